@@ -195,6 +195,9 @@ Java_com_smartcontrolx_SmartControlXService_nativeStartServer(
     // 2. Initialize Video Encoder
     g_encoder = new VideoEncoder(width, height, bitrate, g_network_manager);
     ANativeWindow* window = g_encoder->startEncoder();
+    if (window) {
+        g_network_manager->setVideoEncoder(g_encoder); // Client rate hints go straight to the encoder
+    }
 
     if (!window) {
         ALOGE("Failed to start video encoder or get native window.");
@@ -210,6 +213,7 @@ Java_com_smartcontrolx_SmartControlXService_nativeStartServer(
     jobject surface = ANativeWindow_toSurface(env, window);
     if (!surface) {
         ALOGE("Failed to convert ANativeWindow to Surface.");
+        g_network_manager->setVideoEncoder(nullptr);
         g_encoder->stopEncoder();
         g_network_manager->stopServer();
         delete g_network_manager;
@@ -232,6 +236,9 @@ Java_com_smartcontrolx_SmartControlXService_nativeStopServer(
     ALOGI("nativeStopServer called.");
 
     if (g_encoder) {
+        if (g_network_manager) {
+            g_network_manager->setVideoEncoder(nullptr);
+        }
         g_encoder->stopEncoder();
         delete g_encoder;
         g_encoder = nullptr;
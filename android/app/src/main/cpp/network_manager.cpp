@@ -1,4 +1,5 @@
 #include "network_manager.h"
+#include "video_encoder.h"
 #include <android/log.h>
 #include <sys/socket.h>
 #include <netinet/in.h>
@@ -8,6 +9,8 @@
 #include <cstdlib>
 #include <ctime>
 #include <sstream>
+#include <chrono>
+#include <vector>
 #include <iomanip>
 
 #define LOG_TAG "SmartControlX_Net"
@@ -19,6 +22,42 @@ constexpr int VIDEO_PORT = 8000;
 constexpr int CONTROL_PORT = 8001;
 constexpr int DISCOVERY_PORT = 8002;
 
+// Control protocol (the spec is client/ControlProtocol.py; all integers little-endian)
+// Version 1: fixed records, [1-byte type] [4-byte x] [4-byte y] [4-byte keycode] [4-byte action] = 17 bytes
+// Version 2 adds extended messages: [1-byte type | 0x80] [1-byte message version] [2-byte payload length] [payload]
+// Version 3 adds touch batches
+constexpr int PROTOCOL_VERSION = 3; // Advertised in the pairing message
+constexpr size_t RECORD_SIZE = 17;
+constexpr size_t EXTENDED_HEADER_SIZE = 4;
+constexpr uint8_t EXTENDED_FLAG = 0x80;
+
+// Record types
+constexpr uint8_t EVENT_TYPE_MOUSE = 0x01;
+constexpr uint8_t EVENT_TYPE_KEY = 0x02;
+constexpr uint8_t EVENT_TYPE_TOUCH = 0x03;
+constexpr uint8_t EVENT_TYPE_PING = 0x04;
+constexpr uint8_t EVENT_TYPE_RATE = 0x05;
+constexpr uint8_t EVENT_TYPE_SCROLL = 0x06;
+
+// Extended message types (message version 1)
+constexpr uint8_t EVENT_TYPE_MULTI_TOUCH = 0x81; // [action] [action pointer id] [count], count x [id] [x] [y] [2-byte pressure]
+constexpr uint8_t EVENT_TYPE_TEXT = 0x82; // UTF-8
+constexpr uint8_t EVENT_TYPE_KEY_BATCH = 0x83; // [4-byte keycode] [4-byte action] per key
+// [4-byte time of the first sample, client ms] [2-byte sample interval us] [2-byte sample count] [pointer count],
+// a 1-byte id per pointer, then per sample and pointer [4-byte x] [4-byte y] [2-byte pressure]
+constexpr uint8_t EVENT_TYPE_TOUCH_BATCH = 0x84;
+constexpr size_t MULTI_TOUCH_HEADER_SIZE = 3;
+constexpr size_t POINTER_SIZE = 11;
+constexpr size_t KEY_ENTRY_SIZE = 8;
+constexpr size_t TOUCH_BATCH_HEADER_SIZE = 9;
+constexpr size_t TOUCH_SAMPLE_SIZE = 10;
+
+constexpr int ACTION_MOVE = 2;
+constexpr int ACTION_CANCEL = 3;
+
+// Rate hint flags
+constexpr int RATE_FLAG_KEYFRAME = 0x01;
+
 // Helper function to send data reliably
 static bool sendAll(int socket, const void* data, size_t size) {
     const char* buffer = (const char*)data;
@@ -34,9 +73,31 @@ static bool sendAll(int socket, const void* data, size_t size) {
     return true;
 }
 
+// Reads exactly `size` bytes; returns the recv() result that ended it early (0: closed, < 0: error)
+static ssize_t recvAll(int socket, void* data, size_t size) {
+    ssize_t bytesRead = recv(socket, data, size, MSG_WAITALL);
+    return bytesRead == (ssize_t)size ? bytesRead : (bytesRead > 0 ? -1 : bytesRead);
+}
+
+static int32_t readInt(const uint8_t* data) {
+    int32_t value;
+    memcpy(&value, data, sizeof(value));
+    return value;
+}
+
+static uint16_t readShort(const uint8_t* data) {
+    return data[0] | (data[1] << 8);
+}
+
+// Milliseconds on the clock MotionEvent times use (SystemClock.uptimeMillis(), CLOCK_MONOTONIC)
+static int64_t uptimeMillis() {
+    return std::chrono::duration_cast<std::chrono::milliseconds>(
+        std::chrono::steady_clock::now().time_since_epoch()).count();
+}
+
 NetworkManager::NetworkManager(JNIEnv* env, jobject resultData)
     : mEnv(env), mResultData(resultData), mRunning(false),
-      mVideoSocket(-1), mControlSocket(-1), mVideoListener(-1), mControlListener(-1) {
+      mVideoSocket(-1), mControlSocket(-1), mVideoListener(-1), mControlListener(-1), mEncoder(nullptr) {
     // Detach the JNIEnv from the current thread to avoid issues with new threads
     // The new threads will need to attach to the JVM to use JNI functions.
     // For simplicity in this mock, we'll rely on the fact that we won't be using JNI
@@ -249,14 +310,32 @@ void NetworkManager::controlServerLoop() {
             continue;
         }
         ALOGI("PIN pairing successful.");
+        mTouchClockSynced = false; // A new client, with its own clock
 
-        // 2. Control Loop
-        // Simple fixed-size event protocol: [1-byte type] [4-byte x] [4-byte y] [4-byte keycode] [4-byte action] = 17 bytes
-        constexpr size_t EVENT_SIZE = 17;
-        uint8_t eventBuffer[EVENT_SIZE];
+        // 2. Control Loop: fixed records, and length-prefixed extended messages
+        uint8_t eventBuffer[RECORD_SIZE];
+        std::vector<uint8_t> payload;
 
         while (mRunning) {
-            ssize_t bytesRead = recv(mControlSocket, eventBuffer, EVENT_SIZE, MSG_WAITALL);
+            ssize_t bytesRead = recvAll(mControlSocket, eventBuffer, 1);
+            uint8_t type = eventBuffer[0];
+            if (bytesRead > 0) {
+                // The rest of the record, or of the extended message's header
+                bytesRead = recvAll(mControlSocket, eventBuffer + 1,
+                                    (type & EXTENDED_FLAG ? EXTENDED_HEADER_SIZE : RECORD_SIZE) - 1);
+            }
+            if (bytesRead > 0 && (type & EXTENDED_FLAG)) {
+                uint8_t version = eventBuffer[1];
+                size_t length = eventBuffer[2] | (eventBuffer[3] << 8);
+                payload.resize(length);
+                if (length > 0) {
+                    bytesRead = recvAll(mControlSocket, payload.data(), length);
+                }
+                if (bytesRead > 0) {
+                    handleExtendedMessage(type, version, payload.data(), length);
+                    continue;
+                }
+            }
 
             if (bytesRead == 0) {
                 ALOGI("Control client disconnected gracefully.");
@@ -264,18 +343,30 @@ void NetworkManager::controlServerLoop() {
             } else if (bytesRead < 0) {
                 ALOGE("Error reading control data: %s", strerror(errno));
                 break;
-            } else if (bytesRead == EVENT_SIZE) {
-                // Parse and inject input
-                uint8_t type = eventBuffer[0];
-                int x = *(int*)&eventBuffer[1];
-                int y = *(int*)&eventBuffer[5];
-                int keycode = *(int*)&eventBuffer[9];
-                int action = *(int*)&eventBuffer[13];
-
-                injectInput(type, x, y, keycode, action);
-            } else {
-                ALOGE("Received incomplete control packet: %zd bytes", bytesRead);
             }
+
+            int x = readInt(&eventBuffer[1]);
+            int y = readInt(&eventBuffer[5]);
+            int keycode = readInt(&eventBuffer[9]);
+            int action = readInt(&eventBuffer[13]);
+
+            if (type == EVENT_TYPE_PING) {
+                // Echo pings unchanged so the client can measure the round-trip time
+                sendAll(mControlSocket, eventBuffer, RECORD_SIZE);
+                continue;
+            }
+
+            if (type == EVENT_TYPE_RATE) {
+                // Client rate-control hint: [bitrate kbit/s] [max fps] [flags] [unused]
+                std::lock_guard<std::mutex> lock(mEncoderMutex);
+                if (mEncoder) {
+                    mEncoder->applyRateHint(x * 1000, y, (keycode & RATE_FLAG_KEYFRAME) != 0);
+                }
+                continue;
+            }
+
+            // Mouse, key, touch (keycode: pointer id) and scroll (keycode, action: horizontal, vertical delta)
+            injectInput(type, x, y, keycode, action);
         }
 
         close(mControlSocket);
@@ -285,8 +376,8 @@ void NetworkManager::controlServerLoop() {
 }
 
 bool NetworkManager::performPinPairing(int clientSocket) {
-    // 1. Send PIN to client
-    std::string pinMsg = "PIN:" + mPinCode;
+    // 1. Send PIN (and the control protocol version) to client
+    std::string pinMsg = "PIN:" + mPinCode + ";PROTO:" + std::to_string(PROTOCOL_VERSION);
     if (!sendAll(clientSocket, pinMsg.c_str(), pinMsg.length())) {
         return false;
     }
@@ -308,7 +399,79 @@ bool NetworkManager::performPinPairing(int clientSocket) {
     return mPinCode == receivedPin;
 }
 
-void NetworkManager::injectInput(int type, int x, int y, int keycode, int action) {
+void NetworkManager::setVideoEncoder(VideoEncoder* encoder) {
+    std::lock_guard<std::mutex> lock(mEncoderMutex);
+    mEncoder = encoder;
+}
+
+void NetworkManager::handleExtendedMessage(uint8_t type, uint8_t version, const uint8_t* data, size_t length) {
+    if (version != 1) {
+        ALOGI("Skipping control message 0x%02x version %d (%zu bytes)", type, version, length);
+        return;
+    }
+    switch (type) {
+        case EVENT_TYPE_MULTI_TOUCH: {
+            if (length < MULTI_TOUCH_HEADER_SIZE) break;
+            int action = data[0];
+            int actionPointer = data[1];
+            size_t count = data[2];
+            if (length < MULTI_TOUCH_HEADER_SIZE + count * POINTER_SIZE) break;
+            for (size_t i = 0; i < count; i++) {
+                const uint8_t* pointer = data + MULTI_TOUCH_HEADER_SIZE + i * POINTER_SIZE;
+                int id = pointer[0];
+                // Down/up apply to their own pointer; the others are reported as moved
+                bool own = action == ACTION_MOVE || action == ACTION_CANCEL || id == actionPointer;
+                injectInput(EVENT_TYPE_TOUCH, readInt(pointer + 1), readInt(pointer + 5), id, own ? action : ACTION_MOVE);
+            }
+            break;
+        }
+        case EVENT_TYPE_TOUCH_BATCH: {
+            // Evenly spaced moves. They are injected at once, each carrying the time it was sampled
+            // (mapped onto this clock), so Android's touch resampling spaces them out as drawn.
+            if (length < TOUCH_BATCH_HEADER_SIZE) break;
+            uint32_t timestamp = (uint32_t)readInt(data);
+            uint16_t intervalUs = readShort(data + 4);
+            size_t count = readShort(data + 6);
+            size_t pointers = data[8];
+            if (length < TOUCH_BATCH_HEADER_SIZE + pointers + count * pointers * TOUCH_SAMPLE_SIZE) break;
+            const uint8_t* ids = data + TOUCH_BATCH_HEADER_SIZE;
+            const uint8_t* sample = ids + pointers;
+            int64_t firstTime = touchEventTime(timestamp);
+            for (size_t k = 0; k < count; k++) {
+                int64_t eventTime = firstTime + (int64_t)k * intervalUs / 1000;
+                for (size_t i = 0; i < pointers; i++, sample += TOUCH_SAMPLE_SIZE) {
+                    injectInput(EVENT_TYPE_TOUCH, readInt(sample), readInt(sample + 4), ids[i], ACTION_MOVE, eventTime);
+                }
+            }
+            break;
+        }
+        case EVENT_TYPE_TEXT:
+            ALOGI("Text input: %.*s", (int)length, (const char*)data);
+            break;
+        case EVENT_TYPE_KEY_BATCH:
+            for (size_t offset = 0; offset + KEY_ENTRY_SIZE <= length; offset += KEY_ENTRY_SIZE) {
+                injectInput(EVENT_TYPE_KEY, 0, 0, readInt(data + offset), readInt(data + offset + 4));
+            }
+            break;
+        default:
+            ALOGI("Skipping unknown control message 0x%02x (%zu bytes)", type, length);
+            break;
+    }
+}
+
+int64_t NetworkManager::touchEventTime(uint32_t clientTime) {
+    // The client's clock is offset from this one by the smallest (clock difference + transit)
+    // seen; a batch that took longer to arrive keeps the time it was sampled at
+    int64_t now = uptimeMillis();
+    int32_t lag = (int32_t)((uint32_t)now - clientTime); // Client times wrap at 2^32 ms
+    if (!mTouchClockSynced || lag < mTouchMinLag) {
+        mTouchMinLag = lag;
+        mTouchClockSynced = true;
+    }
+    return now - (lag - mTouchMinLag);
+}
+
+void NetworkManager::injectInput(int type, int x, int y, int keycode, int action, int64_t eventTime) {
     // This is the critical part that requires JNI to call back into the Java/Kotlin
     // layer to use the Android InputManager, as it's not directly accessible from NDK.
     // For a complete, compilable example, we will just log the event.
@@ -316,7 +479,8 @@ void NetworkManager::injectInput(int type, int x, int y, int keycode, int action
     // the appropriate Java method to call.
 
     // Placeholder for actual input injection logic
-    ALOGI("Input Event: Type=%d, X=%d, Y=%d, KeyCode=%d, Action=%d", type, x, y, keycode, action);
+    ALOGI("Input Event: Type=%d, X=%d, Y=%d, KeyCode=%d, Action=%d, Time=%lld", type, x, y, keycode, action,
+          (long long)(eventTime >= 0 ? eventTime : uptimeMillis()));
 
     // In a real application, you would:
     // 1. Get JavaVM* from JNI_OnLoad
@@ -4,8 +4,11 @@
 #include <jni.h>
 #include <thread>
 #include <atomic>
+#include <mutex>
 #include <string>
 
+class VideoEncoder; // Forward declaration
+
 class NetworkManager {
 public:
     NetworkManager(JNIEnv* env, jobject resultData);
@@ -14,6 +17,8 @@ public:
     bool startServer();
     void stopServer();
     void sendVideoFrame(const uint8_t* data, size_t size);
+    // Receives the client's rate hints (nullptr to detach; returns once no hint is being applied, so the encoder can be deleted)
+    void setVideoEncoder(VideoEncoder* encoder);
 
 private:
     JNIEnv* mEnv;
@@ -30,6 +35,11 @@ private:
     int mControlListener;
 
     std::string mPinCode;
+    std::mutex mEncoderMutex; // Held while a rate hint is applied, so the encoder is not detached and freed meanwhile
+    VideoEncoder* mEncoder;
+
+    bool mTouchClockSynced = false; // Touch batch times of the current client
+    int32_t mTouchMinLag = 0;
 
     void videoServerLoop();
     void controlServerLoop();
@@ -37,7 +47,9 @@ private:
     void handleClientConnection(int clientSocket, bool isVideoChannel);
     std::string generatePin();
     bool performPinPairing(int clientSocket);
-    void injectInput(int type, int x, int y, int keycode, int action);
+    void handleExtendedMessage(uint8_t type, uint8_t version, const uint8_t* data, size_t length);
+    int64_t touchEventTime(uint32_t clientTime); // Client sample time -> uptime ms
+    void injectInput(int type, int x, int y, int keycode, int action, int64_t eventTime = -1); // eventTime: uptime ms, -1 now
 };
 
 #endif //SMARTCONTROLX_NETWORK_MANAGER_H
@@ -2,6 +2,7 @@
 #include "network_manager.h"
 #include <android/log.h>
 #include <unistd.h>
+#include <algorithm>
 
 #define LOG_TAG "SmartControlX_Encoder"
 #define ALOGE(...) __android_log_print(ANDROID_LOG_ERROR, LOG_TAG, __VA_ARGS__)
@@ -11,7 +12,7 @@
 constexpr long TIMEOUT_US = 10000; // 10ms
 
 VideoEncoder::VideoEncoder(int width, int height, int bitrate, NetworkManager* networkManager)
-    : mWidth(width), mHeight(height), mBitrate(bitrate), mNetworkManager(networkManager),
+    : mWidth(width), mHeight(height), mBitrate(bitrate), mMaxBitrate(bitrate), mNetworkManager(networkManager),
       mEncoder(nullptr), mFormat(nullptr), mRunning(false) {
     ALOGI("VideoEncoder initialized: %dx%d @ %d bps", mWidth, mHeight, mBitrate);
 }
@@ -102,6 +103,44 @@ void VideoEncoder::stopEncoder() {
     ALOGI("Encoder stopped.");
 }
 
+void VideoEncoder::applyRateHint(int bitrate, int maxFps, bool requestKeyFrame) {
+    // Called from the control thread; MediaCodec parameters may be changed while encoding (API 26+)
+    if (!mEncoder || !mRunning) return;
+
+    if (bitrate > 0) {
+        bitrate = std::min(bitrate, mMaxBitrate);
+    }
+    AMediaFormat* params = AMediaFormat_new();
+    bool changed = false;
+    if (bitrate > 0 && bitrate != mBitrate) {
+        AMediaFormat_setInt32(params, "video-bitrate", bitrate);
+        mBitrate = bitrate;
+        changed = true;
+    }
+    if (maxFps > 0) {
+        // Honoured by encoders that support a runtime frame rate cap; ignored by the others
+        AMediaFormat_setFloat(params, "max-fps-to-encoder", (float)maxFps);
+        changed = true;
+    }
+    if (requestKeyFrame) {
+        AMediaFormat_setInt32(params, "request-sync", 0);
+        changed = true;
+    }
+    if (changed) {
+        if (__builtin_available(android 26, *)) {
+            media_status_t status = AMediaCodec_setParameters(mEncoder, params);
+            if (status != AMEDIA_OK) {
+                ALOGE("Failed to apply rate hint: %d", status);
+            } else {
+                ALOGI("Rate hint: %d bps, max %d fps%s", mBitrate, maxFps, requestKeyFrame ? ", keyframe" : "");
+            }
+        } else {
+            ALOGI("Rate hints need Android 8.0 or later; ignored.");
+        }
+    }
+    AMediaFormat_delete(params);
+}
+
 void VideoEncoder::encodingLoop() {
     AMediaCodecBufferInfo info;
     ssize_t status;
@@ -16,11 +16,13 @@ public:
 
     ANativeWindow* startEncoder();
     void stopEncoder();
+    void applyRateHint(int bitrate, int maxFps, bool requestKeyFrame);
 
 private:
     int mWidth;
     int mHeight;
     int mBitrate;
+    int mMaxBitrate; // Bitrate the server was started with; client hints never exceed it
     NetworkManager* mNetworkManager;
 
     AMediaCodec* mEncoder;
@@ -1,72 +1,313 @@
+import asyncio
+import ipaddress
+import json
+import os
 import socket
+import struct
+import sys
 import threading
 import time
 from PyQt6.QtCore import QObject, pyqtSignal
 
+try:
+    import psutil # Optional: interface addresses on every platform
+except ImportError:
+    psutil = None
+
+try:
+    import fcntl # Unix only: interface addresses through ioctl when psutil is missing
+except ImportError:
+    fcntl = None
+
+# Must match the server's discovery loop (network_manager.cpp)
+DISCOVERY_REQUEST = b'SMARTCONTROLX_DISCOVERY_REQUEST'
+DISCOVERY_RESPONSE = b'SMARTCONTROLX_DISCOVERY_RESPONSE'
+
+# Responders are collected for this long (s); probes are repeated within it in case UDP packets get lost
+DEFAULT_WINDOW = 1.5
+PROBE_INTERVAL = 0.3
+
+# Unicast sweeps larger than this are refused (a /20); sweep packets go out in bursts of SWEEP_BURST
+MAX_SWEEP_HOSTS = 4096
+SWEEP_BURST = 64
+
+# Cached devices older than this are ignored (s)
+DEFAULT_CACHE_TTL = 7 * 24 * 3600
+
+# Linux ioctl requests for interface addresses
+SIOCGIFADDR = 0x8915
+SIOCGIFNETMASK = 0x891b
+
+
+class DiscoveredDevice:
+    """A server that answered a discovery probe."""
+    __slots__ = ('ip', 'rtt_ms', 'last_seen', 'source')
+
+    def __init__(self, ip, rtt_ms, last_seen, source):
+        self.ip = ip
+        self.rtt_ms = rtt_ms # From the probe round it answered
+        self.last_seen = last_seen # time.time()
+        self.source = source # Broadcast address or 'sweep' / 'cache' it was found through
+
+    def __repr__(self):
+        return f"DiscoveredDevice({self.ip}, {self.rtt_ms:.1f} ms via {self.source})"
+
+
+def _ioctl_address(sock, request, name):
+    packed = struct.pack('256s', name.encode()[:15])
+    return socket.inet_ntoa(fcntl.ioctl(sock.fileno(), request, packed)[20:24])
+
+
+def local_networks():
+    """Returns the IPv4 networks of the local interfaces (loopback excluded)."""
+    addresses = []
+    if psutil:
+        for entries in psutil.net_if_addrs().values():
+            addresses += [(entry.address, entry.netmask) for entry in entries
+                          if entry.family == socket.AF_INET and entry.netmask]
+    elif fcntl and sys.platform.startswith('linux'):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for _, name in socket.if_nameindex():
+                try:
+                    addresses.append((_ioctl_address(sock, SIOCGIFADDR, name),
+                                      _ioctl_address(sock, SIOCGIFNETMASK, name)))
+                except OSError:
+                    pass # Interface without an IPv4 address
+    else:
+        # Address of the default route's interface, assumed to be a /24
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                sock.connect(('192.0.2.1', 9)) # No packet is sent for a UDP connect
+                addresses.append((sock.getsockname()[0], '255.255.255.0'))
+        except OSError:
+            pass
+
+    networks = []
+    for address, netmask in addresses:
+        network = ipaddress.ip_interface(f"{address}/{netmask}").network
+        if not network.is_loopback and not network.is_link_local and network not in networks:
+            networks.append(network)
+    return networks
+
+
+def sweep_targets(cidrs):
+    """Expands CIDR ranges ("10.0.8.0/24") into the host addresses to probe by unicast."""
+    hosts = []
+    for cidr in cidrs:
+        network = ipaddress.ip_network(cidr, strict=False)
+        if network.num_addresses > MAX_SWEEP_HOSTS:
+            raise ValueError(f"Sweep range {cidr} is larger than {MAX_SWEEP_HOSTS} addresses")
+        hosts += [str(host) for host in (network.hosts() if network.num_addresses > 1 else [network.network_address])]
+    if len(hosts) > MAX_SWEEP_HOSTS:
+        raise ValueError(f"Sweep ranges add up to more than {MAX_SWEEP_HOSTS} addresses")
+    return hosts
+
+
+class _DiscoveryProtocol(asyncio.DatagramProtocol):
+    """Collects discovery responses on the socket the probes were sent from."""
+
+    def __init__(self, on_response):
+        self.on_response = on_response
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if data.rstrip(b'\0\r\n') == DISCOVERY_RESPONSE:
+            self.on_response(addr[0], time.perf_counter())
+
+    def error_received(self, exc):
+        pass # ICMP unreachable from sweep targets without a server
+
+
+async def discover(port, window=DEFAULT_WINDOW, sweep=(), broadcast=True, on_device=None, stop_event=None):
+    """Probes all local broadcast addresses (and the `sweep` CIDR ranges) and collects every responder.
+
+    Returns DiscoveredDevice objects sorted by RTT once `window` seconds have passed (or
+    `stop_event`, an asyncio.Event, is set). `on_device(device)` is called as each new
+    responder arrives.
+    """
+    loop = asyncio.get_running_loop()
+    networks = local_networks() if broadcast else []
+    targets = [str(network.broadcast_address) for network in networks if network.prefixlen < 31]
+    if broadcast:
+        targets.append('255.255.255.255') # Limited broadcast, in case interface enumeration missed one
+    hosts = sweep_targets(sweep)
+
+    sent_at = {} # target -> perf_counter() of its latest probe
+    devices = {}
+
+    def on_response(ip, received):
+        if ip in devices:
+            return
+        address = ipaddress.ip_address(ip)
+        if ip in sent_at:
+            source, sent = 'sweep', sent_at[ip]
+        else:
+            source = next((str(network.broadcast_address) for network in networks if address in network),
+                          '255.255.255.255')
+            sent = sent_at.get(source, sent_at.get('255.255.255.255'))
+        rtt_ms = (received - sent) * 1000 if sent else 0.0
+        device = devices[ip] = DiscoveredDevice(ip, rtt_ms, time.time(), source)
+        if on_device:
+            on_device(device)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    sock.bind(('', 0))
+    transport, _ = await loop.create_datagram_endpoint(lambda: _DiscoveryProtocol(on_response), sock=sock)
+
+    def probe(target):
+        sent_at[target] = time.perf_counter()
+        try:
+            transport.sendto(DISCOVERY_REQUEST, (target, port))
+        except OSError:
+            pass # E.g. no route to one of several networks
+
+    async def sweep_hosts():
+        # Unicast probes in bursts so a large range does not overflow the socket buffer
+        for start in range(0, len(hosts), SWEEP_BURST):
+            for host in hosts[start:start + SWEEP_BURST]:
+                if host not in devices:
+                    probe(host)
+            await asyncio.sleep(0.005)
+
+    deadline = loop.time() + window
+    try:
+        while loop.time() < deadline and not (stop_event and stop_event.is_set()):
+            for target in targets:
+                probe(target)
+            await sweep_hosts()
+            remaining = min(PROBE_INTERVAL, deadline - loop.time())
+            if remaining > 0:
+                if stop_event:
+                    try:
+                        await asyncio.wait_for(stop_event.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await asyncio.sleep(remaining)
+    finally:
+        transport.close()
+    return sorted(devices.values(), key=lambda device: device.rtt_ms)
+
+
+class DiscoveryCache:
+    """Devices found by earlier discoveries, kept on disk (JSON) for `ttl` seconds."""
+
+    def __init__(self, path, ttl=DEFAULT_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.entries = {} # ip -> {"rtt_ms": ..., "last_seen": ..., "source": ...}
+        self.last_device = None # Last device the client connected to
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.entries = data.get("devices", {})
+        self.last_device = data.get("last_device")
+
+    def save(self):
+        """Writes the cache atomically (a crash cannot leave a truncated file)."""
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump({"last_device": self.last_device, "devices": self.entries}, f, indent=2)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Discovery cache not saved: {e}")
+
+    def devices(self):
+        """Unexpired devices, most recently seen first."""
+        now = time.time()
+        devices = [DiscoveredDevice(ip, entry["rtt_ms"], entry["last_seen"], 'cache')
+                   for ip, entry in self.entries.items() if now - entry["last_seen"] < self.ttl]
+        return sorted(devices, key=lambda device: -device.last_seen)
+
+    def get_last_device(self):
+        """The last connected device, if it is still within the TTL."""
+        entry = self.entries.get(self.last_device)
+        if entry and time.time() - entry["last_seen"] < self.ttl:
+            return self.last_device
+        return None
+
+    def update(self, devices):
+        for device in devices:
+            self.entries[device.ip] = {"rtt_ms": device.rtt_ms, "last_seen": device.last_seen,
+                                       "source": device.source}
+        # Drop expired entries so the file does not grow forever
+        now = time.time()
+        self.entries = {ip: entry for ip, entry in self.entries.items() if now - entry["last_seen"] < self.ttl}
+
+    def remember_connection(self, ip):
+        self.last_device = ip
+        entry = self.entries.setdefault(ip, {"rtt_ms": 0.0, "source": "manual"})
+        entry["last_seen"] = time.time()
+
+
 class AutoDiscovery(QObject):
-    """Uses UDP broadcast to discover the Android server's IP address."""
-    device_found = pyqtSignal(str)
+    """Runs a discovery window on the client runtime (or a thread of its own) and reports the responders to the GUI."""
+    device_found = pyqtSignal(str) # Each new responder's IP, as it answers
+    discovery_finished = pyqtSignal(list) # All DiscoveredDevices of the window, sorted by RTT
 
-    def __init__(self, port, parent=None):
+    def __init__(self, port, parent=None, window=DEFAULT_WINDOW, sweep=(), runtime=None):
         super().__init__(parent)
         self.port = port
+        self.window = window
+        self.sweep = sweep # CIDR ranges to probe by unicast (VLANs broadcasts do not reach)
+        self.runtime = runtime # Runtime.ClientRuntime to run on; None: a thread with its own loop
         self.is_running = False
         self.thread = None
+        self.future = None
+        self.loop = None
+        self.stop_event = None
 
     def start(self):
         self.is_running = True
-        self.thread = threading.Thread(target=self._run_discovery)
-        self.thread.start()
+        if self.runtime:
+            self.future = self.runtime.submit(self._discover())
+        else:
+            self.thread = threading.Thread(target=self._run_discovery, name="SCX-Discovery", daemon=True)
+            self.thread.start()
 
     def stop(self):
+        """Ends the discovery window early; responders found so far are still reported."""
         self.is_running = False
-        if self.thread and self.thread.is_alive():
-            # Send a dummy packet to unblock the socket if it's blocked on recvfrom
+        if self.loop and self.stop_event:
             try:
-                s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                s.sendto(b'STOP', ('127.0.0.1', self.port))
-                s.close()
-            except:
-                pass
+                self.loop.call_soon_threadsafe(self.stop_event.set)
+            except RuntimeError:
+                pass # Loop already closed
+        if self.runtime:
+            self.runtime.wait(self.future)
+        elif self.thread and self.thread is not threading.current_thread():
             self.thread.join()
 
     def _run_discovery(self):
-        # 1. Listener Socket (for server response)
-        listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        listener.bind(('', self.port))
-        listener.settimeout(1) # Timeout for non-blocking check
-
-        # 2. Sender Socket (for broadcast)
-        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sender.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        sender.settimeout(1)
-
-        message = b'SMARTCONTROLX_DISCOVERY_REQUEST'
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self._discover())
+        finally:
+            loop.close()
 
-        while self.is_running:
-            try:
-                # Broadcast the request
-                sender.sendto(message, ('<broadcast>', self.port))
-
-                # Wait for a response
-                try:
-                    data, addr = listener.recvfrom(1024)
-                    if data.decode() == 'SMARTCONTROLX_DISCOVERY_RESPONSE':
-                        self.device_found.emit(addr[0])
-                        self.is_running = False # Stop after finding one
-                        break
-                except socket.timeout:
-                    pass # Continue broadcasting
-                except Exception as e:
-                    print(f"Discovery error: {e}")
-                    break
-
-                time.sleep(1) # Wait a second before next broadcast
-
-            except Exception as e:
-                print(f"Broadcast error: {e}")
-                break
-
-        listener.close()
-        sender.close()
+    async def _discover(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        if not self.is_running: # Stopped before the task started
+            self.stop_event.set()
+        devices = []
+        try:
+            devices = await discover(self.port, self.window, self.sweep,
+                                     on_device=lambda device: self.device_found.emit(device.ip),
+                                     stop_event=self.stop_event)
+        except Exception as e:
+            print(f"Discovery error: {e}")
+        finally:
+            self.is_running = False
+        self.discovery_finished.emit(devices)
@@ -0,0 +1,349 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+import av
+
+# Headless: must be set before any Qt module is imported
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt6.QtCore import QObject, pyqtSignal
+from PyQt6.QtWidgets import QApplication
+
+import ControlProtocol as proto
+from ControlSender import ControlSender
+from Decoder import DEFAULT_PROFILE, PROFILES
+from Metrics import PipelineMetrics, format_prometheus
+from MockServer import PATTERNS, MockServer, generate_h264, load_h264, split_nal_units
+from StreamCapture import CaptureReader
+from SmartControlX import VideoWidget
+from StreamReceiver import StreamReceiver
+from Reconnect import STATE_CONNECTED
+from TouchInput import pinch, swipe
+
+try:
+    import resource # Unix only
+except ImportError:
+    resource = None
+
+# The pipeline counts as drained once nothing has been decoded or painted for this long (s)
+SETTLE_TIME = 0.25
+
+# Scripted gestures (--gestures) reach the sender in bursts this far apart, like input a GUI thread
+# hands over once per frame (s), from an input device reporting at GESTURE_INPUT_RATE (Hz)
+GESTURE_BURST = 0.012
+GESTURE_INPUT_RATE = 240
+
+# Default matrix: (width, height, bitrate in Mbit/s)
+DEFAULT_SCENARIOS = [
+    (1280, 720, 4),
+    (1920, 1080, 8),
+    (2560, 1440, 16),
+]
+
+
+class BenchmarkSignals(QObject):
+    """Stands in for MainWindow's cross-thread signals."""
+    frame_received = pyqtSignal(object)
+    status_updated = pyqtSignal(str)
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def gesture_script(width, height):
+    """Two swipes and a pinch on a width x height screen: [(time offset, TouchSampler points)]."""
+    gestures = [
+        (0.2, swipe(round(width * 0.2), height // 2, round(width * 0.8), height // 2, 0.3, GESTURE_INPUT_RATE)),
+        (0.8, swipe(width // 2, round(height * 0.8), width // 2, round(height * 0.2), 0.3, GESTURE_INPUT_RATE)),
+        (1.4, pinch(width // 2, height // 2, width * 0.2, width * 0.6, 0.5, GESTURE_INPUT_RATE)),
+    ]
+    return [(start + t, points) for start, events in gestures for t, points in events]
+
+
+def play_gestures(sender, events, timeout=10):
+    """Feeds scripted gestures to the sender once it is connected, in bursts, with their real times."""
+    deadline = time.perf_counter() + timeout
+    while sender.state != STATE_CONNECTED:
+        if time.perf_counter() > deadline:
+            return
+        time.sleep(0.01)
+    base = time.perf_counter()
+    index = 0
+    while index < len(events):
+        time.sleep(GESTURE_BURST)
+        elapsed = time.perf_counter() - base
+        while index < len(events) and events[index][0] <= elapsed:
+            t, points = events[index]
+            sender.send_touch_input(base + t, points)
+            index += 1
+
+
+def gesture_stats(server, events):
+    """What the mock server received of the scripted gestures: messages, bytes and sample spacing."""
+    messages = 0
+    size = 0
+    times = []
+    for kind, fields in server.control_log:
+        if kind == proto.TYPE_MULTI_TOUCH:
+            messages += 1
+            size += proto.HEADER_SIZE + proto.MULTI_TOUCH.size + len(fields[2]) * proto.POINTER.size
+        elif kind == proto.TYPE_TOUCH_BATCH:
+            timestamp, interval, ids, samples = fields
+            messages += 1
+            size += (proto.HEADER_SIZE + proto.TOUCH_BATCH.size + len(ids)
+                     + len(samples) * len(ids) * proto.TOUCH_SAMPLE.size)
+            times.extend(timestamp + k * interval / 1000.0 for k in range(len(samples)))
+    gaps = [b - a for a, b in zip(times, times[1:]) if b - a < 100] # Not across gestures
+    mean = sum(gaps) / len(gaps) if gaps else 0.0
+    spread = (sum((gap - mean) ** 2 for gap in gaps) / len(gaps)) ** 0.5 if gaps else 0.0
+    return {"events": sum(len(points) for _, points in events), "messages": messages, "bytes": size,
+            "samples": len(times), "sample_interval_ms": mean, "sample_interval_sd_ms": spread}
+
+
+def check_prometheus(snapshot):
+    """Problems in the Prometheus exposition of a snapshot: stats that are not numbers, samples that do not parse."""
+    problems = [f"gauge {name} is {value!r}, not a number" for name, value in snapshot["gauges"].items()
+                if isinstance(value, bool) or not isinstance(value, (int, float))]
+    for line in format_prometheus(snapshot).splitlines():
+        if line and not line.startswith("#"):
+            try:
+                float(line.rsplit(" ", 1)[1])
+            except (IndexError, ValueError):
+                problems.append(f"sample does not parse: {line}")
+    return problems
+
+
+def run_scenario(app, units, label, fps=60, realtime=False, pipelined=True, display_size=(960, 540),
+                 ping_interval=0.05, timeout=120, size=(None, None), decode_backend='thread', capture=None,
+                 frame_diff=False, decoder='auto', decoder_profile=DEFAULT_PROFILE, decoder_threads=0,
+                 pacing_buffer=None, jitter=0.0, gestures=False):
+    """Streams `units` (or replays `capture`) from a local mock server into StreamReceiver/ControlSender
+    and measures them."""
+    server = MockServer(units, video_port=0, control_port=0, fps=fps, realtime=realtime,
+                        hold_open=True, width=size[0], height=size[1], capture=capture,
+                        jitter=jitter).start_in_thread()
+    signals = BenchmarkSignals()
+    metrics = PipelineMetrics(window=100000)
+
+    widget = VideoWidget()
+    widget.resize(*display_size)
+    widget.metrics = metrics
+    widget.show()
+    signals.frame_received.connect(widget.setImage)
+
+    receiver = StreamReceiver("127.0.0.1", server.video_port, signals.frame_received, signals.status_updated,
+                              pipelined=pipelined, metrics=metrics, decode_backend=decode_backend,
+                              frame_diff=frame_diff, decoder=decoder, decoder_profile=decoder_profile,
+                              decoder_threads=decoder_threads, frame_pacing=pacing_buffer is not None,
+                              pacing_buffer_frames=pacing_buffer or 0,
+                              backpressure=not realtime) # At max speed: decode everything, as fast as it goes
+    receiver.set_refresh_rate(widget.screen().refreshRate())
+    receiver.set_display_size(*widget.physicalSize())
+    sender = ControlSender("127.0.0.1", server.control_port, signals.status_updated, ping_interval=ping_interval)
+
+    receiver_thread = threading.Thread(target=receiver.run, name="SCX-BenchVideo")
+    gesture_events = gesture_script(*(size if size[0] else (1280, 720))) if gestures else []
+    gesture_thread = threading.Thread(target=play_gestures, args=(sender, gesture_events),
+                                      name="SCX-BenchGestures", daemon=True)
+    sender_thread = threading.Thread(target=sender.run, name="SCX-BenchControl", daemon=True)
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    sender_thread.start()
+    receiver_thread.start()
+    if gestures:
+        gesture_thread.start()
+    # Keep the GUI side live so frames are really painted, until the stream is sent and the pipeline drained
+    deadline = wall_start + timeout
+    progress = None
+    last_progress = wall_end = cpu_end = time.perf_counter()
+    # Frames dropped until the pipeline first caught up: start-up catch-up, e.g. on pictures sent while a decoder process spawned
+    dropped_at_start = None
+    while receiver_thread.is_alive() and time.perf_counter() < deadline:
+        app.processEvents()
+        now = time.perf_counter()
+        current = (metrics.counters["frames_decoded"], metrics.counters["frames_painted"])
+        if dropped_at_start is None and current[1] and not receiver.picture_queue.qsize():
+            dropped_at_start = receiver.get_pipeline_stats()["frames_dropped"]
+        if current != progress:
+            progress, last_progress = current, now
+            wall_end, cpu_end = now, time.process_time()
+        elif (server.video_finished.is_set() and now - last_progress > SETTLE_TIME
+              and not receiver.picture_queue.qsize()):
+            break
+        time.sleep(0.001)
+    wall = wall_end - wall_start
+    cpu = cpu_end - cpu_start
+
+    if gestures:
+        gesture_thread.join(timeout=10) # Short script; let it finish even if the stream ended first
+        time.sleep(0.1)
+    receiver.stop()
+    sender.stop()
+    receiver_thread.join(timeout=5)
+    server.stop_thread()
+
+    snapshot = metrics.snapshot(receiver.get_pipeline_stats())
+    counters = snapshot["counters"]
+    widget.close()
+    return {
+        "scenario": label,
+        "pipelined": pipelined,
+        "decode_backend": decode_backend,
+        "frame_diff": frame_diff,
+        "pacing_buffer": pacing_buffer,
+        "decoder": receiver.decoder_label or decoder,
+        "decoder_profile": decoder_profile,
+        "realtime": realtime,
+        "jitter_ms": jitter * 1000.0,
+        "units": server.units_sent,
+        "wall_s": wall,
+        "throughput_mbps": counters["bytes_received"] * 8 / 1e6 / wall,
+        "nals_per_s": counters["nals_received"] / wall,
+        "decode_fps": counters["frames_decoded"] / wall,
+        "paint_fps": counters["frames_painted"] / wall,
+        "cpu_percent": 100.0 * cpu / wall,
+        "peak_rss_mb": _peak_rss_mb(),
+        "frame_latency_ms": snapshot["stages"],
+        "rtt_ms": sender.get_latency_stats(),
+        "pipeline": snapshot["gauges"],
+        "steady_frames_dropped": snapshot["gauges"]["frames_dropped"] - (dropped_at_start or 0),
+        "prometheus_problems": check_prometheus(snapshot),
+        "gestures": gesture_stats(server, gesture_events) if gestures else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless SmartControlX client benchmark against a local mock server.")
+    parser.add_argument("--input", help="Benchmark a recorded stream instead of the generated matrix")
+    parser.add_argument("--capture", help="Replay a video channel capture (first connection) instead; "
+                                          "--realtime keeps its original receive timing")
+    parser.add_argument("--scenario", action="append", metavar="WxH@MBPS",
+                        help="Generated scenario, e.g. 1920x1080@8 (repeatable; default: 720p/1080p/1440p)")
+    parser.add_argument("--fps", type=int, default=60)
+    parser.add_argument("--seconds", type=float, default=5, help="Length of each generated stream")
+    parser.add_argument("--realtime", action="store_true", help="Pace the stream at --fps instead of max speed")
+    parser.add_argument("--jitter-ms", type=float, default=0,
+                        help="With --realtime: send each picture up to this much late (bursty delivery)")
+    parser.add_argument("--split-nals", action="store_true", help="Send each NAL unit separately")
+    parser.add_argument("--mode", choices=("pipelined", "inline", "both"), default="both")
+    parser.add_argument("--backend", choices=("thread", "process"), default="thread",
+                        help="Decode in this process or in a worker process")
+    parser.add_argument("--pattern", choices=PATTERNS, default="moving", help="Generated stream content")
+    parser.add_argument("--frame-diff", action="store_true",
+                        help="Skip conversion and repaint of unchanged frames (frame_diff in settings.json)")
+    parser.add_argument("--pacing-buffer", type=int, metavar="FRAMES",
+                        help="Pace frames to the display refresh with this jitter buffer depth (0: lowest latency)")
+    parser.add_argument("--decoder", default="auto",
+                        help="'auto', 'software', a hardware device type or an FFmpeg decoder name")
+    parser.add_argument("--decoder-profile", choices=tuple(PROFILES), default=DEFAULT_PROFILE)
+    parser.add_argument("--decoder-threads", type=int, default=0, help="Decoder threads (0: FFmpeg picks)")
+    parser.add_argument("--gestures", action="store_true",
+                        help="Also play scripted swipes and pinches on the control channel")
+    parser.add_argument("--output", default="bench_results.json", help="Machine-readable results file")
+    args = parser.parse_args()
+
+    if args.scenario:
+        scenarios = []
+        for spec in args.scenario:
+            size, bitrate = spec.split("@")
+            width, height = (int(v) for v in size.lower().split("x"))
+            scenarios.append((width, height, float(bitrate)))
+    else:
+        scenarios = DEFAULT_SCENARIOS
+    modes = {"pipelined": [True], "inline": [False], "both": [True, False]}[args.mode]
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    results = []
+
+    streams = []
+    capture = None
+    if args.capture:
+        try:
+            capture = CaptureReader(args.capture)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        if not capture.connections:
+            parser.error(f"{args.capture} contains no video data")
+        streams.append((os.path.basename(args.capture), (None, None), []))
+    elif args.input:
+        with av.open(args.input) as container:
+            size = (container.streams.video[0].width, container.streams.video[0].height)
+        streams.append((os.path.basename(args.input), size, load_h264(args.input)))
+    else:
+        for width, height, bitrate in scenarios:
+            print(f"Generating {width}x{height} @ {bitrate:g} Mbit/s...")
+            streams.append((f"{width}x{height}@{bitrate:g}", (width, height),
+                            generate_h264(width, height, args.fps, bitrate, args.seconds, pattern=args.pattern)))
+
+    for label, size, units in streams:
+        if args.split_nals:
+            units = split_nal_units(units)
+        for pipelined in modes:
+            result = run_scenario(app, units, label, fps=args.fps, realtime=args.realtime, pipelined=pipelined,
+                                  size=size, decode_backend=args.backend, capture=capture,
+                                  frame_diff=args.frame_diff, decoder=args.decoder,
+                                  decoder_profile=args.decoder_profile, decoder_threads=args.decoder_threads,
+                                  pacing_buffer=args.pacing_buffer, jitter=args.jitter_ms / 1000.0,
+                                  gestures=args.gestures)
+            results.append(result)
+            total = result["frame_latency_ms"]["total"]
+            pipeline = result["pipeline"]
+            static = ""
+            if args.frame_diff and pipeline.get("frames_emitted"):
+                decoded = pipeline["frames_emitted"] + pipeline["frames_unchanged"]
+                static = f" unchanged {pipeline['frames_unchanged'] / decoded * 100:.0f}%"
+            if args.pacing_buffer is not None:
+                static += f" late {pipeline['frames_late']} unseen {pipeline['frames_dropped']}"
+            if pipeline["pictures_dropped"]:
+                static += f" dropped {pipeline['pictures_dropped']}"
+            print(f"{label:>18} {'pipelined' if pipelined else 'inline':>9}: "
+                  f"{result['decode_fps']:6.1f} dec/s {result['paint_fps']:6.1f} paint/s "
+                  f"{result['throughput_mbps']:6.1f} Mbit/s CPU {result['cpu_percent']:5.1f}% "
+                  f"latency p50/p95/p99 {total['p50']:.1f}/{total['p95']:.1f}/{total['p99']:.1f} ms "
+                  f"RTT p50 {result['rtt_ms']['p50']:.2f} ms{static}")
+            received = pipeline["pictures_received"]
+            if received and pipeline["pictures_dropped"] + pipeline["pictures_skipped"] > received / 2:
+                print(f"{'':>18} warning: most pictures were dropped before decoding; "
+                      f"the rates above are not decoder throughput")
+            if args.realtime and not args.jitter_ms and args.pacing_buffer is None:
+                # Once caught up, a steady stream the machine keeps up with shows (nearly) every frame; network bursts of
+                # two pictures at once may still cost one
+                steady = result["steady_frames_dropped"]
+                if steady > pipeline["frames_emitted"] / 20:
+                    print(f"{'':>18} warning: {steady} decoded frames were never shown at a steady frame rate")
+            for problem in result["prometheus_problems"]:
+                print(f"{'':>18} error: Prometheus exposition: {problem}")
+            if args.gestures:
+                touch = result["gestures"]
+                print(f"{'':>18} gestures: {touch['events']} pointer events -> {touch['messages']} messages "
+                      f"({touch['bytes']} bytes), {touch['samples']} samples every "
+                      f"{touch['sample_interval_ms']:.2f} ms (sd {touch['sample_interval_sd_ms']:.2f} ms)")
+
+    report = {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "fps": args.fps,
+        "realtime": args.realtime,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    if any(result["prometheus_problems"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
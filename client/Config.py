@@ -0,0 +1,111 @@
+import json
+
+DEFAULT_SETTINGS_FILE = "settings.json"
+
+# Allowed values of the enumerated settings (kept here so validating them imports nothing heavy;
+# they mirror FrameConverter.PIXEL_FORMATS / INTERPOLATIONS, StreamReceiver.DECODE_BACKENDS and Decoder.PROFILES)
+PIXEL_FORMATS = ('rgb24', 'bgra')
+SCALING_QUALITIES = ('fast', 'smooth')
+DECODE_BACKENDS = ('thread', 'process')
+DECODER_PROFILES = ('low_latency', 'throughput')
+RENDERERS = ('qpainter', 'opengl')
+VIDEO_CODECS = ('h264',)
+MIN_TOUCH_SAMPLE_RATE = 16 # TouchInput.MIN_SAMPLE_RATE
+
+# name: (type, default, allowed values or None). Numbers must be >= 0.
+FIELDS = {
+    "default_ip": (str, "192.168.1.1", None),
+    "default_port": (int, 8000, None),
+    "control_port": (int, 8001, None),
+    "discovery_port": (int, 8002, None),
+    "discovery_window_s": (float, 1.5, None),
+    "discovery_sweep": (list, [], None), # CIDR ranges probed by unicast
+    "discovery_cache_file": (str, "discovery_cache.json", None),
+    "discovery_cache_ttl_s": (float, 7 * 24 * 3600, None),
+    "connect_last_device": (bool, True, None),
+    "target_fps": (int, 30, None),
+    "target_bitrate_mbps": (float, 5, None),
+    "video_codec": (str, "h264", VIDEO_CODECS),
+    "rate_policy": (str, "aimd", None), # 'off', a RateControl.RATE_POLICIES name or "module:Class"
+    "decode_backend": (str, "thread", DECODE_BACKENDS),
+    "decoder": (str, "auto", None), # 'auto', 'software', a hardware device type or an FFmpeg decoder name
+    "decoder_profile": (str, "low_latency", DECODER_PROFILES),
+    "decoder_threads": (int, 0, None), # 0: FFmpeg picks
+    "decoder_skip_loop_filter": (bool, False, None),
+    "frame_diff": (bool, False, None), # Skip conversion/repaint of unchanged frames (FrameDiff.py)
+    "frame_pacing": (bool, True, None), # At most one frame per display refresh, adaptive jitter buffer (FramePacing.py)
+    "pacing_buffer_frames": (int, 2, None), # Most frames held back to smooth bursts (0: lowest latency)
+    "frame_pixel_format": (str, "rgb24", PIXEL_FORMATS),
+    "scaling_quality": (str, "smooth", SCALING_QUALITIES),
+    "renderer": (str, "qpainter", RENDERERS),
+    "pointer_overlay": (bool, True, None), # Local cursor and touch trail drawn over the video
+    "mouse_as_touch": (bool, True, None), # Left-button drags are sent as a finger (TouchInput.py)
+    "touch_sample_rate_hz": (int, 120, None), # Finger paths resampled to this rate, 16 or more (0: sent as they come)
+    "touch_batch_ms": (float, 16, None), # Resampled touch input is sent this often
+    "recording_file": (str, "record.mp4", None),
+    "capture_file": (str, "", None), # Raw video channel capture for replay ("" = off)
+    "ping_interval_ms": (float, 1000, None),
+    "reconnect_timeout_s": (float, 30, None),
+    "use_uvloop": (bool, True, None), # For the client runtime's event loop, if installed
+    "metrics_enabled": (bool, False, None),
+    "metrics_jsonl_file": (str, "", None),
+    "metrics_prometheus_port": (int, 0, None),
+    "metrics_overlay": (bool, False, None),
+    "devices": (list, [], None), # SessionManager: ip or ip:video_port:control_port
+    "session_loops": (int, 1, None),
+    "session_decode_workers": (int, 0, None), # 0: one per core (up to 8)
+    "session_queue_size": (int, 8, None),
+}
+
+
+TYPE_NAMES = {str: "a string", int: "an integer", float: "a number", bool: "true or false", list: "a list"}
+
+
+class ConfigError(ValueError):
+    """settings.json is unreadable or has a setting of the wrong type or value."""
+
+
+class Config:
+    """settings.json, parsed and validated once. Each setting is an attribute of its own type."""
+    __slots__ = tuple(FIELDS) + ('path',)
+
+    def __init__(self, values=None, path=None):
+        self.path = path
+        values = dict(values or {})
+        for name, (kind, default, allowed) in FIELDS.items():
+            value = values.pop(name, default)
+            setattr(self, name, self._check(name, value, kind, allowed))
+        if 0 < self.touch_sample_rate_hz < MIN_TOUCH_SAMPLE_RATE:
+            raise ConfigError(f"Setting touch_sample_rate_hz must be 0 or at least {MIN_TOUCH_SAMPLE_RATE}, "
+                              f"not {self.touch_sample_rate_hz}")
+        if values:
+            print(f"Ignoring unknown settings: {', '.join(sorted(values))}")
+
+    @staticmethod
+    def _check(name, value, kind, allowed):
+        if kind is float and isinstance(value, int) and not isinstance(value, bool):
+            value = float(value)
+        if not isinstance(value, kind) or (kind is int and isinstance(value, bool)):
+            raise ConfigError(f"Setting {name} must be {TYPE_NAMES[kind]}, not {value!r}")
+        if kind in (int, float) and value < 0:
+            raise ConfigError(f"Setting {name} must not be negative ({value})")
+        if allowed and value not in allowed:
+            raise ConfigError(f"Setting {name} must be one of {', '.join(allowed)}, not {value!r}")
+        return list(value) if kind is list else value
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in FIELDS}
+
+
+def load_config(path=DEFAULT_SETTINGS_FILE):
+    """Reads and validates a settings file; a missing file gives the defaults."""
+    try:
+        with open(path, "r") as f:
+            values = json.load(f)
+    except FileNotFoundError:
+        values = {}
+    except (OSError, ValueError) as e:
+        raise ConfigError(f"Cannot read {path}: {e}") from e
+    if not isinstance(values, dict):
+        raise ConfigError(f"{path} must contain a JSON object")
+    return Config(values, path)
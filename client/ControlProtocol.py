@@ -0,0 +1,327 @@
+import struct
+
+# The control channel protocol, shared by ControlSender (client), MockServer and, by hand, the
+# NDK server (network_manager.cpp). All integers are little-endian.
+#
+# Version 1: fixed 17-byte records, [1-byte type] [4 x 4-byte int]. Every server reads these.
+# Version 2 adds extended messages, [1-byte type | 0x80] [1-byte message version]
+# [2-byte payload length] [payload]; a reader skips those it does not know by their length.
+# Version 3 adds TYPE_TOUCH_BATCH. The server advertises its version in the pairing message
+# ("PIN:1234;PROTO:3"); without PROTO it is version 1 and the client sends it records only.
+PROTOCOL_VERSION = 3
+
+RECORD = struct.Struct('<Biiii')
+RECORD_SIZE = RECORD.size
+PING = struct.Struct('<BI12x') # A record whose sequence is unsigned
+
+# Record types and their four fields
+TYPE_MOUSE = 0x01 # x, y, button (Qt code: 1 left, 2 right, 4 middle), action
+TYPE_KEY = 0x02 # 0, 0, Qt key code, action
+TYPE_TOUCH = 0x03 # x, y, pointer id, action (a single pointer)
+TYPE_PING = 0x04 # sequence, 0, 0, 0; echoed back unchanged
+TYPE_RATE = 0x05 # bitrate kbit/s, max fps, flags, 0 (RateControl.py)
+TYPE_SCROLL = 0x06 # x, y, horizontal and vertical wheel delta (1/8 degree steps, Qt angleDelta)
+
+# Actions (mouse, key and touch)
+ACTION_UP = 0
+ACTION_DOWN = 1
+ACTION_MOVE = 2
+ACTION_CANCEL = 3 # Touch: the gesture was aborted; nothing it did should take effect
+
+# Rate hint flags
+RATE_FLAG_KEYFRAME = 0x01 # Encode the next frame as an IDR picture
+
+EXTENDED_FLAG = 0x80
+HEADER = struct.Struct('<BBH') # type, message version, payload length
+HEADER_SIZE = HEADER.size
+MAX_PAYLOAD = 0xFFFF
+
+# Extended message types (all at message version 1)
+TYPE_MULTI_TOUCH = 0x81 # MULTI_TOUCH, then one POINTER per finger down
+TYPE_TEXT = 0x82 # UTF-8 text to commit as typed (input method, paste)
+TYPE_KEY_BATCH = 0x83 # KEY_ENTRY per key event, in order
+TYPE_TOUCH_BATCH = 0x84 # TOUCH_BATCH, a 1-byte id per pointer, then per sample a TOUCH_SAMPLE per pointer (protocol 3)
+MESSAGE_VERSIONS = {TYPE_MULTI_TOUCH: 1, TYPE_TEXT: 1, TYPE_KEY_BATCH: 1, TYPE_TOUCH_BATCH: 1}
+
+MULTI_TOUCH = struct.Struct('<BBB') # action, id of the pointer it applies to, pointer count
+POINTER = struct.Struct('<BiiH') # id, x, y, pressure (0-65535 for 0.0-1.0)
+KEY_ENTRY = struct.Struct('<ii') # Qt key code, action
+# Evenly spaced finger positions: time of the first sample (ms on the sender's clock, wrapping;
+# only differences mean anything), sample interval (us), sample count, pointer count
+TOUCH_BATCH = struct.Struct('<IHHB')
+TOUCH_SAMPLE = struct.Struct('<iiH') # x, y, pressure
+
+MAX_POINTERS = min((MAX_PAYLOAD - MULTI_TOUCH.size) // POINTER.size, 0xFF) # Counted in one byte
+MAX_BATCH_KEYS = MAX_PAYLOAD // KEY_ENTRY.size
+MAX_TEXT_CHARS = MAX_PAYLOAD // 4 # Characters per text message (UTF-8 needs up to 4 bytes each)
+
+# Initial size of a PacketBuffer; enough for a frame's worth of input without growing
+DEFAULT_CAPACITY = 4096
+
+
+def parse_pairing(message):
+    """Splits the server's pairing message ("PIN:1234" or "PIN:1234;PROTO:2") into (pin, protocol version).
+
+    Returns None if it is not a pairing message. Unknown fields are ignored.
+    """
+    fields = {}
+    for field in message.strip().split(';'):
+        name, _, value = field.partition(':')
+        fields[name.strip()] = value.strip()
+    if not fields.get('PIN'):
+        return None
+    try:
+        version = int(fields.get('PROTO', 1))
+    except ValueError:
+        version = 1
+    return fields['PIN'], max(version, 1)
+
+
+def pairing_message(pin, version=PROTOCOL_VERSION):
+    """The server's side of parse_pairing (MockServer)."""
+    return f"PIN:{pin};PROTO:{version}" if version > 1 else f"PIN:{pin}"
+
+
+class PacketBuffer:
+    """Control messages encoded back to back into one preallocated bytearray, for a single write().
+
+    Each message is packed in place with the precompiled structs above (pack_into), so encoding
+    an event allocates nothing; the bytearray only grows when a batch outgrows it. A move that
+    directly follows a move of the same type and size overwrites it instead of being appended:
+    the server only needs the latest position. The record/ping/multi_touch methods return True
+    when the message replaced such a move.
+
+    While a memoryview of the buffer (view()) is alive the buffer cannot grow, so a buffer whose
+    contents are still being written out must not be encoded into (see ControlSender's ring).
+    """
+    __slots__ = ('data', 'size', 'messages', 'move_at', 'move_type')
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.data = bytearray(capacity)
+        self.size = 0
+        self.messages = 0
+        self.move_at = -1 # Offset of the last message if it is a move, else -1
+        self.move_type = 0
+
+    def __len__(self):
+        return self.size
+
+    def clear(self):
+        self.size = 0
+        self.messages = 0
+        self.move_at = -1
+
+    def view(self):
+        """The encoded messages, without copying them."""
+        return memoryview(self.data)[:self.size]
+
+    def _grow(self, end):
+        self.data.extend(bytes(max(end, 2 * len(self.data)) - len(self.data)))
+
+    def _place(self, length, move_type=0):
+        """Offset to encode a `length`-byte message at, and whether it replaces the previous move.
+
+        `move_type` identifies what a move moves (its message type, 0 for anything but a move).
+        """
+        start = self.move_at
+        if move_type and move_type == self.move_type and start >= 0 and start + length == self.size:
+            return start, True
+        start = self.size
+        end = start + length
+        if end > len(self.data):
+            self._grow(end)
+        self.size = end
+        self.messages += 1
+        self.move_at = start if move_type else -1
+        self.move_type = move_type
+        return start, False
+
+    def record(self, type, a, b, c, d, move=False):
+        """Appends a fixed record (TYPE_MOUSE, TYPE_KEY, TYPE_TOUCH, TYPE_RATE, TYPE_SCROLL).
+
+        A `move` only replaces one with the same third field (mouse buttons held, touch pointer id).
+        """
+        # _place() inlined: this is the per-event path
+        start = self.size
+        if move:
+            move = type | c << 8
+            if move == self.move_type and self.move_at >= 0 and self.move_at + RECORD_SIZE == start:
+                RECORD.pack_into(self.data, self.move_at, type, a, b, c, d)
+                return True
+            self.move_at = start
+            self.move_type = move
+        else:
+            self.move_at = -1
+        end = start + RECORD_SIZE
+        if end > len(self.data):
+            self._grow(end)
+        RECORD.pack_into(self.data, start, type, a, b, c, d)
+        self.size = end
+        self.messages += 1
+        return False
+
+    def ping(self, seq):
+        offset, _ = self._place(RECORD_SIZE)
+        PING.pack_into(self.data, offset, TYPE_PING, seq)
+
+    def multi_touch(self, action, action_pointer, pointers):
+        """Appends the state of every finger down: `pointers` are (id, x, y, pressure 0.0-1.0).
+
+        `action` applies to the pointer `action_pointer` (ACTION_DOWN: it was just put down,
+        ACTION_UP: lifted, still listed for the last time); ACTION_MOVE and ACTION_CANCEL to all.
+        """
+        count = len(pointers)
+        if count > MAX_POINTERS:
+            raise ValueError(f"At most {MAX_POINTERS} pointers per message")
+        length = MULTI_TOUCH.size + count * POINTER.size
+        offset, replaced = self._place(HEADER_SIZE + length, TYPE_MULTI_TOUCH if action == ACTION_MOVE else 0)
+        data = self.data
+        HEADER.pack_into(data, offset, TYPE_MULTI_TOUCH, MESSAGE_VERSIONS[TYPE_MULTI_TOUCH], length)
+        offset += HEADER_SIZE
+        MULTI_TOUCH.pack_into(data, offset, action, action_pointer, count)
+        offset += MULTI_TOUCH.size
+        for pointer_id, x, y, pressure in pointers:
+            POINTER.pack_into(data, offset, pointer_id, x, y, min(max(int(pressure * 0xFFFF), 0), 0xFFFF))
+            offset += POINTER.size
+        return replaced
+
+    def text(self, text):
+        """Appends `text` as one or more TYPE_TEXT messages."""
+        for start in range(0, len(text), MAX_TEXT_CHARS):
+            payload = text[start:start + MAX_TEXT_CHARS].encode('utf-8')
+            offset, _ = self._place(HEADER_SIZE + len(payload))
+            HEADER.pack_into(self.data, offset, TYPE_TEXT, MESSAGE_VERSIONS[TYPE_TEXT], len(payload))
+            offset += HEADER_SIZE
+            self.data[offset:offset + len(payload)] = payload
+
+    def touch_batch(self, timestamp_ms, interval_us, ids, samples):
+        """Appends evenly spaced positions of the pointers `ids`: `samples` holds (x, y, pressure 0.0-1.0)
+        for each pointer of the first sample, then of the second, and so on."""
+        pointers = len(ids)
+        if pointers > MAX_POINTERS:
+            raise ValueError(f"At most {MAX_POINTERS} pointers per message")
+        count = len(samples) // pointers
+        length = TOUCH_BATCH.size + pointers + len(samples) * TOUCH_SAMPLE.size
+        if length > MAX_PAYLOAD:
+            raise ValueError("Touch batch too long for one message")
+        offset, _ = self._place(HEADER_SIZE + length)
+        data = self.data
+        HEADER.pack_into(data, offset, TYPE_TOUCH_BATCH, MESSAGE_VERSIONS[TYPE_TOUCH_BATCH], length)
+        offset += HEADER_SIZE
+        TOUCH_BATCH.pack_into(data, offset, timestamp_ms & 0xFFFFFFFF, interval_us, count, pointers)
+        offset += TOUCH_BATCH.size
+        for pointer_id in ids:
+            data[offset] = pointer_id
+            offset += 1
+        for x, y, pressure in samples:
+            TOUCH_SAMPLE.pack_into(data, offset, x, y, min(max(int(pressure * 0xFFFF), 0), 0xFFFF))
+            offset += TOUCH_SAMPLE.size
+
+    def key_batch(self, keys):
+        """Appends (key code, action) pairs as TYPE_KEY_BATCH messages, as many keys per message as fit."""
+        for start in range(0, len(keys), MAX_BATCH_KEYS):
+            count = min(len(keys) - start, MAX_BATCH_KEYS)
+            length = count * KEY_ENTRY.size
+            offset, _ = self._place(HEADER_SIZE + length)
+            data = self.data
+            HEADER.pack_into(data, offset, TYPE_KEY_BATCH, MESSAGE_VERSIONS[TYPE_KEY_BATCH], length)
+            offset += HEADER_SIZE
+            for index in range(start, start + count):
+                keycode, action = keys[index]
+                KEY_ENTRY.pack_into(data, offset, keycode, action)
+                offset += KEY_ENTRY.size
+
+
+class ControlDecoder:
+    """Splits a control byte stream back into messages; the reading side of PacketBuffer.
+
+    feed(data) takes bytes as they arrive and returns the messages they complete, as
+    (type, fields) tuples:
+      records        the four ints ((seq,) for TYPE_PING, unsigned)
+      TYPE_MULTI_TOUCH (action, action pointer, [(id, x, y, pressure 0.0-1.0), ...])
+      TYPE_TEXT      (text,)
+      TYPE_KEY_BATCH ([(key code, action), ...],)
+      TYPE_TOUCH_BATCH (timestamp ms, interval us, [id, ...], [[(x, y, pressure) per pointer] per sample])
+    Extended messages of an unknown type or a newer message version are skipped by their
+    length and counted in `skipped`.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.skipped = 0
+
+    @property
+    def pending(self):
+        """Bytes of an incomplete message still waiting for the rest."""
+        return len(self.buffer)
+
+    def feed(self, data):
+        buffer = self.buffer
+        buffer += data
+        messages = []
+        offset = 0
+        end = len(buffer)
+        while offset < end:
+            type = buffer[offset]
+            if type & EXTENDED_FLAG:
+                if end - offset < HEADER_SIZE:
+                    break
+                _, version, length = HEADER.unpack_from(buffer, offset)
+                if end - offset < HEADER_SIZE + length:
+                    break
+                message = self._extended(type, version, buffer, offset + HEADER_SIZE, length)
+                offset += HEADER_SIZE + length
+                if message is None:
+                    self.skipped += 1
+                    continue
+            else:
+                if end - offset < RECORD_SIZE:
+                    break
+                if type == TYPE_PING:
+                    message = (type, PING.unpack_from(buffer, offset)[1:])
+                else:
+                    message = (type, RECORD.unpack_from(buffer, offset)[1:])
+                offset += RECORD_SIZE
+            messages.append(message)
+        del buffer[:offset]
+        return messages
+
+    @staticmethod
+    def _extended(type, version, buffer, offset, length):
+        if version != MESSAGE_VERSIONS.get(type):
+            return None
+        if type == TYPE_TEXT:
+            return type, (bytes(buffer[offset:offset + length]).decode('utf-8', 'replace'),)
+        if type == TYPE_KEY_BATCH:
+            return type, (list(KEY_ENTRY.iter_unpack(buffer[offset:offset + length])),)
+        if type == TYPE_TOUCH_BATCH:
+            if length < TOUCH_BATCH.size:
+                return None
+            timestamp, interval, count, pointers = TOUCH_BATCH.unpack_from(buffer, offset)
+            offset += TOUCH_BATCH.size
+            if length < TOUCH_BATCH.size + pointers + count * pointers * TOUCH_SAMPLE.size:
+                return None
+            ids = list(buffer[offset:offset + pointers])
+            offset += pointers
+            samples = []
+            for _ in range(count):
+                sample = []
+                for _ in range(pointers):
+                    x, y, pressure = TOUCH_SAMPLE.unpack_from(buffer, offset)
+                    sample.append((x, y, pressure / 0xFFFF))
+                    offset += TOUCH_SAMPLE.size
+                samples.append(sample)
+            return type, (timestamp, interval, ids, samples)
+        # TYPE_MULTI_TOUCH
+        if length < MULTI_TOUCH.size:
+            return None
+        action, action_pointer, count = MULTI_TOUCH.unpack_from(buffer, offset)
+        if length < MULTI_TOUCH.size + count * POINTER.size:
+            return None
+        offset += MULTI_TOUCH.size
+        pointers = []
+        for _ in range(count):
+            pointer_id, x, y, pressure = POINTER.unpack_from(buffer, offset)
+            pointers.append((pointer_id, x, y, pressure / 0xFFFF))
+            offset += POINTER.size
+        return type, (action, action_pointer, pointers)
@@ -1,23 +1,42 @@
 import asyncio
-import struct
+import socket
+import threading
 import time
 from PyQt6.QtCore import QObject, pyqtSignal, QThread
 
+import ControlProtocol as proto
+from ControlProtocol import ControlDecoder, PacketBuffer
+from Metrics import LatencyHistogram
+from Reconnect import (Backoff, DEFAULT_RECONNECT_TIMEOUT, STATE_CONNECTED, STATE_CONNECTING,
+                       STATE_DISCONNECTED, STATE_RECONNECTING)
+from TouchInput import DEFAULT_BATCH_INTERVAL, DEFAULT_SAMPLE_RATE, TouchSampler
+
 class ControlSender(QObject):
-    """Handles control event transmission, PIN pairing, and ping calculation."""
+    """Handles control event transmission, PIN pairing, and ping calculation.
+
+    Events are encoded straight into a preallocated buffer (ControlProtocol.PacketBuffer) on the
+    caller's thread and written with one write() per event-loop tick. Messages the server's
+    protocol version does not have are sent in a version 1 form where there is one.
+    """
     finished = pyqtSignal()
+    state_changed = pyqtSignal(str) # Reconnect.STATE_* (connecting, connected, reconnecting, disconnected)
+
+    # A ping without an echo after this long (or 4 intervals, if longer) is counted as lost
+    PING_TIMEOUT = 2.0
 
-    # Event Type Codes (must match C++ server)
-    EVENT_TYPE_MOUSE = 0x01
-    EVENT_TYPE_KEY = 0x02
-    EVENT_TYPE_PING = 0x04
+    # Stop flushing into the socket above this many unsent bytes; queued moves keep coalescing instead
+    SEND_BUFFER_LIMIT = 16 * 1024
 
-    # Mouse Action Codes (simplified for now)
-    ACTION_DOWN = 1
-    ACTION_UP = 0
-    ACTION_MOVE = 2
+    # Encode buffers the send path cycles through: events are encoded into one while the transport
+    # may still hold on to others it has not written out yet
+    SEND_BUFFERS = 4
 
-    def __init__(self, ip, port, status_signal, parent=None):
+    # Bytes read from the socket at a time
+    RECEIVE_SIZE = 4096
+
+    def __init__(self, ip, port, status_signal, parent=None, ping_interval=1.0,
+                 reconnect_timeout=DEFAULT_RECONNECT_TIMEOUT, touch_sample_rate=DEFAULT_SAMPLE_RATE,
+                 touch_batch_interval=DEFAULT_BATCH_INTERVAL):
         super().__init__(parent)
         self.ip = ip
         self.port = port
@@ -28,225 +47,467 @@ class ControlSender(QObject):
         self.reader = None
         self.ping_ms = 0.0
 
+        # Round-trip measurement: sequence-numbered pings matched against the server's echoes
+        self.ping_interval = ping_interval
+        self.ping_seq = 0
+        self.pings_in_flight = {} # seq -> send time (monotonic)
+        self.pings_sent = 0
+        self.pings_lost = 0
+        self.rtt_stats = LatencyHistogram()
+        self.receive_task = None
+        self.main_task = None
+
+        # A dropped control channel is reconnected and re-paired for up to reconnect_timeout s (0: never)
+        self.reconnect_timeout = reconnect_timeout
+        self.state = None
+        self.reconnects = 0
+
+        # Protocol version of the paired server (ControlProtocol; from the pairing message)
+        self.protocol_version = 1
+
+        # Outgoing events: encoded into send_buffer from the GUI thread, flushed on the loop
+        self.send_lock = threading.Lock()
+        self.send_buffers = [PacketBuffer() for _ in range(self.SEND_BUFFERS)]
+        self.send_buffer = self.send_buffers[0]
+        self.buffers_in_flight = [] # Written, but possibly still referenced by the transport
+        self.flush_scheduled = False
+        self.drain_task = None
+        self.events_coalesced = 0
+        self.events_unsupported = 0 # Not sent: the server's protocol version has no such message
+        self.batches_sent = 0
+
+        # Touch and gesture input, resampled on the loop and sent in batches (TouchInput.TouchSampler)
+        self.touch_lock = threading.Lock()
+        self.touch_sampler = TouchSampler(self, touch_sample_rate)
+        self.touch_batch_interval = max(touch_batch_interval, self.touch_sampler.interval) # At least a sample per batch
+        self.touch_ticking = False
+
     def run(self):
         """Starts the asyncio event loop and the main control task."""
         self.loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.loop)
         self.is_running = True
         try:
-            self.loop.run_until_complete(self.connect_and_run())
+            self.main_task = self.loop.create_task(self.connect_and_run())
+            self.loop.run_until_complete(self.main_task)
         except asyncio.CancelledError:
             pass
         finally:
             if self.writer:
                 self.writer.close()
+            self.loop.close()
             self.is_running = False
             self.finished.emit()
 
+    def start(self, loop):
+        """Runs the sender on an event loop already running in another thread (Runtime.ClientRuntime)."""
+        self.loop = loop
+        self.is_running = True
+        self.main_task = asyncio.run_coroutine_threadsafe(self.connect_and_run(), loop)
+        self.main_task.add_done_callback(self._task_finished)
+
+    def _task_finished(self, future):
+        if self.writer:
+            self.writer.close()
+        self.is_running = False
+        self.finished.emit()
+
     async def connect_and_run(self):
-        """Connects to the control server, performs pairing, and runs the ping loop."""
+        """Connects and pairs, runs the ping loop, and reconnects (re-pairing) if the channel drops."""
+        backoff = Backoff()
+        deadline = None
+        self._set_state(STATE_CONNECTING)
+        try:
+            while self.is_running:
+                if await self._connect():
+                    # PIN Pairing Handshake (repeated on every new connection)
+                    if not await self.perform_pin_pairing():
+                        self.status_signal.emit("PIN Pairing Failed. Disconnecting.")
+                        break
+                    resumed = self.state == STATE_RECONNECTING
+                    backoff.reset()
+                    deadline = None
+                    self._set_state(STATE_CONNECTED)
+                    if resumed:
+                        self.reconnects += 1
+                        self.request_keyframe() # The video stream most likely dropped too
+                    await self._run_session()
+                elif self.state == STATE_CONNECTING:
+                    break # Never connected: wrong address or server not running
+                if not self.is_running or not self.reconnect_timeout:
+                    break
+                now = time.monotonic()
+                if deadline is None:
+                    deadline = now + self.reconnect_timeout
+                elif now >= deadline:
+                    self.status_signal.emit(f"Control channel lost; gave up reconnecting after "
+                                            f"{self.reconnect_timeout:g} s")
+                    break
+                self._set_state(STATE_RECONNECTING)
+                await asyncio.sleep(backoff.next_delay())
+        finally:
+            self._close_connection()
+            self._set_state(STATE_DISCONNECTED)
+
+    async def _connect(self):
+        """Opens the control connection; returns False if the attempt failed."""
         try:
             self.reader, self.writer = await asyncio.open_connection(self.ip, self.port)
-            self.status_signal.emit(f"Control channel connected to {self.ip}:{self.port}")
         except ConnectionRefusedError:
-            self.status_signal.emit(f"Connection refused by control server at {self.ip}:{self.port}")
-            return
+            if self.state == STATE_CONNECTING:
+                self.status_signal.emit(f"Connection refused by control server at {self.ip}:{self.port}")
+            return False
         except Exception as e:
-            self.status_signal.emit(f"Error connecting control channel: {e}")
-            return
+            if self.state == STATE_CONNECTING:
+                self.status_signal.emit(f"Error connecting control channel: {e}")
+            return False
+        self.status_signal.emit(f"Control channel connected to {self.ip}:{self.port}")
+        self._discard_pending() # Encoded while there was no connection
+        # Control events are tiny and latency-critical; never let Nagle hold them back
+        sock = self.writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return True
 
-        # 1. PIN Pairing Handshake
-        if not await self.perform_pin_pairing():
-            self.status_signal.emit("PIN Pairing Failed. Disconnecting.")
-            self.stop()
-            return
+    async def _run_session(self):
+        """Pings until the connection is lost (the receive task ends) or the sender is stopped."""
+        # Read echoed packets in the background
+        self.receive_task = asyncio.ensure_future(self.receive_loop())
+        try:
+            while self.is_running and not self.receive_task.done():
+                await self.send_ping()
+                await asyncio.wait([self.receive_task], timeout=self.ping_interval)
+        finally:
+            self.receive_task.cancel()
+            self.receive_task = None
+            self._close_connection()
+
+    def _close_connection(self):
+        """Closes the current connection; events sent until the next one is paired are dropped."""
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+        with self.send_lock:
+            # Buffers the old transport may still be writing from are left to it
+            self.send_buffers = [buffer if buffer not in self.buffers_in_flight else PacketBuffer()
+                                 for buffer in self.send_buffers]
+            self.buffers_in_flight.clear()
+            for buffer in self.send_buffers:
+                buffer.clear()
+            self.send_buffer = self.send_buffers[0]
+            self.flush_scheduled = False
+        self.pings_in_flight.clear() # Echoes cannot arrive on a new connection
+        with self.touch_lock:
+            self.touch_sampler.reset()
 
-        # 2. Ping Loop
-        while self.is_running:
-            await self.send_ping()
-            await asyncio.sleep(5) # Ping every 5 seconds
+    def _discard_pending(self):
+        """Drops events encoded but not written yet (the current buffer is not in the transport's hands)."""
+        with self.send_lock:
+            self.send_buffer.clear()
+            self.flush_scheduled = False
+
+    def _set_state(self, state):
+        if state != self.state:
+            self.state = state
+            self.state_changed.emit(state)
+
+    async def receive_loop(self):
+        """Reads messages sent back by the server (currently ping echoes) until the connection ends."""
+        decoder = ControlDecoder()
+        try:
+            while self.is_running:
+                data = await self.reader.read(self.RECEIVE_SIZE)
+                if not data:
+                    self.status_signal.emit("Control channel closed by server")
+                    break
+                for message_type, fields in decoder.feed(data):
+                    if message_type == proto.TYPE_PING:
+                        self._handle_ping_echo(fields[0])
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.status_signal.emit(f"Control channel read error: {e}")
 
     async def perform_pin_pairing(self):
         """Handles the PIN code exchange with the server."""
         try:
-            # 1. Receive PIN request/info from server (e.g., "PIN:1234")
+            # 1. Receive the PIN (and the server's protocol version) from the server, e.g. "PIN:1234;PROTO:2"
             data = await self.reader.read(1024)
             message = data.decode().strip()
-            if not message.startswith("PIN:"):
+            pairing = proto.parse_pairing(message)
+            if pairing is None:
                 self.status_signal.emit(f"Unexpected pairing message: {message}")
                 return False
+            pin_code, server_version = pairing
+            self.protocol_version = min(server_version, proto.PROTOCOL_VERSION)
 
-            pin_code = message.split(":")[1]
-            self.status_signal.emit(f"Server requested PIN: {pin_code}. Please enter it on the client.")
-
-            # In a real application, a dialog would pop up here to ask the user for the PIN.
-            # For this example, we'll assume the user sees the PIN on the Android screen and enters it.
-            # Since we can't get user input in this background thread, we'll simulate the user
-            # reading the PIN from the Android screen and sending it back.
-            # NOTE: The Android server side generates the PIN and sends it.
-            # For a complete testable example, we'll assume the user manually enters the PIN
-            # in a future GUI dialog, but for now, we'll just send the received PIN back
-            # to complete the handshake, as the server expects the client to send the PIN.
-            # In the C++ server, the PIN is generated and sent, and the server expects the client
-            # to send the *correct* PIN back. Since we don't have a GUI dialog to ask the user,
-            # we'll use a placeholder for the PIN that the user would enter.
-            # Since the C++ server sends the PIN, we'll use a hardcoded placeholder for now.
-            
-            # **CRITICAL FIX**: The C++ server *sends* the PIN, and the client needs to *receive* it
-            # and then *send* it back. Since the client doesn't have a UI to ask the user,
-            # we'll assume the user sees the PIN on the Android screen and enters it.
-            # For a testable example, we'll use a simple input mechanism.
-            
-            # Since the C++ server sends the PIN, we'll prompt the user to enter it.
-            # This is a limitation of the sandbox environment, but it makes the protocol correct.
-            # In the final implementation, the GUI (MainWindow) should handle this.
-            
-            # For now, let's assume the user has seen the PIN on the Android screen and we'll
-            # hardcode a placeholder for the PIN that the user would enter.
-            # Since the server sends the PIN, we'll just send a hardcoded PIN back for now.
-            # The C++ server's `performPinPairing` expects a 4-byte PIN.
-            
-            # Let's assume the user enters '1234' for testing.
-            # In a real app, the MainWindow would handle this and call a method on ControlSender.
-            
-            # For now, let's just send a placeholder PIN.
-            # The C++ server generates a random PIN. We can't know it here.
-            # We must rely on the user to enter it.
-            
-            # Since the server sends the PIN, we'll use a simple mechanism to get it.
-            # This is a major architectural issue in a non-interactive environment.
-            
-            # **Alternative**: Since the server sends the PIN, we'll assume the user sees it
-            # and we'll just send a fixed PIN back for now, and document the need for a dialog.
-            # Let's assume the user sees the PIN and enters it correctly.
-            
-            # The C++ server expects the client to send the correct PIN back.
-            # Since we can't get the user input, we'll assume the user enters the PIN shown on the Android screen.
-            # The Android server *sends* the PIN, so the client *knows* the PIN.
-            # The client should send the PIN back to confirm.
-            
-            # Let's extract the PIN from the server's message and send it back.
-            # This is a security flaw (no user interaction), but it satisfies the protocol for testing.
-            
-            # The server sends "PIN:XXXX". The client sends "XXXX".
-            
+            # 2. Send it back. The user confirms by comparing it with the PIN shown on the phone;
+            # a PIN entry dialog (MainWindow) would take its place here.
             self.status_signal.emit(f"Server PIN: {pin_code}. Sending back for pairing...")
             self.writer.write(pin_code.encode())
             await self.writer.drain()
-            
-            # The server will close the connection if the PIN is wrong.
-            # If the connection remains open, pairing is successful.
-            
-            # We need a way to check if the server accepted the PIN.
-            # The C++ server doesn't send a confirmation message, it just keeps the socket open.
-            # We'll assume success if the connection is still open after a short delay.
+
+            # The server closes the connection on a wrong PIN and sends no confirmation otherwise
             await asyncio.sleep(0.1)
-            return True # Assume success if connection is not closed
+            return True
 
         except Exception as e:
             self.status_signal.emit(f"PIN pairing error: {e}")
             return False
 
     def send_mouse_event(self, x, y, button, action):
-        """Sends a mouse event to the server."""
-        if not self.writer: return
-
-        # Scale x, y to 0-1000 range for device independence (assuming a 1000x1000 virtual screen)
-        # The MainWindow needs to provide the actual screen size for scaling.
-        # For now, we'll send the raw coordinates and assume the server can handle it.
-        # The C++ server expects: [1-byte type] [4-byte x] [4-byte y] [4-byte keycode] [4-byte action]
-        
-        # Keycode is 0 for mouse events.
-        # Button is the PyQt button code (1=Left, 2=Right, 4=Middle). We'll use this as the keycode.
-        
-        # The C++ server expects: [1-byte type] [4-byte x] [4-byte y] [4-byte keycode] [4-byte action] = 17 bytes
-        
-        # We need to ensure the x, y are scaled to the actual video widget size.
-        # The MainWindow should handle this scaling before calling this method.
-        
-        # For now, we'll use the raw x, y and let the server handle the scaling/injection.
-        
-        # Pack the data: >BiiiI (Big-endian: 1-byte, 4-byte int, 4-byte int, 4-byte int, 4-byte int)
-        # The C++ server uses native endianness for the ints, so we should use native endianness here.
-        # We'll use '<' (little-endian) as Android is little-endian.
-        
-        # The C++ server expects: [1-byte type] [4-byte x] [4-byte y] [4-byte keycode] [4-byte action]
-        # The C++ server code is:
-        # uint8_t type = eventBuffer[0];
-        # int x = *(int*)&eventBuffer[1];
-        # int y = *(int*)&eventBuffer[5];
-        # int keycode = *(int*)&eventBuffer[9];
-        # int action = *(int*)&eventBuffer[13];
-        
-        # This is a fixed-size 17-byte packet.
-        
-        # We need to use struct.pack with native endianness.
-        
-        packet = struct.pack('<Biiii', self.EVENT_TYPE_MOUSE, x, y, button, action)
-        
-        # The C++ server expects: [1-byte type] [4-byte x] [4-byte y] [4-byte keycode] [4-byte action] = 17 bytes
-        # struct.pack('<Biiii', ...) will produce 1+4+4+4+4 = 17 bytes. Correct.
-        
-        self.loop.call_soon_threadsafe(self._send_packet, packet)
+        """Sends a mouse event: x, y in device pixels (PointerOverlay maps them through the letterbox),
+        the Qt button code (1 left, 2 right, 4 middle) and ControlProtocol.ACTION_*."""
+        if self.state != STATE_CONNECTED: return # Not paired yet: a packet ahead of the PIN would break pairing
+        # Consecutive moves collapse to the latest position; press/release keep their place in order
+        self._record(proto.TYPE_MOUSE, x, y, button, action, action == proto.ACTION_MOVE)
 
     def send_key_event(self, keycode, action):
-        """Sends a keyboard event to the server."""
-        if not self.writer: return
+        """Sends a keyboard event (Qt key code)."""
+        if self.state != STATE_CONNECTED: return
+        self._record(proto.TYPE_KEY, 0, 0, keycode, action)
+
+    def send_keys(self, keys):
+        """Sends (Qt key code, action) pairs in order, as one message where the server supports it."""
+        if self.state != STATE_CONNECTED or not keys: return
+        if self.protocol_version >= 2:
+            self._encode(PacketBuffer.key_batch, keys)
+            return
+        with self.send_lock:
+            for keycode, action in keys:
+                self.send_buffer.record(proto.TYPE_KEY, 0, 0, keycode, action)
+        self._schedule_flush()
+
+    def send_text(self, text):
+        """Sends text to type as is (input method, paste). Version 1 servers have no text message."""
+        if self.state != STATE_CONNECTED or not text: return
+        if self.protocol_version < 2:
+            self.events_unsupported += 1
+            return
+        self._encode(PacketBuffer.text, text)
+
+    def send_touch(self, pointer_id, x, y, action):
+        """Sends one touch pointer: device pixels and ControlProtocol.ACTION_* (including ACTION_CANCEL)."""
+        if self.state != STATE_CONNECTED: return
+        self._record(proto.TYPE_TOUCH, x, y, pointer_id, action, action == proto.ACTION_MOVE)
+
+    def send_multi_touch(self, action, action_pointer, pointers):
+        """Sends every finger down, (id, x, y, pressure 0.0-1.0), with the action of `action_pointer`.
+
+        A version 1 server gets a touch record per pointer instead: the one that changed for
+        ACTION_DOWN/ACTION_UP, all of them for ACTION_MOVE/ACTION_CANCEL.
+        """
+        if self.state != STATE_CONNECTED or not pointers: return
+        if self.protocol_version >= 2:
+            self._encode(PacketBuffer.multi_touch, action, action_pointer, pointers)
+            return
+        with self.send_lock:
+            for pointer_id, x, y, _ in pointers:
+                if action in (proto.ACTION_MOVE, proto.ACTION_CANCEL) or pointer_id == action_pointer:
+                    if self.send_buffer.record(proto.TYPE_TOUCH, x, y, pointer_id, action, action == proto.ACTION_MOVE):
+                        self.events_coalesced += 1
+        self._schedule_flush()
+
+    def send_touch_batch(self, timestamp_ms, interval_us, ids, samples):
+        """Sends evenly spaced positions of the pointers `ids` (TouchInput.TouchSampler).
+
+        Servers before protocol version 3 get the last sample as an ordinary move.
+        """
+        if self.state != STATE_CONNECTED: return
+        if self.protocol_version >= 3:
+            self._encode(PacketBuffer.touch_batch, timestamp_ms, interval_us, ids, samples)
+            return
+        latest = samples[-len(ids):]
+        self.send_multi_touch(proto.ACTION_MOVE, ids[0],
+                              [(pointer_id,) + sample for pointer_id, sample in zip(ids, latest)])
+
+    def send_touch_input(self, t, points):
+        """Thread-safe: touch/gesture input from the GUI, (key, action, x, y, pressure) per changed
+        pointer at perf_counter() time t; resampled and sent in batches (TouchInput.TouchSampler)."""
+        if self.state != STATE_CONNECTED: return
+        with self.touch_lock:
+            self.touch_sampler.update(t, points)
+            self._start_touch_ticks()
+
+    def send_scroll_input(self, t, x, y, delta_x, delta_y):
+        """Thread-safe: a wheel step from the GUI; the steps between two batches are sent as one scroll."""
+        if self.state != STATE_CONNECTED: return
+        with self.touch_lock:
+            self.touch_sampler.scroll_step(t, x, y, delta_x, delta_y)
+            self._start_touch_ticks()
 
-        # For key events, x, y are 0. Keycode is the PyQt key code.
-        # The C++ server expects: [1-byte type] [4-byte x] [4-byte y] [4-byte keycode] [4-byte action]
-        
-        packet = struct.pack('<Biiii', self.EVENT_TYPE_KEY, 0, 0, keycode, action)
-        self.loop.call_soon_threadsafe(self._send_packet, packet)
+    def _start_touch_ticks(self):
+        """With touch_lock held: keeps the sampler ticking on the loop while it has work."""
+        if self.touch_sampler.active and not self.touch_ticking:
+            self.touch_ticking = True
+            self.loop.call_soon_threadsafe(self._touch_tick)
 
-    async def _send_packet_async(self, packet):
-        """Internal asynchronous function to send a packet."""
+    def _touch_tick(self):
+        """Runs on the event loop, every touch_batch_interval while fingers are down or scroll steps wait."""
+        with self.touch_lock:
+            try:
+                self.touch_sampler.tick(time.perf_counter())
+            except Exception as e:
+                self.touch_sampler.reset() # Drop the gesture; the next one starts the ticks again
+                self.status_signal.emit(f"Error sending touch input: {e}")
+            self.touch_ticking = self.touch_sampler.active and self.is_running
+        if self.touch_ticking:
+            self.loop.call_later(self.touch_batch_interval, self._touch_tick)
+
+    def send_scroll(self, x, y, delta_x, delta_y):
+        """Sends a wheel/scroll step at device pixel x, y; deltas in 1/8 degree steps (Qt angleDelta)."""
+        if self.state != STATE_CONNECTED: return
+        self._record(proto.TYPE_SCROLL, x, y, delta_x, delta_y)
+
+    def _record(self, type, a, b, c, d, move=False):
+        """Thread-safe: encodes a fixed record (the per-event path; _encode() without the indirection)."""
+        with self.send_lock:
+            if self.send_buffer.record(type, a, b, c, d, move):
+                self.events_coalesced += 1
+            if self.flush_scheduled:
+                return
+            self.flush_scheduled = True
+        self.loop.call_soon_threadsafe(self._flush)
+
+    def _encode(self, encode, *args):
+        """Thread-safe: encodes a message with the PacketBuffer method `encode` and schedules a flush."""
+        with self.send_lock:
+            if encode(self.send_buffer, *args):
+                self.events_coalesced += 1
+            if self.flush_scheduled:
+                return
+            self.flush_scheduled = True
+        self.loop.call_soon_threadsafe(self._flush)
+
+    def _schedule_flush(self):
+        """Thread-safe: at most one flush per event-loop tick, however many events were encoded."""
+        with self.send_lock:
+            if self.flush_scheduled:
+                return
+            self.flush_scheduled = True
+        self.loop.call_soon_threadsafe(self._flush)
+
+    def _flush(self):
+        """Runs on the event loop: writes everything encoded since the last flush with a single write() call."""
+        if not self.writer:
+            self._discard_pending() # No connection: not kept for the next one, where it would arrive stale
+            return
+        transport = self.writer.transport
+        if transport.get_write_buffer_size() > self.SEND_BUFFER_LIMIT:
+            # Socket is backed up; keep events queued (and moves coalescing) until it drains
+            if not self.drain_task:
+                self.drain_task = self.loop.create_task(self._drain_then_flush())
+            return
+
+        with self.send_lock:
+            self.flush_scheduled = False
+            buffer = self.send_buffer
+            if not buffer.size:
+                return
+            if not transport.get_write_buffer_size():
+                self.buffers_in_flight.clear() # Everything written before has gone to the socket
+            # The transport may keep a view of what it could not send at once, so the buffer is
+            # handed over and encoding goes on in one it has finished with
+            spare = next((spare for spare in self.send_buffers
+                          if spare is not buffer and spare not in self.buffers_in_flight), None)
+            if spare is None:
+                data = bytes(buffer.view()) # All of them still pending: copy instead
+                buffer.clear()
+            else:
+                data = buffer.view()
+                self.send_buffer = spare
         try:
-            self.writer.write(packet)
-            await self.writer.drain()
+            self.writer.write(data)
+            self.batches_sent += 1
         except Exception as e:
             self.status_signal.emit(f"Error sending control packet: {e}")
-            self.stop()
+            self._close_connection() # Ends the session; the channel is reconnected
+            return
+        if spare is not None:
+            del data
+            if transport.get_write_buffer_size():
+                self.buffers_in_flight.append(buffer)
+            buffer.clear()
+
+    async def _drain_then_flush(self):
+        try:
+            if self.writer:
+                await self.writer.drain()
+        except Exception as e:
+            self.status_signal.emit(f"Error sending control packet: {e}")
+            self._close_connection() # Ends the session; the channel is reconnected
+            return
+        finally:
+            self.drain_task = None
+        self._flush()
+
+    def send_rate_hint(self, bitrate_kbps, max_fps, request_keyframe=False):
+        """Asks the server's encoder for a new bitrate/frame rate, optionally with an immediate keyframe."""
+        if self.state != STATE_CONNECTED: return
 
-    def _send_packet(self, packet):
-        """Thread-safe wrapper to send a packet."""
-        asyncio.run_coroutine_threadsafe(self._send_packet_async(packet), self.loop)
+        flags = proto.RATE_FLAG_KEYFRAME if request_keyframe else 0
+        self._record(proto.TYPE_RATE, bitrate_kbps, max_fps, flags, 0)
+
+    def request_keyframe(self):
+        """Asks the server for an IDR picture now, leaving bitrate and frame rate unchanged (0)."""
+        self.send_rate_hint(0, 0, request_keyframe=True)
 
     async def send_ping(self):
-        """Sends a ping packet and calculates RTT."""
+        """Sends a sequence-numbered ping; the RTT is recorded when the server echoes it back."""
         if not self.writer: return
 
-        # Ping packet: [1-byte type] [4-byte timestamp] [4-byte 0] [4-byte 0] [4-byte 0]
-        timestamp = int(time.time() * 1000) # Milliseconds
-        packet = struct.pack('<Biiii', self.EVENT_TYPE_PING, timestamp, 0, 0, 0)
-        
-        start_time = time.time()
-        
+        self._expire_pings()
+
+        self.ping_seq = (self.ping_seq + 1) & 0xFFFFFFFF # Unsigned 32-bit, wraps around
+
         try:
-            self.writer.write(packet)
-            await self.writer.drain()
-            
-            # Wait for response (The C++ server should echo the packet back)
-            # This requires the C++ server to implement the echo logic.
-            # Since the C++ server is a mock, we'll simulate the RTT for now.
-            # In a real implementation, the C++ server would echo the packet back,
-            # and we would read it here and calculate the RTT.
-            
-            # For now, we'll just calculate the time it took to send the packet.
-            # This is not a true ping, but a placeholder.
-            
-            end_time = time.time()
-            self.ping_ms = (end_time - start_time) * 1000
-            
+            self.pings_in_flight[self.ping_seq] = time.monotonic()
+            self.pings_sent += 1
+            self._encode(PacketBuffer.ping, self.ping_seq)
+            self._flush() # Send now rather than on the next tick so queueing doesn't inflate the RTT
         except Exception as e:
             self.status_signal.emit(f"Error sending ping: {e}")
-            self.stop()
+            self._close_connection()
+
+    def _handle_ping_echo(self, seq):
+        sent_at = self.pings_in_flight.pop(seq, None)
+        if sent_at is None:
+            return # Unknown or already counted as lost
+        self.ping_ms = (time.monotonic() - sent_at) * 1000
+        self.rtt_stats.add(self.ping_ms)
+
+    def _expire_pings(self):
+        """Counts pings whose echo is overdue as lost."""
+        deadline = time.monotonic() - max(self.PING_TIMEOUT, 4 * self.ping_interval)
+        for seq, sent_at in list(self.pings_in_flight.items()):
+            if sent_at < deadline:
+                del self.pings_in_flight[seq]
+                self.pings_lost += 1
 
     def get_ping(self):
+        """Returns the most recent round-trip time in milliseconds."""
         return self.ping_ms
 
+    def get_latency_stats(self):
+        """Returns RTT percentiles (ms), jitter and loss over the rolling window."""
+        stats = self.rtt_stats.summary()
+        stats["sent"] = self.pings_sent
+        stats["lost"] = self.pings_lost
+        stats["loss"] = self.pings_lost / self.pings_sent if self.pings_sent else 0.0
+        return stats
+
     def stop(self):
         """Stops the sender and closes resources."""
         self.is_running = False
-        if self.loop:
-            self.loop.call_soon_threadsafe(self.loop.stop)
+        if not self.loop or self.loop.is_closed():
+            return
+        try:
+            if self.receive_task:
+                self.loop.call_soon_threadsafe(self.receive_task.cancel)
+            # Cancelling the main task ends run_until_complete() cleanly (stopping the loop would abort it)
+            if self.main_task:
+                self.loop.call_soon_threadsafe(self.main_task.cancel)
+            else:
+                self.loop.call_soon_threadsafe(self.loop.stop)
+        except RuntimeError:
+            pass # The loop ended on its own (is_running is already False) and closed since the check
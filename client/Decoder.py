@@ -0,0 +1,102 @@
+import av
+
+try:
+    from av.codec.hwaccel import HWAccel, hwdevices_available # PyAV 14+
+except ImportError:
+    HWAccel = hwdevices_available = None
+
+# Hardware device types 'auto' tries, best first (only those the loaded FFmpeg supports are tried)
+HW_DEVICE_PREFERENCE = ('videotoolbox', 'd3d11va', 'dxva2', 'cuda', 'vaapi', 'qsv')
+
+
+class DecoderProfile:
+    """How the H.264 decoder is threaded and which delays it may add."""
+    __slots__ = ('name', 'thread_type', 'low_delay', 'description')
+
+    def __init__(self, name, thread_type, low_delay, description):
+        self.name = name
+        self.thread_type = thread_type # libavcodec thread types: 'SLICE', 'FRAME' or 'AUTO' (both)
+        self.low_delay = low_delay # AV_CODEC_FLAG_LOW_DELAY: output each picture at once, no reorder buffer
+        self.description = description
+
+
+# Frame threading decodes N pictures at once and so holds each one back by up to N-1 frame
+# times; slice threads split a single picture and add no delay (but need a multi-slice stream
+# to run in parallel). The remote-control default is the low-latency profile.
+PROFILES = {
+    'low_latency': DecoderProfile('low_latency', 'SLICE', True, "slice threads, low delay"),
+    'throughput': DecoderProfile('throughput', 'AUTO', False, "frame and slice threads"),
+}
+DEFAULT_PROFILE = 'low_latency'
+
+
+def hardware_devices():
+    """Hardware device types FFmpeg was built with, in the order 'auto' tries them."""
+    if hwdevices_available is None:
+        return []
+    available = set(hwdevices_available())
+    return [device for device in HW_DEVICE_PREFERENCE if device in available]
+
+
+def _open(name, hwaccel_device, settings, threads, options, copy_opaque):
+    """Creates and opens a decoder, so a missing device or decoder fails here and not on the first packet."""
+    hwaccel = None
+    if hwaccel_device:
+        # With the software fallback on, FFmpeg decodes in software if the device cannot handle the
+        # stream; whether it really runs on the device shows in is_hwaccel once frames come out.
+        hwaccel = HWAccel(hwaccel_device, allow_software_fallback=True)
+    codec = av.CodecContext.create(name, 'r', hwaccel=hwaccel) if hwaccel else av.CodecContext.create(name, 'r')
+    codec.thread_type = settings.thread_type
+    codec.thread_count = threads
+    if copy_opaque:
+        codec.copy_opaque = True # Carry each packet's opaque (FrameTiming) through to its frame
+    codec.options = dict(options)
+    codec.open()
+    return codec
+
+
+def create_decoder(decoder='auto', profile=DEFAULT_PROFILE, threads=0, skip_loop_filter=False, copy_opaque=False):
+    """Creates and opens the H.264 decoder for `decoder`, set up according to `profile`.
+
+    Returns (CodecContext, label for the status bar, whether a hardware device was opened).
+
+    `decoder` is 'auto' (the first hardware device that can be opened, else software),
+    'software', a hardware device type ('cuda', 'vaapi', 'videotoolbox', ...) or a libavcodec
+    decoder name ('libopenh264', 'h264_cuvid', ...). Anything that cannot be opened falls back
+    to the software decoder. `threads` 0 lets FFmpeg pick.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown decoder profile: {profile}")
+    settings = PROFILES[profile]
+    options = {}
+    if settings.low_delay:
+        options['flags'] = '+low_delay' # Also keeps libavcodec from using frame threads
+    if skip_loop_filter:
+        options['skip_loop_filter'] = 'all' # Faster, at the cost of blocking artefacts
+
+    def open_decoder(name='h264', device=None):
+        return _open(name, device, settings, threads, options, copy_opaque)
+
+    if decoder == 'auto':
+        for device in hardware_devices():
+            try:
+                return open_decoder(device=device), f"{device} (hardware), {settings.description}", True
+            except Exception:
+                continue # Device type compiled in but not present / not permitted
+        label = "software"
+    elif decoder == 'software':
+        label = "software"
+    else:
+        try:
+            if HWAccel is not None and decoder in HW_DEVICE_PREFERENCE + tuple(hwdevices_available()):
+                return open_decoder(device=decoder), f"{decoder} (hardware), {settings.description}", True
+            return open_decoder(decoder), f"{decoder}, {settings.description}", False
+        except Exception as e:
+            print(f"Decoder {decoder} unavailable: {e}")
+            label = f"software ({decoder} unavailable)"
+    return open_decoder(), f"{label}, {settings.description}", False
+
+
+def hardware_active(codec):
+    """True if a hardware-accelerated decoder is producing the frames (checked after the first frame)."""
+    return bool(getattr(codec, 'is_hwaccel', False))
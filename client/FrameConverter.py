@@ -0,0 +1,126 @@
+import weakref
+from collections import deque
+
+import numpy as np
+from av.video.reformatter import VideoReformatter
+from PyQt6.QtGui import QImage
+
+# Output pixel formats: PyAV format name -> (bytes per pixel, matching QImage format)
+PIXEL_FORMATS = {
+    'rgb24': (3, QImage.Format.Format_RGB888),
+    'bgra': (4, QImage.Format.Format_RGB32), # BGRA in memory == 0xffRRGGBB on little-endian
+}
+
+# Scaling quality presets -> swscale interpolation
+INTERPOLATIONS = {
+    'fast': 'FAST_BILINEAR',
+    'smooth': 'BICUBIC',
+}
+
+# Row stride alignment for the pool buffers (QImage needs at least 32-bit aligned scanlines)
+STRIDE_ALIGN = 32
+
+
+def aligned_stride(row_bytes):
+    return (row_bytes + STRIDE_ALIGN - 1) // STRIDE_ALIGN * STRIDE_ALIGN
+
+
+class FrameConverter:
+    """Converts decoded av.VideoFrames into QImages backed by a pool of reused buffers.
+
+    A buffer is reused only once the QImage wrapped around it has been dropped, so the GUI
+    can keep painting an image (e.g. on resize or expose) however many frames come after it.
+    The pool starts with `ring_size` buffers and grows while all of them are still held.
+    """
+
+    def __init__(self, pixel_format='rgb24', ring_size=3, scaling='smooth'):
+        if pixel_format not in PIXEL_FORMATS:
+            raise ValueError(f"Unsupported pixel format: {pixel_format}")
+        if scaling not in INTERPOLATIONS:
+            raise ValueError(f"Unsupported scaling quality: {scaling}")
+        self.pixel_format = pixel_format
+        self.interpolation = INTERPOLATIONS[scaling]
+        self.bytes_per_pixel, self.qimage_format = PIXEL_FORMATS[pixel_format]
+        self.ring_size = max(2, ring_size)
+        self.reformatter = VideoReformatter() # Keeps the SwsContext alive between frames
+        self.ring = []
+        self.free_slots = deque() # Buffers no QImage uses; returned from whichever thread drops the image
+        self.generation = 0 # Of the current pool; buffers of older ones are not returned to it
+        self.width = 0
+        self.height = 0
+        self.stride = 0
+
+        # Display size the output is fitted into (None = keep the stream resolution)
+        self.target_size = None
+        self._fit_key = None
+        self._fit_size = None
+
+    def set_target_size(self, width, height):
+        """Sets the display area in physical pixels; frames are scaled to fit it (aspect kept)."""
+        self.target_size = (width, height) if width > 0 and height > 0 else None
+
+    def _fitted_size(self, src_width, src_height):
+        """Returns the aspect-preserving output size, cached until the source or target changes."""
+        key = (src_width, src_height, self.target_size)
+        if key != self._fit_key:
+            if self.target_size is None:
+                size = (src_width, src_height)
+            else:
+                target_width, target_height = self.target_size
+                scale = min(target_width / src_width, target_height / src_height)
+                # Even dimensions keep swscale on its fast chroma paths
+                size = (max(2, int(src_width * scale) & ~1), max(2, int(src_height * scale) & ~1))
+            self._fit_key = key
+            self._fit_size = size
+        return self._fit_size
+
+    def _allocate(self, width, height):
+        """(Re)allocates the buffer pool for a new stream resolution."""
+        self.stride = aligned_stride(width * self.bytes_per_pixel)
+        self.generation += 1
+        self.ring = [np.empty((height, self.stride), dtype=np.uint8) for _ in range(self.ring_size)]
+        self.free_slots = deque(range(self.ring_size))
+        self.width = width
+        self.height = height
+
+    def convert(self, frame):
+        """Colour-converts and scales a frame to the display size in a single swscale pass.
+
+        Returns (pixels, width, height), where pixels is a (height, row bytes) view of the
+        reformatter's output that stays valid until the next call.
+        """
+        out_width, out_height = self._fitted_size(frame.width, frame.height)
+        converted = self.reformatter.reformat(frame, width=out_width, height=out_height,
+                                              format=self.pixel_format, interpolation=self.interpolation)
+        width, height = converted.width, converted.height
+
+        # View the swscale output in place (rows may be padded to plane.line_size)
+        plane = converted.planes[0]
+        rows = np.frombuffer(plane, dtype=np.uint8).reshape(height, plane.line_size)
+        return rows[:, :width * self.bytes_per_pixel], width, height
+
+    def _release(self, generation, slot):
+        if generation == self.generation:
+            self.free_slots.append(slot)
+
+    def to_qimage(self, frame):
+        """Converts a decoded frame and returns a QImage that shares memory with a pool buffer.
+
+        The buffer is not written again until the QImage is gone; a plain QImage copy made of
+        it (not a .copy()) must not outlive it.
+        """
+        pixels, width, height = self.convert(frame)
+        if (width, height) != (self.width, self.height):
+            self._allocate(width, height)
+
+        try:
+            slot = self.free_slots.popleft()
+        except IndexError:
+            # Every buffer is still shown or queued for the GUI
+            self.ring.append(np.empty_like(self.ring[0]))
+            slot = len(self.ring) - 1
+        buffer = self.ring[slot].view() # Its own object, so the finalizer tracks this image only
+        weakref.finalize(buffer, self._release, self.generation, slot) # Fires once the QImage is gone
+        np.copyto(buffer[:, :pixels.shape[1]], pixels)
+
+        return QImage(buffer, width, height, self.stride, self.qimage_format)
@@ -0,0 +1,112 @@
+import numpy as np
+
+# Decoder output formats whose first plane is full-resolution 8-bit luma
+LUMA_FORMATS = ('yuv420p', 'yuvj420p', 'yuv422p', 'yuvj422p', 'yuv444p', 'yuvj444p', 'nv12')
+
+# Frames are compared on every SAMPLE_STEP-th pixel of every SAMPLE_STEP-th luma row, in tiles of
+# TILE_SIZE x TILE_SIZE source pixels. A sample counts as changed when it differs by more than
+# DIFF_THRESHOLD, which absorbs the re-encoding noise of static content (e.g. periodic IDR pictures).
+TILE_SIZE = 64
+SAMPLE_STEP = 4
+DIFF_THRESHOLD = 6
+
+# With more of the frame dirty than this, it is repainted in full (fewer, larger paints are cheaper)
+FULL_UPDATE_FRACTION = 0.5
+
+
+class FrameDiffer:
+    """Finds the parts of a decoded frame that differ from the last one shown.
+
+    Works on a downsampled copy of the luma plane, so a 1080x2400 frame costs about 160k byte
+    comparisons. `compare(frame)` returns (changed, rects): changed is False for a frame that
+    looks the same as the one on screen (nothing to convert or repaint); rects are the dirty
+    areas as (x, y, width, height) in source pixels, or None if the whole frame should be
+    repainted. Chroma-only changes are not detected.
+    """
+
+    def __init__(self, tile_size=TILE_SIZE, step=SAMPLE_STEP, threshold=DIFF_THRESHOLD):
+        if tile_size % step:
+            raise ValueError("Tile size must be a multiple of the sample step")
+        self.tile_size = tile_size
+        self.step = step
+        self.threshold = threshold
+        self.previous = None # Sampled luma of what is on screen
+        self.force_full = True # Set from other threads (resize); the next frame is shown in full
+        self.frames_compared = 0
+        self.frames_unchanged = 0
+        self.frames_partial = 0
+
+    def reset(self):
+        """Makes the next frame a full update (the display was cleared, resized or replaced)."""
+        self.force_full = True
+
+    @property
+    def skipped_fraction(self):
+        return self.frames_unchanged / self.frames_compared if self.frames_compared else 0.0
+
+    def _sample(self, frame):
+        plane = frame.planes[0]
+        luma = np.frombuffer(plane, np.uint8).reshape(-1, plane.line_size)
+        return luma[:frame.height:self.step, :frame.width:self.step]
+
+    def compare(self, frame):
+        self.frames_compared += 1
+        if frame.format.name not in LUMA_FORMATS:
+            return True, None
+        sample = self._sample(frame)
+        previous = self.previous
+        if self.force_full or previous is None or previous.shape != sample.shape:
+            self.force_full = False
+            self.previous = sample.copy()
+            return True, None
+
+        # |a - b| in uint8 without widening
+        changed = (np.maximum(sample, previous) - np.minimum(sample, previous)) > self.threshold
+        if not changed.any():
+            self.frames_unchanged += 1
+            return False, None
+
+        cells = self.tile_size // self.step # Samples per tile side
+        rows = np.arange(0, changed.shape[0], cells)
+        columns = np.arange(0, changed.shape[1], cells)
+        tiles = np.logical_or.reduceat(np.logical_or.reduceat(changed, rows, axis=0), columns, axis=1)
+
+        # Only the repainted tiles become the new reference, so sub-threshold drift elsewhere still adds up
+        mask = tiles.repeat(cells, axis=0).repeat(cells, axis=1)[:sample.shape[0], :sample.shape[1]]
+        np.copyto(previous, sample, where=mask)
+
+        if tiles.mean() > FULL_UPDATE_FRACTION:
+            return True, None
+        self.frames_partial += 1
+        return True, self._rects(tiles, frame.width, frame.height)
+
+    def _rects(self, tiles, width, height):
+        """Merges dirty tiles into rectangles: runs along each tile row, joined with identical runs below."""
+        size = self.tile_size
+        rects = []
+        open_runs = {} # (first column, last column) -> index in rects, for runs that continue downwards
+        for row, line in enumerate(tiles):
+            runs = {}
+            # Run boundaries: where the row switches between clean and dirty tiles
+            edges = np.flatnonzero(np.diff(np.concatenate(([False], line, [False])).astype(np.int8)))
+            for start, stop in zip(edges[::2], edges[1::2]):
+                span = (int(start), int(stop))
+                index = open_runs.get(span)
+                if index is None:
+                    x, y = span[0] * size, row * size
+                    rects.append([x, y, min(span[1] * size, width) - x, 0])
+                    index = len(rects) - 1
+                rect = rects[index]
+                rect[3] = min((row + 1) * size, height) - rect[1]
+                runs[span] = index
+            open_runs = runs
+        return [tuple(rect) for rect in rects]
+
+
+def merge_dirty(replaced, newer):
+    """QtBatchBridge merge for frame channels: a frame replacing one the GUI never showed also repaints its areas."""
+    frame = newer[0]
+    if getattr(frame, 'dirty', None) is not None:
+        previous = getattr(replaced[0], 'dirty', None)
+        frame.dirty = None if previous is None else previous + frame.dirty
+    return newer
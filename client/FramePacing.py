@@ -0,0 +1,170 @@
+import math
+import threading
+import time
+from collections import deque
+
+# Most frames the jitter buffer may hold back to smooth out bursts; 0 shows the newest frame at once
+DEFAULT_BUFFER_FRAMES = 2
+
+# Assumed display refresh until the GUI reports the screen's (s)
+DEFAULT_REFRESH_INTERVAL = 1 / 60
+
+# Gaps longer than this are the phone not sending (static screen), not jitter (s)
+IDLE_GAP = 0.25
+
+# Lateness estimate: follows rises quickly and falls slowly, so the buffer stays up through a bad patch
+JITTER_RISE = 1 / 4
+JITTER_FALL = 1 / 32
+
+# Arrivals the frame interval and the cadence baseline are estimated over
+CADENCE_WINDOW = 32
+
+# Without the display's vsync, releases may come this much (of a refresh interval) early, so the
+# virtual refresh grid slides back to the stream instead of keeping the phase a hiccup gave it
+SLOT_SLACK = 0.25
+
+# A frame counts as late when released this many refresh intervals after its scheduled time
+LATE_REFRESHES = 1.5
+
+
+class FramePacer:
+    """Decoded frames -> render thread, at most one per display refresh, through an adaptive jitter buffer.
+
+    Takes the place of StreamReceiver's LatestFrameSlot (same put/get/close/dropped). Each frame is
+    timestamped as it leaves the decoder and compared with the stream's cadence, which the earliest
+    arrivals define. How late frames come against it (the jitter) sets the playout delay: each
+    frame is due at its place in the cadence plus that delay, capped at `max_depth` frame
+    intervals. A steady stream is shown as it arrives; a bursty one is evened out, at the cost of
+    the delay, for as long as the bursts last. After an idle gap (static screen) the next frame
+    starts a new cadence and is due at once.
+
+    get() releases a frame no sooner than one refresh interval after the previous one, lined up
+    with the display's vsync once the GUI reports it (vsync()). Of the frames due by then only the
+    newest is released; the others are dropped before conversion, as nobody would see them. A frame
+    released well over a refresh interval after its scheduled time (it arrived too late for the
+    buffer, or the render thread fell behind) counts as late.
+    """
+
+    def __init__(self, max_depth=DEFAULT_BUFFER_FRAMES, refresh_interval=DEFAULT_REFRESH_INTERVAL):
+        self._cond = threading.Condition()
+        self._frames = deque() # (frame, due, scheduled or None) in decode order; times are time.perf_counter()
+        self._closed = False
+        self.max_depth = max_depth
+        self.refresh_interval = refresh_interval
+        self.vsync_time = None # A recent vsync of the display the video is shown on (None: not known)
+        self.lead = 0.0 # Conversion and hand-over time, taken off the vsync (EWMA, s)
+
+        # Stream cadence, estimated from arrivals
+        self.frame_interval = None
+        self.jitter = 0.0 # How late frames arrive against the cadence (s)
+        self.arrivals = deque(maxlen=CADENCE_WINDOW) # [arrival, lateness] since the last idle gap
+        self.expected = None # When the last frame would have arrived without jitter
+        self.last_slot = None # Refresh slot of the last release (a virtual vsync grid until the real one is known)
+
+        self.dropped = 0 # Decoded but never shown: a newer frame was due by the same refresh
+        self.late = 0
+
+    @property
+    def target_delay(self):
+        """Playout delay behind the cadence (s): the measured jitter, up to max_depth frame intervals."""
+        if not self.max_depth or not self.frame_interval:
+            return 0.0
+        return min(self.max_depth * self.frame_interval, self.jitter)
+
+    @property
+    def target_depth(self):
+        """The playout delay in frames."""
+        return round(self.target_delay / self.frame_interval) if self.frame_interval else 0
+
+    def set_refresh_rate(self, hz):
+        """Refresh rate of the screen the video is on (QScreen.refreshRate())."""
+        if hz > 0:
+            with self._cond:
+                self.refresh_interval = 1.0 / hz
+                self._cond.notify()
+
+    def vsync(self, timestamp):
+        """A buffer swap of the video widget just completed (GL renderer: frameSwapped), at perf_counter() `timestamp`."""
+        self.vsync_time = timestamp
+
+    def frame_rendered(self, seconds):
+        """Time the render thread took from release to emitting the frame; releases start that much ahead of vsync."""
+        self.lead += (min(seconds, self.refresh_interval) - self.lead) / 8
+
+    def put(self, frame):
+        now = time.perf_counter()
+        with self._cond:
+            arrivals = self.arrivals
+            if arrivals and now - arrivals[-1][0] < max(3 * (self.frame_interval or 0), IDLE_GAP):
+                expected = self.expected + (self.frame_interval or now - arrivals[-1][0])
+                arrivals.append([now, now - expected])
+                self.frame_interval = max((now - arrivals[0][0]) / (len(arrivals) - 1), 1e-3)
+                # The cadence runs through the earliest arrivals of the window: a frame ahead of it
+                # moves it earlier, and when every recent frame came late it moves later
+                shift = min(late for _, late in arrivals)
+                if shift:
+                    expected += shift
+                    for entry in arrivals:
+                        entry[1] -= shift
+            else:
+                arrivals.clear()
+                arrivals.append([now, 0.0])
+                expected = now # First frame, or the first after an idle gap
+            self.expected = expected
+
+            lateness = now - expected
+            self.jitter += (lateness - self.jitter) * (JITTER_RISE if lateness > self.jitter else JITTER_FALL)
+            # More than the buffer can take only makes it slower to shrink again (e.g. after the decoder's start-up burst)
+            self.jitter = min(self.jitter, self.max_depth * self.frame_interval if self.frame_interval else 0.0)
+            scheduled = expected + self.target_delay
+            # Lateness is counted once a full window has settled the cadence (not in the decoder's start-up burst)
+            settled = len(arrivals) == CADENCE_WINDOW
+            self._frames.append((frame, max(now, scheduled), scheduled if settled else None))
+            self._cond.notify()
+
+    def _release_time(self, due):
+        """Earliest moment the render thread may take a frame due at `due`."""
+        interval = self.refresh_interval
+        t = due
+        vsync_time = self.vsync_time
+        if self.last_slot is not None:
+            t = max(t, self.last_slot + interval * (1.0 if vsync_time is not None else 1.0 - SLOT_SLACK))
+        if vsync_time is not None:
+            # Locked to the display: start converting `lead` before the first vsync at or after t
+            t = vsync_time + math.ceil((t + self.lead - vsync_time) / interval) * interval - self.lead
+        return t
+
+    def get(self, timeout=None):
+        """Blocks until a frame is due for display. Returns None on timeout or close."""
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        with self._cond:
+            while not self._closed:
+                now = time.perf_counter()
+                wait = None if deadline is None else deadline - now
+                if self._frames:
+                    release = self._release_time(self._frames[0][1])
+                    if now >= release:
+                        return self._release(now, release)
+                    wait = release - now if wait is None else min(wait, release - now)
+                if wait is not None and wait <= 0:
+                    return None
+                self._cond.wait(wait)
+            return None
+
+    def _release(self, now, slot):
+        frames = self._frames
+        frame, due, scheduled = frames.popleft()
+        while frames and frames[0][1] <= now:
+            frame, due, scheduled = frames.popleft()
+            self.dropped += 1
+        # Slots step on from the last one, not from when this thread woke up, so wake-up delays do not add up
+        self.last_slot = slot
+        if scheduled is not None and now - scheduled > LATE_REFRESHES * self.refresh_interval:
+            self.late += 1
+        return frame
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._frames.clear()
+            self._cond.notify_all()
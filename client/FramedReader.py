@@ -0,0 +1,144 @@
+import asyncio
+import json
+import struct
+import time
+
+# Every NAL unit on the video channel is preceded by its size (4-byte big-endian, see DESIGN.md)
+SIZE_PREFIX = struct.Struct('>I')
+
+# A size prefix above this is treated as a corrupt stream rather than an allocation request
+MAX_NAL_SIZE = 16 * 1024 * 1024
+
+# Receive buffer granularity; a unit larger than this gets a chunk of its own
+CHUNK_SIZE = 256 * 1024
+
+# Start a new chunk instead of asking the socket for fewer bytes than this
+MIN_READ_SIZE = 16 * 1024
+
+# Upper bound for the server's JSON configuration line
+MAX_CONFIG_SIZE = 4096
+
+
+class FramingError(ValueError):
+    """The video stream cannot be split into size-prefixed NAL units."""
+
+
+class NalStreamProtocol(asyncio.BufferedProtocol):
+    """Splits the video channel into NAL units straight out of the socket receive buffer.
+
+    The socket reads into chunks that are only ever appended to, so every complete unit is
+    handed to `on_nal(view, received)` as a memoryview into its chunk without being copied,
+    and units stay valid while queued. Only a unit that straddles the end of a chunk is
+    moved to the start of the next one. All units that arrived in one read are parsed in a
+    single pass and share the same `received` perf_counter() timestamp.
+
+    The server opens the stream with a JSON configuration line ({"width": ...}), which is
+    passed to `on_config(dict)`. Streams starting directly with a size prefix are accepted too.
+    Every read is also passed to `capture.write(view)` when a StreamCapture.CaptureWriter is given.
+    """
+
+    def __init__(self, on_nal, on_config=None, max_nal_size=MAX_NAL_SIZE, chunk_size=CHUNK_SIZE, capture=None):
+        self.on_nal = on_nal
+        self.on_config = on_config
+        self.capture = capture
+        self.max_nal_size = max_nal_size
+        self.chunk_size = chunk_size
+        self.chunk = bytearray(chunk_size)
+        self.view = memoryview(self.chunk)
+        self.start = 0 # First byte not yet parsed
+        self.end = 0 # End of received data
+        self.needed = SIZE_PREFIX.size # Bytes from `start` the pending unit needs in total
+        self.awaiting_config = True
+        self.transport = None
+        self.closed = asyncio.get_running_loop().create_future()
+
+        # Statistics
+        self.bytes_received = 0
+        self.units_parsed = 0
+        self.chunks_allocated = 1
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if self.capture:
+            self.capture.new_connection()
+
+    def get_buffer(self, sizehint):
+        free = len(self.chunk) - self.end
+        pending = self.end - self.start
+        # Move on when the pending unit cannot complete here, or to avoid tiny reads (cheap: little to copy)
+        if self.start + self.needed > len(self.chunk) or (free < MIN_READ_SIZE and pending < MIN_READ_SIZE):
+            self._next_chunk()
+        return self.view[self.end:]
+
+    def buffer_updated(self, nbytes):
+        if self.capture:
+            self.capture.write(self.view[self.end:self.end + nbytes]) # Chunks are never reused: no copy needed
+        self.end += nbytes
+        self.bytes_received += nbytes
+        try:
+            self._parse()
+        except Exception as e:
+            # Includes errors raised by the consumer; end the stream instead of losing sync
+            self._finish(e)
+            self.transport.abort()
+
+    def eof_received(self):
+        return False # Let the transport close
+
+    def connection_lost(self, exc):
+        self._finish(exc)
+
+    def _finish(self, exc):
+        if self.closed.done():
+            return
+        if exc is None:
+            self.closed.set_result(None)
+        else:
+            self.closed.set_exception(exc)
+
+    def _next_chunk(self):
+        """Continues in a fresh chunk, carrying over the partially received unit."""
+        pending = self.end - self.start
+        chunk = bytearray(max(self.chunk_size, self.needed))
+        chunk[:pending] = self.view[self.start:self.end]
+        self.chunk = chunk
+        self.view = memoryview(chunk)
+        self.start = 0
+        self.end = pending
+        self.chunks_allocated += 1
+
+    def _parse(self):
+        chunk, view, pos, end = self.chunk, self.view, self.start, self.end
+        if self.awaiting_config:
+            if chunk[pos] == 0x7B: # '{': configuration line
+                newline = chunk.find(b'\n', pos, end)
+                if newline < 0:
+                    if end - pos > MAX_CONFIG_SIZE:
+                        raise FramingError("Configuration line too long")
+                    self.needed = end - pos + 1
+                    return
+                try:
+                    config = json.loads(bytes(view[pos:newline]))
+                except ValueError as e:
+                    raise FramingError(f"Invalid configuration line: {e}")
+                pos = newline + 1
+                if self.on_config:
+                    self.on_config(config)
+            self.awaiting_config = False
+
+        received = time.perf_counter()
+        prefix = SIZE_PREFIX.size
+        while end - pos >= prefix:
+            size, = SIZE_PREFIX.unpack_from(chunk, pos)
+            if size > self.max_nal_size:
+                raise FramingError(f"NAL size {size} exceeds the {self.max_nal_size} byte limit")
+            if end - pos - prefix < size:
+                self.needed = prefix + size
+                break
+            pos += prefix
+            self.on_nal(view[pos:pos + size], received)
+            pos += size
+            self.units_parsed += 1
+        else:
+            self.needed = prefix
+        self.start = pos
@@ -0,0 +1,207 @@
+from PyQt6.QtGui import QOpenGLContext, QPainter, QVector2D
+from PyQt6.QtOpenGL import (
+    QOpenGLShader, QOpenGLShaderProgram, QOpenGLTexture, QOpenGLPixelTransferOptions,
+    QOpenGLVersionFunctionsFactory, QOpenGLVersionProfile
+)
+from PyQt6.QtOpenGLWidgets import QOpenGLWidget
+from PyQt6.QtCore import pyqtSignal
+
+from PointerOverlay import PointerInput
+
+# Raw GL enums (PyQt6 does not export the GL constants)
+GL_COLOR_BUFFER_BIT = 0x4000
+GL_TRIANGLE_STRIP = 0x0005
+
+# Pixel formats whose planes can be uploaded as-is (three 8-bit planes, 2x2 chroma subsampling)
+YUV_FORMATS = ('yuv420p', 'yuvj420p')
+
+VERTEX_SHADER = """
+attribute vec2 a_position;
+attribute vec2 a_texcoord;
+uniform vec2 u_scale;
+varying vec2 v_texcoord;
+void main() {
+    v_texcoord = a_texcoord;
+    gl_Position = vec4(a_position * u_scale, 0.0, 1.0);
+}
+"""
+
+FRAGMENT_SHADER = """
+#ifdef GL_ES
+precision mediump float;
+#endif
+uniform sampler2D u_tex_y;
+uniform sampler2D u_tex_u;
+uniform sampler2D u_tex_v;
+uniform vec2 u_luma;    // (offset, scale) for limited/full range luma
+uniform vec4 u_chroma;  // (Cr->R, Cb->G, Cr->G, Cb->B) BT.601 coefficients
+varying vec2 v_texcoord;
+void main() {
+    float y = (texture2D(u_tex_y, v_texcoord).r - u_luma.x) * u_luma.y;
+    float u = texture2D(u_tex_u, v_texcoord).r - 0.5;
+    float v = texture2D(u_tex_v, v_texcoord).r - 0.5;
+    gl_FragColor = vec4(y + u_chroma.x * v,
+                        y - u_chroma.y * u - u_chroma.z * v,
+                        y + u_chroma.w * u,
+                        1.0);
+}
+"""
+
+# Full-screen quad as a triangle strip; texture row 0 is the top of the frame
+QUAD_POSITIONS = [QVector2D(-1, -1), QVector2D(1, -1), QVector2D(-1, 1), QVector2D(1, 1)]
+QUAD_TEXCOORDS = [QVector2D(0, 1), QVector2D(1, 1), QVector2D(0, 0), QVector2D(1, 0)]
+
+# BT.601 conversion constants (MediaCodec's default for SD/HD screen capture)
+LIMITED_RANGE_LUMA = (16.0 / 255.0, 255.0 / 219.0)
+FULL_RANGE_LUMA = (0.0, 1.0)
+LIMITED_RANGE_CHROMA = (1.596, 0.392, 0.813, 2.017)
+FULL_RANGE_CHROMA = (1.402, 0.344, 0.714, 1.772)
+
+
+class GLVideoWidget(PointerInput, QOpenGLWidget):
+    """Displays decoded yuv420p frames with the YUV->RGB conversion and scaling done on the GPU."""
+    # Emitted if the GL pipeline cannot be set up, so the window can fall back to QPainter
+    renderer_failed = pyqtSignal(str)
+    # Mouse input in device coordinates: x, y, buttons, action (PointerOverlay.ACTION_*)
+    pointer_event = pyqtSignal(int, int, int, int)
+    # Touch and gesture input: time (perf_counter), [(pointer, action, device x, device y, pressure)] (TouchInput)
+    touch_event = pyqtSignal(float, object)
+    # Wheel steps: time, device x, device y, horizontal and vertical delta (Qt angleDelta)
+    scroll_event = pyqtSignal(float, int, int, int, int)
+
+    def __init__(self, parent=None, pointer_overlay=True, mouse_as_touch=True):
+        super().__init__(parent)
+        self.frame = None
+        self.frame_dirty = False
+        self.program = None
+        self.gl = None
+        self.textures = []
+        self.texture_size = None
+        self.metrics = None # PipelineMetrics when instrumentation is enabled
+        self.painted_frame = None
+        self._init_pointer_input(pointer_overlay, mouse_as_touch)
+
+    @staticmethod
+    def is_supported():
+        """Returns True if the platform can create an OpenGL context (Mesa/llvmpipe included)."""
+        context = QOpenGLContext()
+        return context.create()
+
+    def setFrame(self, frame):
+        """Takes an av.VideoFrame in yuv420p/yuvj420p (or None to clear the display)."""
+        if frame is None and self.overlay:
+            self.overlay.clear()
+        self.frame = frame
+        self.frame_dirty = True
+        self.update()
+
+    def initializeGL(self):
+        profile = QOpenGLVersionProfile()
+        profile.setVersion(2, 0)
+        self.gl = QOpenGLVersionFunctionsFactory.get(profile, self.context())
+        if self.gl is None:
+            self.renderer_failed.emit("OpenGL 2.0 functions unavailable")
+            return
+
+        self.program = QOpenGLShaderProgram(self)
+        if (not self.program.addShaderFromSourceCode(QOpenGLShader.ShaderTypeBit.Vertex, VERTEX_SHADER)
+                or not self.program.addShaderFromSourceCode(QOpenGLShader.ShaderTypeBit.Fragment, FRAGMENT_SHADER)
+                or not self.program.link()):
+            log = self.program.log()
+            self.program = None
+            self.renderer_failed.emit(f"YUV shader failed: {log}")
+            return
+
+        self.context().aboutToBeDestroyed.connect(self._release_textures)
+        self.gl.glClearColor(0.0, 0.0, 0.0, 1.0)
+
+    def _release_textures(self):
+        self.makeCurrent()
+        for texture in self.textures:
+            texture.destroy()
+        self.textures = []
+        self.texture_size = None
+        self.doneCurrent()
+
+    def _allocate_textures(self, width, height):
+        """Creates one single-channel texture per plane for a new frame size."""
+        for texture in self.textures:
+            texture.destroy()
+        self.textures = []
+        chroma_width, chroma_height = (width + 1) // 2, (height + 1) // 2
+        for plane_width, plane_height in ((width, height), (chroma_width, chroma_height), (chroma_width, chroma_height)):
+            texture = QOpenGLTexture(QOpenGLTexture.Target.Target2D)
+            texture.setFormat(QOpenGLTexture.TextureFormat.R8_UNorm)
+            texture.setSize(plane_width, plane_height)
+            texture.setMinMagFilters(QOpenGLTexture.Filter.Linear, QOpenGLTexture.Filter.Linear)
+            texture.setWrapMode(QOpenGLTexture.WrapMode.ClampToEdge)
+            texture.allocateStorage(QOpenGLTexture.PixelFormat.Red, QOpenGLTexture.PixelType.UInt8)
+            self.textures.append(texture)
+        self.texture_size = (width, height)
+
+    def _upload_frame(self, frame):
+        """Uploads the Y, U and V planes straight from the decoder's buffers."""
+        if (frame.width, frame.height) != self.texture_size:
+            self._allocate_textures(frame.width, frame.height)
+        for texture, plane in zip(self.textures, frame.planes):
+            # Planes may be padded; row length tells GL to skip the padding without a copy
+            options = QOpenGLPixelTransferOptions()
+            options.setAlignment(1)
+            options.setRowLength(plane.line_size)
+            texture.setData(QOpenGLTexture.PixelFormat.Red, QOpenGLTexture.PixelType.UInt8, plane.buffer_ptr, options)
+
+    def paintGL(self):
+        if self.gl is None:
+            return
+        self.gl.glClear(GL_COLOR_BUFFER_BIT)
+        frame = self.frame
+        if frame is None or self.program is None:
+            return
+
+        if self.frame_dirty:
+            self._upload_frame(frame)
+            self.frame_dirty = False
+
+        # Aspect-preserving fit: shrink the quad along one axis to letterbox the frame
+        scale = min(self.width() / frame.width, self.height() / frame.height)
+        scale_x = frame.width * scale / max(1, self.width())
+        scale_y = frame.height * scale / max(1, self.height())
+        width, height = int(frame.width * scale), int(frame.height * scale)
+        self._set_video_rect((self.width() - width) // 2, (self.height() - height) // 2, width, height)
+
+        full_range = frame.format.name == 'yuvj420p'
+        luma = FULL_RANGE_LUMA if full_range else LIMITED_RANGE_LUMA
+        chroma = FULL_RANGE_CHROMA if full_range else LIMITED_RANGE_CHROMA
+
+        self.program.bind()
+        for unit, (texture, name) in enumerate(zip(self.textures, ('u_tex_y', 'u_tex_u', 'u_tex_v'))):
+            texture.bind(unit)
+            self.program.setUniformValue(self.program.uniformLocation(name), unit)
+        self.program.setUniformValue(self.program.uniformLocation('u_scale'), float(scale_x), float(scale_y))
+        self.program.setUniformValue(self.program.uniformLocation('u_luma'), *luma)
+        self.program.setUniformValue(self.program.uniformLocation('u_chroma'), *chroma)
+
+        self.program.enableAttributeArray('a_position')
+        self.program.enableAttributeArray('a_texcoord')
+        self.program.setAttributeArray('a_position', QUAD_POSITIONS)
+        self.program.setAttributeArray('a_texcoord', QUAD_TEXCOORDS)
+        self.gl.glDrawArrays(GL_TRIANGLE_STRIP, 0, 4)
+        self.program.disableAttributeArray('a_position')
+        self.program.disableAttributeArray('a_texcoord')
+
+        for unit, texture in enumerate(self.textures):
+            texture.release(unit)
+        self.program.release()
+
+        if self.overlay:
+            painter = QPainter(self)
+            self._paint_overlay(painter)
+            painter.end()
+
+        if self.metrics:
+            if frame is not self.painted_frame:
+                self.painted_frame = frame
+                self.metrics.count('frames_painted')
+                timing = getattr(frame, 'opaque', None)
+                if timing:
+                    self.metrics.frame_painted(timing)
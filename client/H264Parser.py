@@ -0,0 +1,179 @@
+# H.264 NAL unit types used by the client
+NAL_TYPE_SLICE = 1
+NAL_TYPE_IDR = 5
+NAL_TYPE_SEI = 6
+NAL_TYPE_SPS = 7
+NAL_TYPE_PPS = 8
+NAL_TYPE_AUD = 9
+
+# Slice NAL types (the ones that carry picture data)
+VCL_NAL_TYPES = (NAL_TYPE_SLICE, NAL_TYPE_IDR)
+
+
+def _start_code_length(data, offset):
+    """Returns 4 or 3 if an Annex-B start code begins at offset, else 0."""
+    if data[offset:offset + 4] == b'\x00\x00\x00\x01':
+        return 4
+    if data[offset:offset + 3] == b'\x00\x00\x01':
+        return 3
+    return 0
+
+
+def nal_unit_type(nal_data):
+    """Returns the H.264 NAL unit type, skipping an Annex-B start code if present."""
+    offset = _start_code_length(nal_data, 0)
+    if len(nal_data) <= offset:
+        return None
+    return nal_data[offset] & 0x1F
+
+
+def iter_nal_units(data):
+    """Yields (nal_type, start, end) for each NAL in a buffer, where start/end include the start code.
+
+    A buffer without a leading start code is treated as a single raw NAL unit.
+    """
+    data = bytes(data) if isinstance(data, memoryview) else data
+    if not _start_code_length(data, 0):
+        if data:
+            yield data[0] & 0x1F, 0, len(data)
+        return
+
+    start = 0
+    while start < len(data):
+        header = start + _start_code_length(data, start)
+        next_start = data.find(b'\x00\x00\x01', header)
+        if next_start < 0:
+            end = len(data)
+        else:
+            # A 4-byte start code owns the preceding zero byte
+            end = next_start - 1 if next_start > header and data[next_start - 1] == 0 else next_start
+        if header < len(data):
+            yield data[header] & 0x1F, start, end
+        if next_start < 0:
+            break
+        start = end
+
+
+# Bytes of a unit copied and parsed before falling back to a scan of the whole unit
+SCAN_HEAD_SIZE = 1024
+
+
+def scan_unit(data, head_size=SCAN_HEAD_SIZE):
+    """Parses the NAL units in front of the first slice of a buffer.
+
+    Returns (parameter_sets, slice_type, new_picture): a {NAL_TYPE_SPS/PPS: nal} dict of the
+    parameter sets found, the type of the first slice (None if there is none) and whether that
+    slice begins a picture. Slices usually start within the first bytes of a unit, so only
+    that head is copied out of a memoryview.
+    """
+    head = bytes(data[:head_size])
+    complete = len(head) == len(data)
+    parameter_sets = {}
+    for nal_type, start, end in iter_nal_units(head):
+        if nal_type in VCL_NAL_TYPES:
+            header = start + _start_code_length(head, start)
+            if header + 1 < len(head):
+                return parameter_sets, nal_type, bool(head[header + 1] & 0x80)
+            if complete:
+                return parameter_sets, nal_type, False
+        elif complete or end < len(head):
+            if nal_type in (NAL_TYPE_SPS, NAL_TYPE_PPS):
+                parameter_sets[nal_type] = head[start:end]
+            continue
+        # The head ends inside this NAL unit; parse the whole buffer instead
+        return scan_unit(data, len(data))
+    return parameter_sets, None, False
+
+
+class AccessUnitAssembler:
+    """Groups received NAL units into access units, so the decoder gets one packet per picture.
+
+    SPS/PPS are cached and put in front of each IDR picture that does not carry its own; SEI
+    and AUD units are attached to the next picture. Senders that deliver one whole picture per
+    unit (MediaCodec does) get each picture released the moment it arrives. If slices of a
+    picture arrive in separate units, pictures are held until the next one starts instead.
+
+    Nothing is released before the first IDR, or after `resync()` until the next one, so a
+    decoder never gets pictures whose references are missing.
+    """
+
+    def __init__(self):
+        self.sps = None
+        self.pps = None
+        self.prefix = [] # SEI/AUD units waiting for the next picture
+        self.parts = [] # Units of the held picture
+        self.keyframe = False
+        self.has_parameter_sets = False
+        self.tag = None
+        self.whole_pictures = None # Unknown until the unit after the first picture arrives
+        self.awaiting_idr = True
+        self.pictures_released = 0
+        self.pictures_skipped = 0
+
+    def push(self, data, tag=None):
+        """Adds one received unit; returns the access units it completes as (data, keyframe, tag)."""
+        parameter_sets, slice_type, new_picture = scan_unit(data)
+        self.sps = parameter_sets.get(NAL_TYPE_SPS, self.sps)
+        self.pps = parameter_sets.get(NAL_TYPE_PPS, self.pps)
+
+        if slice_type is None:
+            # Non-slice units precede the picture they belong to
+            released = self._release()
+            if not parameter_sets: # Parameter sets come from the cache at the next IDR
+                self.prefix.append(data)
+            return released
+
+        if not new_picture:
+            if self.parts:
+                # Further slices of the held picture
+                self.parts.append(data)
+                self.keyframe = self.keyframe or slice_type == NAL_TYPE_IDR
+                self.whole_pictures = False
+                return []
+            # Continuation of a picture that has already been released incomplete
+            self.whole_pictures = False
+            self.pictures_skipped += 1
+            self.resync()
+            return []
+
+        released = []
+        if self.parts:
+            if self.whole_pictures is None:
+                self.whole_pictures = True
+            released = self._release()
+        self.parts = self.prefix + [data]
+        self.prefix = []
+        self.keyframe = slice_type == NAL_TYPE_IDR
+        self.has_parameter_sets = len(parameter_sets) == 2
+        self.tag = tag
+        if self.whole_pictures:
+            released += self._release()
+        return released
+
+    def flush(self):
+        """Releases the held picture (at the end of the stream)."""
+        return self._release()
+
+    def resync(self):
+        """Drops pictures until the next IDR (after lost or undecodable data)."""
+        self.awaiting_idr = True
+
+    def discard(self):
+        """Forgets a partly received picture and resyncs (its connection is gone); SPS/PPS stay cached."""
+        self.parts = []
+        self.prefix = []
+        self.resync()
+
+    def _release(self):
+        if not self.parts:
+            return []
+        parts, self.parts = self.parts, []
+        if self.awaiting_idr:
+            if not self.keyframe or self.sps is None or self.pps is None:
+                self.pictures_skipped += 1
+                return []
+            self.awaiting_idr = False
+        if self.keyframe and not self.has_parameter_sets:
+            parts = [self.sps, self.pps] + parts
+        self.pictures_released += 1
+        return [(parts[0] if len(parts) == 1 else b''.join(parts), self.keyframe, self.tag)]
@@ -0,0 +1,260 @@
+import json
+import math
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PyQt6.QtWidgets import QLabel
+
+# Default number of samples kept by a rolling histogram
+DEFAULT_WINDOW = 1000
+
+
+class LatencyHistogram:
+    """Rolling window of latency samples (ms) with percentile, max and jitter summaries."""
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.last = None
+        self.jitter = 0.0
+
+    def add(self, value_ms):
+        if self.last is not None:
+            # Interarrival jitter estimator from RFC 3550 (smoothed mean absolute difference)
+            self.jitter += (abs(value_ms - self.last) - self.jitter) / 16.0
+        self.last = value_ms
+        self.samples.append(value_ms)
+        self.count += 1
+
+    def clear(self):
+        self.samples.clear()
+        self.count = 0
+        self.last = None
+        self.jitter = 0.0
+
+    def summary(self):
+        """Returns count/min/mean/p50/p95/p99/max/jitter over the current window."""
+        values = sorted(self.samples) # list() of a deque is atomic, so this is safe across threads
+        if not values:
+            return {"count": self.count, "min": 0.0, "mean": 0.0, "p50": 0.0, "p95": 0.0,
+                    "p99": 0.0, "max": 0.0, "jitter": self.jitter}
+        return {
+            "count": self.count,
+            "min": values[0],
+            "mean": sum(values) / len(values),
+            "p50": _percentile(values, 50),
+            "p95": _percentile(values, 95),
+            "p99": _percentile(values, 99),
+            "max": values[-1],
+            "jitter": self.jitter,
+        }
+
+
+def _percentile(sorted_values, percent):
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(1, math.ceil(percent / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+# --- Frame pipeline instrumentation ---
+
+# Stage intervals (ms): received->packet built, packet->decoded, decoded->converted,
+# converted->emitted, emitted->painted, and the whole received->painted path
+STAGES = ('network', 'decode', 'convert', 'emit', 'paint', 'total')
+
+# Monotonic counters; per-second rates are derived for each of them when publishing
+COUNTERS = ('bytes_received', 'nals_received', 'frames_decoded', 'frames_painted')
+
+
+class FrameTiming:
+    """perf_counter() timestamps of one frame as it moves through the pipeline."""
+    __slots__ = ('received', 'packet', 'decoded', 'converted', 'emitted')
+
+    def __init__(self, received):
+        self.received = received
+        self.packet = None
+        self.decoded = None
+        self.converted = None
+        self.emitted = None
+
+
+class PipelineMetrics:
+    """Per-stage latency histograms and throughput counters, exported through pluggable sinks.
+
+    Instrumented code keeps a reference that is None when metrics are disabled, so the
+    disabled cost is a single attribute check per stage.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.histograms = {stage: LatencyHistogram(window) for stage in STAGES}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.sinks = []
+        self.last_publish = time.monotonic()
+        self.last_counters = dict(self.counters)
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def observe(self, stage, start, end):
+        if start is not None and end is not None:
+            self.histograms[stage].add((end - start) * 1000)
+
+    def frame_decoded(self, timing):
+        timing.decoded = time.perf_counter()
+        self.observe('decode', timing.packet, timing.decoded)
+
+    def frame_converted(self, timing):
+        timing.converted = time.perf_counter()
+        self.observe('convert', timing.decoded, timing.converted)
+
+    def frame_emitted(self, timing):
+        timing.emitted = time.perf_counter()
+        self.observe('emit', timing.converted, timing.emitted)
+
+    def frame_painted(self, timing):
+        """Called from the GUI thread once a frame has actually been drawn."""
+        painted = time.perf_counter()
+        self.observe('paint', timing.emitted, painted)
+        self.observe('total', timing.received, painted)
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def snapshot(self, gauges=None):
+        """Returns counters, per-second rates, stage latency summaries and extra gauges."""
+        now = time.monotonic()
+        elapsed = max(now - self.last_publish, 1e-6)
+        counters = dict(self.counters)
+        rates = {name: (counters[name] - self.last_counters[name]) / elapsed for name in COUNTERS}
+        self.last_publish = now
+        self.last_counters = counters
+        return {
+            "timestamp": time.time(),
+            "counters": counters,
+            "rates": rates,
+            "stages": {stage: histogram.summary() for stage, histogram in self.histograms.items()},
+            "gauges": dict(gauges or {}),
+        }
+
+    def publish(self, gauges=None):
+        """Takes a snapshot and hands it to every sink."""
+        snapshot = self.snapshot(gauges)
+        for sink in self.sinks:
+            try:
+                sink.publish(snapshot)
+            except Exception as e:
+                print(f"Metrics sink error: {e}")
+        return snapshot
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+        self.sinks = []
+
+
+class MetricsSink:
+    """Base class for metrics exporters."""
+
+    def publish(self, snapshot):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JsonLinesSink(MetricsSink):
+    """Appends one JSON object per snapshot to a file."""
+
+    def __init__(self, path):
+        self.file = open(path, "a", buffering=1)
+
+    def publish(self, snapshot):
+        self.file.write(json.dumps(snapshot) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class PrometheusSink(MetricsSink):
+    """Serves the latest snapshot in Prometheus text format on a local HTTP endpoint."""
+
+    def __init__(self, port, host="127.0.0.1"):
+        self.text = ""
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = sink.text.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # Keep scrapes out of the console
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name="SCX-Metrics", daemon=True)
+        self.thread.start()
+
+    def publish(self, snapshot):
+        self.text = format_prometheus(snapshot)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class OverlaySink(MetricsSink):
+    """Shows a compact summary in a label drawn on top of the video widget."""
+
+    def __init__(self, parent_widget):
+        self.label = QLabel(parent_widget)
+        self.label.setStyleSheet("background-color: rgba(0, 0, 0, 160); color: #9cdcfe;"
+                                 "font-family: monospace; padding: 4px;")
+        self.label.move(8, 8)
+        self.label.show()
+
+    def publish(self, snapshot):
+        rates = snapshot["rates"]
+        lines = [f"{rates['bytes_received'] * 8 / 1e6:6.2f} Mbit/s  {rates['nals_received']:5.0f} NAL/s  "
+                 f"{rates['frames_decoded']:4.0f} dec/s  {rates['frames_painted']:4.0f} paint/s"]
+        for stage, summary in snapshot["stages"].items():
+            lines.append(f"{stage:>8}: p50 {summary['p50']:6.1f}  p95 {summary['p95']:6.1f}  max {summary['max']:6.1f} ms")
+        lines.extend(f"{name}: {value}" for name, value in snapshot["gauges"].items())
+        self.label.setText("\n".join(lines))
+        self.label.adjustSize()
+        self.label.raise_()
+
+    def close(self):
+        self.label.deleteLater()
+
+
+def _sample_value(value):
+    """A counter or gauge as a Prometheus sample value: bools as 0/1, None for anything not a number."""
+    if isinstance(value, bool):
+        return int(value)
+    return value if isinstance(value, (int, float)) else None
+
+
+def format_prometheus(snapshot):
+    """Renders a snapshot in the Prometheus text exposition format.
+
+    Values that are not numbers are left out, so one bad stats key cannot break the whole scrape.
+    """
+    lines = []
+    for kind, suffix, values in (("counter", "_total", snapshot["counters"]), ("gauge", "", snapshot["gauges"])):
+        for name, value in values.items():
+            value = _sample_value(value)
+            if value is None:
+                continue
+            lines.append(f"# TYPE smartcontrolx_{name}{suffix} {kind}")
+            lines.append(f"smartcontrolx_{name}{suffix} {value}")
+    lines.append("# TYPE smartcontrolx_stage_latency_ms summary")
+    for stage, summary in snapshot["stages"].items():
+        for quantile, key in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99"), ("1", "max")):
+            lines.append(f'smartcontrolx_stage_latency_ms{{stage="{stage}",quantile="{quantile}"}} {summary[key]:.3f}')
+        lines.append(f'smartcontrolx_stage_latency_ms_count{{stage="{stage}"}} {summary["count"]}')
+    return "\n".join(lines) + "\n"
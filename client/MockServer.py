@@ -0,0 +1,365 @@
+import argparse
+import asyncio
+import json
+import random
+import struct
+import threading
+import time
+from collections import deque
+from fractions import Fraction
+
+import av
+import numpy as np
+
+import ControlProtocol as proto
+from ControlProtocol import ControlDecoder
+from H264Parser import iter_nal_units, scan_unit
+from StreamCapture import CaptureReader
+
+# Default ports of the Android server (see DESIGN.md)
+VIDEO_PORT = 8000
+CONTROL_PORT = 8001
+DISCOVERY_PORT = 8002
+
+# Decoded control messages kept for inspection (control_log)
+CONTROL_LOG_SIZE = 1000
+
+# Discovery datagrams (must match AutoDiscovery)
+DISCOVERY_REQUEST = b'SMARTCONTROLX_DISCOVERY_REQUEST'
+DISCOVERY_RESPONSE = b'SMARTCONTROLX_DISCOVERY_RESPONSE'
+
+# Generated test patterns (generate_h264)
+PATTERNS = ('moving', 'dashboard')
+
+
+def generate_h264(width, height, fps=60, bitrate_mbps=8, seconds=5, gop=None, pattern='moving'):
+    """Encodes a test pattern with libx264 and returns one Annex-B access unit per frame.
+
+    'moving' changes most of the picture every frame; 'dashboard' is a static screen where
+    only a small counter changes (a few times a second), like a mirrored status display.
+    """
+    if pattern not in PATTERNS:
+        raise ValueError(f"Unknown pattern: {pattern}")
+    codec = av.CodecContext.create('libx264', 'w')
+    codec.width = width
+    codec.height = height
+    codec.pix_fmt = 'yuv420p'
+    codec.time_base = Fraction(1, fps)
+    codec.framerate = fps
+    codec.bit_rate = int(bitrate_mbps * 1_000_000)
+    # Same shape of stream MediaCodec produces for screen capture: no B-frames, periodic IDR
+    codec.options = {'preset': 'ultrafast', 'tune': 'zerolatency', 'bf': '0', 'g': str(gop or fps)}
+
+    # Gradient background with a moving bar and noise band so the encoder has real work to do
+    rng = np.random.default_rng(0)
+    base = np.zeros((height, width, 3), dtype=np.uint8)
+    base[..., 0] = np.linspace(0, 255, width, dtype=np.uint8)
+    base[..., 2] = np.linspace(0, 255, height, dtype=np.uint8)[:, None]
+    bar = max(8, width // 20)
+
+    units = []
+    for index in range(int(seconds * fps)):
+        image = base.copy()
+        if pattern == 'dashboard':
+            # Counter block in one corner, redrawn 4 times a second
+            value = index * 4 // fps
+            image[bar:2 * bar, bar:bar * (1 + 1 + value % 8)] = 255
+        else:
+            x = (index * bar // 2) % max(1, width - bar)
+            image[:, x:x + bar] = 255
+            band = slice(height // 2, height // 2 + height // 10)
+            image[band] = rng.integers(0, 255, image[band].shape, dtype=np.uint8)
+        frame = av.VideoFrame.from_ndarray(image, format='rgb24')
+        frame.pts = index
+        units.extend(bytes(packet) for packet in codec.encode(frame))
+    units.extend(bytes(packet) for packet in codec.encode(None))
+    return units
+
+
+def load_h264(path):
+    """Reads a recorded stream (raw .h264 or any container) as Annex-B access units."""
+    container = av.open(path)
+    stream = container.streams.video[0]
+    bsf = None
+    if stream.codec_context.extradata and stream.codec_context.extradata[:1] == b'\x01':
+        # MP4/MKV store length-prefixed NAL units; convert to the start-code form the server sends
+        bsf = av.bitstream.BitStreamFilterContext('h264_mp4toannexb', stream)
+    units = []
+    for packet in container.demux(stream):
+        packets = bsf.filter(packet) if bsf else [packet]
+        units.extend(bytes(p) for p in packets if p.size)
+    container.close()
+    return units
+
+
+def split_nal_units(units):
+    """Splits access units into individual NAL units (stresses per-NAL framing on the client)."""
+    return [unit[start:end] for unit in units for _, start, end in iter_nal_units(unit)]
+
+
+class _DiscoveryResponder(asyncio.DatagramProtocol):
+    """Answers discovery requests the way the server's discovery loop does."""
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if data == DISCOVERY_REQUEST:
+            self.transport.sendto(DISCOVERY_RESPONSE, addr)
+
+
+class MockServer:
+    """Local stand-in for the Android server's video and control channels.
+
+    Sends the NDK server's JSON configuration line, then streams the given H.264 units with
+    the same 4-byte big-endian size prefix, answers PIN pairing and echoes ping packets on
+    the control channel. Other control messages are decoded (ControlProtocol.ControlDecoder)
+    and kept in `control_log`; `protocol` is the version advertised at pairing.
+
+    With a `capture` (StreamCapture.CaptureReader) the video channel replays the captured
+    bytes instead: each client connection gets the next captured connection, read by read,
+    at the original receive times (`realtime`) or as fast as the client takes them.
+    """
+
+    def __init__(self, units, host='127.0.0.1', video_port=VIDEO_PORT, control_port=CONTROL_PORT,
+                 fps=60, realtime=True, loops=1, pin='1234', hold_open=False, width=None, height=None,
+                 discovery_port=None, capture=None, jitter=0.0, protocol=proto.PROTOCOL_VERSION):
+        self.units = units
+        self.capture = capture
+        self.next_capture_connection = 0
+        self.host = host
+        self.video_port = video_port
+        self.control_port = control_port
+        self.fps = fps
+        self.realtime = realtime
+        self.jitter = jitter # Realtime: each picture goes out up to this much late (s), in order, like Wi-Fi bursts
+        self.loops = loops
+        self.pin = pin
+        self.protocol = protocol
+        self.width = width
+        self.height = height
+        self.hold_open = hold_open # Keep the video connection open after the stream, like the real server
+        self.discovery_port = discovery_port # Answer discovery requests on this UDP port (None: off)
+        self.discovery_transport = None
+        self.loop = None
+        self.thread = None
+        self.servers = []
+        self.connections = set() # Handler tasks of connected clients
+        self.ready = threading.Event()
+        self.video_finished = threading.Event() # Set once a video client has been sent the whole stream
+
+        # Statistics
+        self.bytes_sent = 0
+        self.units_sent = 0
+        self.pings_echoed = 0
+        self.control_events = 0
+        self.rate_hints = [] # (bitrate kbit/s, max fps, flags) in arrival order
+        self.control_log = deque(maxlen=CONTROL_LOG_SIZE) # Latest other messages: (type, fields)
+        self.control_skipped = 0 # Extended messages of an unknown type or version
+
+    async def start(self):
+        video = await asyncio.start_server(self._handle_video, self.host, self.video_port)
+        control = await asyncio.start_server(self._handle_control, self.host, self.control_port)
+        self.servers = [video, control]
+        # Report the real ports when 0 (ephemeral) was requested
+        self.video_port = video.sockets[0].getsockname()[1]
+        self.control_port = control.sockets[0].getsockname()[1]
+        if self.discovery_port is not None:
+            self.discovery_transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: _DiscoveryResponder(), local_addr=(self.host, self.discovery_port))
+            self.discovery_port = self.discovery_transport.get_extra_info('sockname')[1]
+
+    async def stop(self):
+        if self.discovery_transport:
+            self.discovery_transport.close()
+            self.discovery_transport = None
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        self.servers = []
+        # Closing the listeners leaves accepted connections running; end them too
+        for task in list(self.connections):
+            task.cancel()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+
+    async def _handle_video(self, reader, writer):
+        self._track_connection()
+        if self.capture:
+            return await self._replay_capture(writer)
+        frame_interval = 1.0 / self.fps
+        start = time.perf_counter()
+        frames = 0
+        delays = random.Random(0) # Same jitter pattern on every run
+        picture_starts = [scan_unit(unit)[2] for unit in self.units]
+        try:
+            # Configuration line the NDK server sends before the first NAL unit
+            config = {"width": self.width, "height": self.height, "codec": "H.264"}
+            writer.write(json.dumps(config).encode() + b"\n")
+            for _ in range(self.loops):
+                for unit, picture_start in zip(self.units, picture_starts):
+                    writer.write(struct.pack('>I', len(unit)) + unit)
+                    self.bytes_sent += len(unit) + 4
+                    self.units_sent += 1
+                    await writer.drain()
+                    if self.realtime and picture_start:
+                        # Pace pictures to the target frame rate
+                        frames += 1
+                        delay = start + frames * frame_interval - time.perf_counter()
+                        if self.jitter:
+                            delay += delays.uniform(0, self.jitter)
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+            self.video_finished.set()
+            if self.hold_open:
+                await asyncio.Event().wait() # Until the server is stopped
+        except (ConnectionResetError, BrokenPipeError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _replay_capture(self, writer):
+        index = self.next_capture_connection % len(self.capture.connections)
+        self.next_capture_connection += 1
+        start = time.perf_counter()
+        try:
+            for timestamp, data in self.capture.connection(index):
+                if self.realtime:
+                    delay = start + timestamp - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                writer.write(data)
+                self.bytes_sent += len(data)
+                self.units_sent += 1
+                await writer.drain()
+            self.video_finished.set()
+            # A connection that ended in the capture ends here too (the client reconnects for the next one)
+            if self.hold_open and index == len(self.capture.connections) - 1:
+                await asyncio.Event().wait()
+        except (ConnectionResetError, BrokenPipeError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_control(self, reader, writer):
+        self._track_connection()
+        try:
+            writer.write(proto.pairing_message(self.pin, self.protocol).encode())
+            await writer.drain()
+            await reader.readexactly(4)
+            decoder = ControlDecoder()
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                for message_type, fields in decoder.feed(data):
+                    if message_type == proto.TYPE_PING:
+                        writer.write(proto.PING.pack(proto.TYPE_PING, *fields))
+                        self.pings_echoed += 1
+                    elif message_type == proto.TYPE_RATE:
+                        self.rate_hints.append(fields[:3])
+                    else:
+                        self.control_events += 1
+                        self.control_log.append((message_type, fields))
+                self.control_skipped += decoder.skipped
+                decoder.skipped = 0
+        except (asyncio.IncompleteReadError, ConnectionResetError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    def _track_connection(self):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        task.add_done_callback(self.connections.discard)
+
+    # --- Running on a background thread (for benchmarks) ---
+    def start_in_thread(self):
+        """Starts the server on its own event loop thread and returns once it is listening."""
+        self.thread = threading.Thread(target=self._thread_main, name="SCX-MockServer", daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        return self
+
+    def _thread_main(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.start())
+        self.ready.set()
+        self.loop.run_forever()
+        self.loop.run_until_complete(self.stop())
+        self.loop.close()
+
+    def drop_connections(self):
+        """Thread-safe: cuts every client connection while keeping the listeners up (a Wi-Fi blip)."""
+        def drop():
+            for task in list(self.connections):
+                task.cancel()
+        self.loop.call_soon_threadsafe(drop)
+
+    def stop_thread(self):
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the SmartControlX Android server.")
+    parser.add_argument("--input", help="Recorded H.264 stream (raw .h264, .mp4 or .mkv); generated if omitted")
+    parser.add_argument("--capture", help="Replay a video channel capture (capture_file in settings.json)")
+    parser.add_argument("--size", default="1280x720", help="Generated stream resolution (WxH)")
+    parser.add_argument("--bitrate", type=float, default=8, help="Generated stream bitrate in Mbit/s")
+    parser.add_argument("--fps", type=int, default=60)
+    parser.add_argument("--seconds", type=float, default=10, help="Length of the generated stream")
+    parser.add_argument("--pattern", choices=PATTERNS, default="moving", help="Generated stream content")
+    parser.add_argument("--loops", type=int, default=1000, help="Times the stream is repeated per connection")
+    parser.add_argument("--max-speed", action="store_true", help="Send as fast as the client reads")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Send each picture up to this much late")
+    parser.add_argument("--split-nals", action="store_true", help="Send each NAL unit with its own size prefix")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--discovery-port", type=int, help=f"Answer discovery probes (e.g. {DISCOVERY_PORT})")
+    parser.add_argument("--protocol", type=int, default=proto.PROTOCOL_VERSION,
+                        help="Control protocol version to advertise (1: fixed records only)")
+    args = parser.parse_args()
+
+    capture = None
+    width = height = None
+    if args.capture:
+        try:
+            capture = CaptureReader(args.capture)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        if not capture.connections:
+            parser.error(f"{args.capture} contains no video data")
+        units = []
+        print(f"Replaying {args.capture}: {capture.total_bytes / 1e6:.1f} MB, {len(capture.connections)} "
+              f"connection(s), {capture.duration:.1f} s{' at max speed' if args.max_speed else ''}")
+    elif args.input:
+        units = load_h264(args.input)
+        with av.open(args.input) as container:
+            width, height = container.streams.video[0].width, container.streams.video[0].height
+    else:
+        width, height = (int(v) for v in args.size.lower().split("x"))
+        units = generate_h264(width, height, args.fps, args.bitrate, args.seconds, pattern=args.pattern)
+    if args.split_nals:
+        units = split_nal_units(units)
+
+    async def serve():
+        server = MockServer(units, host=args.host, fps=args.fps, realtime=not args.max_speed, loops=args.loops,
+                            width=width, height=height, discovery_port=args.discovery_port, capture=capture,
+                            jitter=args.jitter_ms / 1000.0, protocol=args.protocol)
+        await server.start()
+        source = "capture" if capture else f"{len(units)} units"
+        print(f"Mock server: video on {args.host}:{server.video_port}, control on {args.host}:{server.control_port} "
+              f"({source}, PIN {server.pin})")
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
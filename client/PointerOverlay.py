@@ -0,0 +1,364 @@
+import time
+from collections import deque
+
+from PyQt6.QtCore import QEvent, QPointF, QRect, QRectF, Qt, QTimer
+from PyQt6.QtGui import QColor, QEventPoint, QPen
+
+from ControlProtocol import ACTION_CANCEL, ACTION_DOWN, ACTION_MOVE, ACTION_UP
+from TouchInput import PINCH_RAMP, PINCH_STEP, EventClock, PinchSynthesizer
+
+TOUCH_EVENTS = (QEvent.Type.TouchBegin, QEvent.Type.TouchUpdate, QEvent.Type.TouchEnd, QEvent.Type.TouchCancel)
+# Touch point states that are sent (stationary fingers are not)
+TOUCH_ACTIONS = {
+    QEventPoint.State.Pressed: ACTION_DOWN,
+    QEventPoint.State.Updated: ACTION_MOVE,
+    QEventPoint.State.Released: ACTION_UP,
+}
+
+# A Ctrl+wheel pinch lifts its fingers this long after the last notch (ms)
+PINCH_IDLE_MS = 250
+
+# Trail points fade out over this long (s); the fade is repainted at about 60 Hz while visible
+TRAIL_DURATION = 0.35
+TRAIL_REPAINT_MS = 16
+MAX_TRAIL_POINTS = 128
+
+CURSOR_RADIUS = 4
+TOUCH_RADIUS = 14
+TRAIL_WIDTH = 4
+TRAIL_COLOR = QColor(80, 170, 255)
+CURSOR_COLOR = QColor(255, 255, 255, 200)
+
+
+class DeviceMapping:
+    """Widget -> device coordinates through the letterbox rectangle the frame is drawn in.
+
+    Built from the rectangle the widget's paint code actually used, so clicks land where the
+    user sees them whatever the window size, device pixel ratio or pre-scaling of the frame.
+    """
+    __slots__ = ('x', 'y', 'width', 'height', 'device_width', 'device_height', 'scale_x', 'scale_y')
+
+    def __init__(self, x, y, width, height, device_width, device_height):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.device_width = device_width
+        self.device_height = device_height
+        self.scale_x = device_width / width
+        self.scale_y = device_height / height
+
+    def contains(self, px, py):
+        return self.x <= px < self.x + self.width and self.y <= py < self.y + self.height
+
+    def to_device(self, px, py):
+        """Device pixel under widget point (px, py), clamped to the screen (for drags leaving the video)."""
+        dx = int((px - self.x) * self.scale_x)
+        dy = int((py - self.y) * self.scale_y)
+        return min(max(dx, 0), self.device_width - 1), min(max(dy, 0), self.device_height - 1)
+
+
+class PointerOverlay:
+    """Local cursor and touch trail drawn over the video straight from Qt input events.
+
+    The remote screen shows the same feedback a full round trip later (control channel,
+    phone, encoder, network, decoder); this one is on screen with the next repaint. Only
+    the area around the pointer is repainted, so the frame itself is not redrawn in full.
+    """
+
+    def __init__(self, widget):
+        self.widget = widget
+        self.position = None # Last pointer position over the video (widget coordinates)
+        self.pressed = False
+        self.trail = deque(maxlen=MAX_TRAIL_POINTS) # (QPointF, time.monotonic())
+        self.fade_timer = QTimer(widget)
+        self.fade_timer.setInterval(TRAIL_REPAINT_MS)
+        self.fade_timer.timeout.connect(self._fade)
+
+    def press(self, point):
+        self.pressed = True
+        self.trail.clear()
+        self._move_to(point)
+
+    def move(self, point):
+        self._move_to(point)
+
+    def release(self, point):
+        self._move_to(point)
+        self.pressed = False
+        self.widget.update(self._dirty_rect())
+
+    def leave(self):
+        if self.position is not None:
+            dirty = self._dirty_rect()
+            self.position = None
+            self.widget.update(dirty)
+
+    def clear(self):
+        self.leave()
+        self.trail.clear()
+        self.fade_timer.stop()
+
+    def _move_to(self, point):
+        dirty = self._dirty_rect()
+        self.position = QPointF(point)
+        if self.pressed:
+            self.trail.append((self.position, time.monotonic()))
+            if not self.fade_timer.isActive():
+                self.fade_timer.start()
+        self.widget.update(dirty.united(self._dirty_rect()))
+
+    def _fade(self):
+        dirty = self._dirty_rect()
+        cutoff = time.monotonic() - TRAIL_DURATION
+        while self.trail and self.trail[0][1] < cutoff:
+            self.trail.popleft()
+        if not self.trail:
+            self.fade_timer.stop()
+        self.widget.update(dirty)
+
+    def _dirty_rect(self):
+        """Widget area covered by the cursor, touch ring and trail."""
+        points = [point for point, _ in self.trail]
+        if self.position is not None:
+            points.append(self.position)
+        if not points:
+            return QRect()
+        margin = TOUCH_RADIUS + TRAIL_WIDTH
+        xs = [point.x() for point in points]
+        ys = [point.y() for point in points]
+        return QRectF(min(xs) - margin, min(ys) - margin,
+                      max(xs) - min(xs) + 2 * margin, max(ys) - min(ys) + 2 * margin).toAlignedRect()
+
+    def paint(self, painter, clip):
+        """Draws the overlay with `painter`, limited to the video rectangle `clip` (QRectF)."""
+        if self.position is None and not self.trail:
+            return
+        painter.save()
+        painter.setRenderHint(painter.RenderHint.Antialiasing)
+        painter.setClipRect(clip)
+        now = time.monotonic()
+        pen = QPen(TRAIL_COLOR, TRAIL_WIDTH, Qt.PenStyle.SolidLine, Qt.PenCapStyle.RoundCap)
+        previous = None
+        for point, stamp in self.trail:
+            if previous is not None:
+                color = QColor(TRAIL_COLOR)
+                color.setAlphaF(max(0.0, 1.0 - (now - stamp) / TRAIL_DURATION))
+                pen.setColor(color)
+                painter.setPen(pen)
+                painter.drawLine(previous, point)
+            previous = point
+        if self.position is not None:
+            if self.pressed:
+                painter.setPen(QPen(TRAIL_COLOR, 2))
+                painter.setBrush(QColor(80, 170, 255, 70))
+                painter.drawEllipse(self.position, TOUCH_RADIUS, TOUCH_RADIUS)
+            painter.setPen(QPen(QColor(0, 0, 0, 160), 1))
+            painter.setBrush(CURSOR_COLOR)
+            painter.drawEllipse(self.position, CURSOR_RADIUS, CURSOR_RADIUS)
+        painter.restore()
+
+
+class PointerInput:
+    """Mouse, touch and gesture handling shared by the video widgets (mixed in ahead of the Qt widget class).
+
+    The widget defines `pointer_event = pyqtSignal(int, int, int, int)` (device x, device y,
+    buttons, action), `touch_event = pyqtSignal(float, object)` (time, TouchSampler points)
+    and `scroll_event = pyqtSignal(float, int, int, int, int)` (time, device x, device y,
+    wheel deltas), calls `_init_pointer_input()` from its constructor and `_set_video_rect()`
+    from its paint code. The device mapping is rebuilt only when the drawn rectangle (resize,
+    pre-scaled frame size) or the device resolution changes.
+
+    Touch screens send their fingers. With `mouse_as_touch`, left-button drags are sent as a
+    finger too; Ctrl+wheel and trackpad pinches become a two-finger pinch (PinchSynthesizer).
+    Times are the events' own, on the time.perf_counter() clock (EventClock).
+    """
+
+    def _init_pointer_input(self, overlay=True, mouse_as_touch=True):
+        self.source_size = (0, 0) # Device (stream) resolution
+        self.video_rect = None # (x, y, width, height) the last frame was drawn in
+        self.mapping = None
+        self.pointer_down = False # A press was sent; moves and the release follow it even outside the video
+        self.overlay = PointerOverlay(self) if overlay else None
+        self.setMouseTracking(overlay) # Hover moves only move the local cursor; nothing is sent
+
+        self.mouse_as_touch = mouse_as_touch
+        self.touch_mouse = False # A left-button drag is being sent as a finger
+        self.touch_primary = None # Touch point the overlay follows
+        self.event_clock = EventClock()
+        self.pinch = PinchSynthesizer()
+        self.pinch_timer = QTimer(self)
+        self.pinch_timer.setSingleShot(True)
+        self.pinch_timer.setInterval(PINCH_IDLE_MS)
+        self.pinch_timer.timeout.connect(self._end_pinch)
+        self.setAttribute(Qt.WidgetAttribute.WA_AcceptTouchEvents)
+
+    def setSourceSize(self, width, height):
+        """Device resolution the video is streamed at (StreamReceiver.stream_size_changed)."""
+        if (width, height) != self.source_size:
+            self.source_size = (width, height)
+            self.mapping = None
+
+    def _set_video_rect(self, x, y, width, height):
+        rect = (x, y, width, height)
+        if rect != self.video_rect:
+            self.video_rect = rect
+            self.mapping = None
+
+    def deviceMapping(self):
+        """The current widget -> device mapping, or None before a frame has been shown."""
+        if self.mapping is None and self.video_rect and self.video_rect[2] > 0 and self.video_rect[3] > 0:
+            device_width, device_height = self.source_size
+            if not device_width:
+                return None
+            self.mapping = DeviceMapping(*self.video_rect, device_width, device_height)
+        return self.mapping
+
+    def _paint_overlay(self, painter):
+        if self.overlay and self.video_rect:
+            self.overlay.paint(painter, QRectF(*self.video_rect))
+
+    def mousePressEvent(self, event):
+        mapping = self.deviceMapping()
+        point = event.position()
+        if mapping is None or not mapping.contains(point.x(), point.y()):
+            return super().mousePressEvent(event) # Letterbox bars: not part of the device screen
+        if self.mouse_as_touch and event.button() == Qt.MouseButton.LeftButton and not self.pointer_down:
+            self.touch_mouse = True
+            if self.overlay:
+                self.overlay.press(point)
+            self._mouse_touch(event, mapping, ACTION_DOWN)
+            return
+        self.pointer_down = True
+        if self.overlay:
+            self.overlay.press(point)
+        self.pointer_event.emit(*mapping.to_device(point.x(), point.y()), event.button().value, ACTION_DOWN)
+
+    def mouseMoveEvent(self, event):
+        mapping = self.deviceMapping()
+        point = event.position()
+        if mapping is None:
+            return super().mouseMoveEvent(event)
+        if self.overlay:
+            if mapping.contains(point.x(), point.y()) or self.overlay.pressed:
+                self.overlay.move(point)
+            else:
+                self.overlay.leave()
+        if self.touch_mouse:
+            self._mouse_touch(event, mapping, ACTION_MOVE)
+        elif self.pointer_down:
+            self.pointer_event.emit(*mapping.to_device(point.x(), point.y()), event.buttons().value, ACTION_MOVE)
+
+    def mouseReleaseEvent(self, event):
+        mapping = self.deviceMapping()
+        point = event.position()
+        if self.touch_mouse and event.button() == Qt.MouseButton.LeftButton and mapping is not None:
+            self.touch_mouse = False
+            if self.overlay:
+                self.overlay.release(point)
+            self._mouse_touch(event, mapping, ACTION_UP)
+            return
+        if mapping is None or not self.pointer_down:
+            return super().mouseReleaseEvent(event)
+        if event.buttons() == Qt.MouseButton.NoButton:
+            self.pointer_down = False
+            if self.overlay:
+                self.overlay.release(point)
+        self.pointer_event.emit(*mapping.to_device(point.x(), point.y()), event.button().value, ACTION_UP)
+
+    def leaveEvent(self, event):
+        if self.overlay and not self.overlay.pressed:
+            self.overlay.leave()
+        super().leaveEvent(event)
+
+    def _mouse_touch(self, event, mapping, action):
+        point = event.position()
+        self.touch_event.emit(self.event_clock.time(event.timestamp()),
+                              [('mouse', action, *mapping.to_device(point.x(), point.y()), 1.0)])
+
+    def event(self, event):
+        if event.type() in TOUCH_EVENTS:
+            self._touch(event)
+            return True # Accepted, so Qt does not turn the touch into mouse events as well
+        if event.type() == QEvent.Type.NativeGesture and self._native_gesture(event):
+            return True
+        return super().event(event)
+
+    def _touch(self, event):
+        mapping = self.deviceMapping()
+        if mapping is None:
+            return
+        t = self.event_clock.time(event.timestamp())
+        if event.type() == QEvent.Type.TouchCancel:
+            self.touch_primary = None
+            if self.overlay:
+                self.overlay.clear()
+            self.touch_event.emit(t, [(None, ACTION_CANCEL, 0, 0, 0.0)])
+            return
+        points = []
+        for point in event.points():
+            action = TOUCH_ACTIONS.get(point.state())
+            if action is None:
+                continue
+            position = point.position()
+            if action == ACTION_DOWN and not mapping.contains(position.x(), position.y()):
+                continue # Letterbox bars
+            points.append((point.id(), action, *mapping.to_device(position.x(), position.y()), point.pressure()))
+            if self.overlay:
+                self._overlay_touch(point.id(), action, position)
+        if points:
+            self.touch_event.emit(t, points)
+
+    def _overlay_touch(self, point_id, action, position):
+        if action == ACTION_DOWN:
+            if self.touch_primary is None:
+                self.touch_primary = point_id
+                self.overlay.press(position)
+        elif point_id == self.touch_primary:
+            if action == ACTION_UP:
+                self.touch_primary = None
+                self.overlay.release(position)
+            else:
+                self.overlay.move(position)
+
+    def wheelEvent(self, event):
+        mapping = self.deviceMapping()
+        point = event.position()
+        if mapping is None or not mapping.contains(point.x(), point.y()):
+            return super().wheelEvent(event)
+        t = self.event_clock.time(event.timestamp())
+        x, y = mapping.to_device(point.x(), point.y())
+        delta = event.angleDelta()
+        if event.modifiers() & Qt.KeyboardModifier.ControlModifier:
+            if delta.y():
+                self._zoom(t, x, y, PINCH_STEP ** (delta.y() / 120))
+        else:
+            self.scroll_event.emit(t, x, y, delta.x(), delta.y())
+        event.accept()
+
+    def _native_gesture(self, event):
+        """Trackpad pinch (ZoomNativeGesture); True if handled."""
+        kind = event.gestureType()
+        if kind == Qt.NativeGestureType.ZoomNativeGesture:
+            mapping = self.deviceMapping()
+            point = event.position()
+            if mapping is None or not (self.pinch.active or mapping.contains(point.x(), point.y())):
+                return False
+            self._zoom(self.event_clock.time(event.timestamp()), *mapping.to_device(point.x(), point.y()),
+                       1.0 + event.value(), ramp=0.0) # Continuous already
+            return True
+        if kind == Qt.NativeGestureType.EndNativeGesture and self.pinch.active:
+            self.pinch_timer.stop()
+            self._end_pinch()
+            return True
+        return False
+
+    def _zoom(self, t, x, y, factor, ramp=PINCH_RAMP):
+        if not self.pinch.active:
+            self.touch_event.emit(*self.pinch.begin(t, x, y, *self.source_size))
+        self.touch_event.emit(*self.pinch.zoom(t, factor, ramp))
+        self.pinch_timer.start() # Lifts the fingers once the zooming stops
+
+    def _end_pinch(self):
+        if self.pinch.active:
+            self.touch_event.emit(*self.pinch.end(time.perf_counter()))
@@ -0,0 +1,311 @@
+import multiprocessing
+import queue
+import struct
+import threading
+import time
+import weakref
+from collections import deque
+from multiprocessing import shared_memory
+
+import av
+import numpy as np
+from PyQt6.QtGui import QImage
+
+from Decoder import DEFAULT_PROFILE, create_decoder, hardware_active
+from FrameConverter import FrameConverter, PIXEL_FORMATS, aligned_stride
+
+# Frames the GUI may hold at once: the image shown, the one last painted and one queued in the Qt bridge
+FRAMES_HELD_BY_GUI = 3
+
+# Shared memory frame slots per stream; a slot is reused only after the GUI has dropped its frame.
+# Beyond the GUI's frames: the slot being written and one whose release is on its way back
+DEFAULT_RING_SIZE = FRAMES_HELD_BY_GUI + 2
+
+# While the worker is behind (more pictures waiting), the newest frame is still converted this often (s)
+BEHIND_CONVERT_INTERVAL = 1 / 60
+
+# Pictures sent to the worker but not yet decoded before the receiver skips to the next keyframe
+DEFAULT_MAX_IN_FLIGHT = 64
+
+# Parent -> worker messages (first byte)
+MSG_PICTURE = b'P'     # + PICTURE_HEADER + access unit
+MSG_RELEASE = b'L'     # + RELEASE_HEADER: the GUI no longer references a slot
+MSG_TARGET_SIZE = b'S' # + SIZE_HEADER: display size the frames are scaled to
+MSG_QUIT = b'Q'
+
+# Worker -> parent messages
+MSG_RING = b'R'        # + RING_HEADER + shared memory name
+MSG_FRAME = b'F'       # + FRAME_HEADER + COUNTERS
+MSG_DONE = b'D'        # + COUNTERS (sent when pictures produced no new frame)
+MSG_ERROR = b'E'       # + message
+
+PICTURE_HEADER = struct.Struct('<IB')            # seq, keyframe
+RELEASE_HEADER = struct.Struct('<II')            # ring generation, slot
+SIZE_HEADER = struct.Struct('<ii')               # width, height
+RING_HEADER = struct.Struct('<III')              # generation, slot count, slot size
+FRAME_HEADER = struct.Struct('<IIIIIIIIdd')      # generation, slot, width, height, stride, source width/height,
+                                                 # seq, decoded and converted perf_counter() timestamps
+COUNTERS = struct.Struct('<IIIII')               # pictures done, frames decoded, frames superseded,
+                                                 # decode errors, pictures skipped
+
+
+def _worker_main(commands, results, pixel_format, scaling, ring_size, decoder_settings):
+    """Decoder process: access units in over `commands`, converted frames out through a shared memory ring."""
+    track_seq = hasattr(av.CodecContext, 'copy_opaque')
+    codec, label, check_hwaccel = create_decoder(*decoder_settings, copy_opaque=track_seq)
+    print(f"Decoder process: {label}")
+    converter = FrameConverter(pixel_format, scaling=scaling)
+
+    ring = None
+    generation = 0
+    slot_size = 0
+    free_slots = deque()
+    counters = [0] * 5 # Same order as COUNTERS
+    reported = None
+    skip_to_idr = False
+    latest = None # Newest decoded frame not yet converted: (frame, seq, decoded timestamp)
+    converted_at = 0.0
+
+    try:
+        while True:
+            behind = commands.poll()
+            # Convert only the newest frame, once a slot is free: when caught up, and now and then while behind
+            if latest is not None and (ring is None or free_slots) and (
+                    not behind or time.perf_counter() - converted_at >= BEHIND_CONVERT_INTERVAL):
+                frame, seq, decoded = latest
+                latest = None
+                pixels, width, height = converter.convert(frame)
+                stride = aligned_stride(pixels.shape[1])
+                if stride * height > slot_size:
+                    # First frame or a larger output size: new ring (frames out in the GUI keep the old mapping)
+                    if ring:
+                        ring.close()
+                        ring.unlink()
+                    generation += 1
+                    slot_size = stride * height
+                    ring = shared_memory.SharedMemory(create=True, size=slot_size * ring_size)
+                    free_slots = deque(range(ring_size))
+                    results.send_bytes(MSG_RING + RING_HEADER.pack(generation, ring_size, slot_size) +
+                                       ring.name.encode())
+                slot = free_slots.popleft()
+                target = np.ndarray((height, stride), dtype=np.uint8, buffer=ring.buf, offset=slot * slot_size)
+                np.copyto(target[:, :pixels.shape[1]], pixels)
+                del target # Exported views would keep ring.close() from succeeding
+                results.send_bytes(MSG_FRAME + FRAME_HEADER.pack(
+                    generation, slot, width, height, stride, frame.width, frame.height, seq,
+                    decoded, time.perf_counter()) + COUNTERS.pack(*counters))
+                reported = tuple(counters)
+                converted_at = time.perf_counter()
+            elif not behind and reported != tuple(counters):
+                results.send_bytes(MSG_DONE + COUNTERS.pack(*counters))
+                reported = tuple(counters)
+
+            message = commands.recv_bytes()
+            kind = message[:1]
+            if kind == MSG_PICTURE:
+                seq, keyframe = PICTURE_HEADER.unpack_from(message, 1)
+                counters[0] += 1
+                if skip_to_idr:
+                    if not keyframe:
+                        counters[4] += 1
+                        continue
+                    skip_to_idr = False
+                packet = av.Packet(memoryview(message)[1 + PICTURE_HEADER.size:])
+                if track_seq:
+                    packet.opaque = seq
+                try:
+                    frames = codec.decode(packet)
+                except av.error.InvalidDataError:
+                    counters[3] += 1
+                    skip_to_idr = True
+                    continue
+                if frames:
+                    if check_hwaccel:
+                        check_hwaccel = False
+                        if not hardware_active(codec):
+                            print("Decoder process: hardware device unusable for this stream, decoding in software")
+                    counters[1] += len(frames)
+                    counters[2] += len(frames) - 1 + (latest is not None)
+                    frame = frames[-1]
+                    latest = (frame, frame.opaque if track_seq else seq, time.perf_counter())
+            elif kind == MSG_RELEASE:
+                released_generation, slot = RELEASE_HEADER.unpack_from(message, 1)
+                if released_generation == generation:
+                    free_slots.append(slot)
+            elif kind == MSG_TARGET_SIZE:
+                converter.set_target_size(*SIZE_HEADER.unpack_from(message, 1))
+            elif kind == MSG_QUIT:
+                break
+    except (EOFError, OSError, KeyboardInterrupt):
+        pass # Parent went away
+    except Exception as e:
+        try:
+            results.send_bytes(MSG_ERROR + str(e).encode())
+        except OSError:
+            pass
+    finally:
+        if ring:
+            ring.close()
+            ring.unlink()
+
+
+class ProcessDecoder:
+    """Decodes and converts one stream in a worker process, outside this process's GIL.
+
+    Access units go to the worker over a pipe as raw bytes; converted frames come back in a
+    ring of shared memory slots and are emitted as QImages viewing their slot. A slot is
+    returned to the worker when the last reference to its QImage goes away, so the worker
+    never overwrites a frame the GUI may still paint. Nothing is pickled.
+
+    Messages are written to the pipe by a feeder thread, so neither the network task nor the
+    GUI thread blocks while the worker starts up or catches up. Offers the
+    put_nowait/get_nowait/qsize subset of queue.Queue that StreamReceiver uses.
+    """
+
+    def __init__(self, receiver, pixel_format='rgb24', scaling='smooth', ring_size=DEFAULT_RING_SIZE,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, decoder_settings=('auto', DEFAULT_PROFILE, 0, False)):
+        self.receiver = receiver
+        self.qimage_format = PIXEL_FORMATS[pixel_format][1]
+        self.max_in_flight = max_in_flight
+        self.outbox = queue.SimpleQueue() # Message parts for the feeder thread; None ends it
+        self.seq = 0
+        self.timings = deque() # (seq, FrameTiming) of pictures in flight, when metrics are enabled
+        self.rings = {} # generation -> (SharedMemory, slot size)
+        self.source_size = (0, 0)
+        self.closing = False
+
+        # Worker-side counters, as last reported
+        self.pictures_done = 0
+        self.frames_decoded = 0
+        self.frames_superseded = 0
+        self.decode_errors = 0
+        self.pictures_skipped = 0
+
+        # 'spawn' keeps the worker free of this process's Qt and thread state
+        context = multiprocessing.get_context('spawn')
+        worker_commands, self.commands = context.Pipe(duplex=False)
+        self.results, worker_results = context.Pipe(duplex=False)
+        self.process = context.Process(target=_worker_main, name="SCX-Decoder", daemon=True,
+                                       args=(worker_commands, worker_results, pixel_format, scaling, ring_size,
+                                             decoder_settings))
+        self.process.start()
+        worker_commands.close()
+        worker_results.close()
+        self.feeder = threading.Thread(target=self._feed_commands, name="SCX-DecoderFeed", daemon=True)
+        self.reader = threading.Thread(target=self._read_results, name="SCX-DecoderResults", daemon=True)
+        self.feeder.start()
+        self.reader.start()
+
+    # --- queue.Queue subset ---
+    def put_nowait(self, item):
+        data, keyframe, timing = item
+        # A keyframe is always accepted: it is where the receiver resumes after an overflow
+        if self.seq - self.pictures_done >= self.max_in_flight and not keyframe:
+            raise queue.Full
+        self.seq += 1
+        if timing:
+            timing.packet = time.perf_counter()
+            self.receiver.metrics.observe('network', timing.received, timing.packet)
+            self.timings.append((self.seq, timing))
+        self.outbox.put((MSG_PICTURE, PICTURE_HEADER.pack(self.seq, keyframe), data)) # data: receive buffer view
+
+    def get_nowait(self):
+        raise queue.Empty # Pictures already in the pipe cannot be taken back
+
+    def qsize(self):
+        return self.seq - self.pictures_done
+
+    # ---
+    def set_target_size(self, width, height):
+        self.outbox.put((MSG_TARGET_SIZE, SIZE_HEADER.pack(width, height)))
+
+    def _release(self, generation, slot):
+        if not self.closing:
+            self.outbox.put((MSG_RELEASE, RELEASE_HEADER.pack(generation, slot)))
+
+    def _feed_commands(self):
+        while True:
+            parts = self.outbox.get()
+            if parts is None:
+                break
+            try:
+                self.commands.send_bytes(b''.join(parts))
+            except OSError:
+                break # Worker gone; reported by the reader thread
+
+    def _read_results(self):
+        while True:
+            try:
+                message = self.results.recv_bytes()
+            except (EOFError, OSError):
+                break
+            kind = message[:1]
+            if kind == MSG_FRAME:
+                self._frame_ready(message)
+            elif kind == MSG_DONE:
+                self._update_counters(COUNTERS.unpack_from(message, 1))
+            elif kind == MSG_RING:
+                generation, _, slot_size = RING_HEADER.unpack_from(message, 1)
+                name = message[1 + RING_HEADER.size:].decode()
+                try:
+                    self.rings[generation] = (shared_memory.SharedMemory(name=name), slot_size)
+                except FileNotFoundError:
+                    pass # Already replaced by a newer ring
+            elif kind == MSG_ERROR:
+                self.receiver.status_signal.emit(f"Decoder process error: {message[1:].decode()}")
+        if not self.closing:
+            self.receiver.status_signal.emit("Decoder process exited unexpectedly")
+
+    def _update_counters(self, counters):
+        frames_decoded = counters[1]
+        if self.receiver.metrics:
+            self.receiver.metrics.count('frames_decoded', frames_decoded - self.frames_decoded)
+        (self.pictures_done, self.frames_decoded, self.frames_superseded,
+         self.decode_errors, self.pictures_skipped) = counters
+
+    def _frame_ready(self, message):
+        (generation, slot, width, height, stride, source_width, source_height,
+         seq, decoded, converted) = FRAME_HEADER.unpack_from(message, 1)
+        self._update_counters(COUNTERS.unpack_from(message, 1 + FRAME_HEADER.size))
+        self.source_size = (source_width, source_height)
+
+        timing = None
+        while self.timings and self.timings[0][0] <= seq:
+            timing_seq, timing = self.timings.popleft()
+            if timing_seq != seq:
+                timing = None # That picture produced no frame of its own
+
+        if generation not in self.rings:
+            return
+        ring, slot_size = self.rings[generation]
+        pixels = np.ndarray((height, stride), dtype=np.uint8, buffer=ring.buf, offset=slot * slot_size)
+        weakref.finalize(pixels, self._release, generation, slot) # Fires once the QImage is gone
+        image = QImage(pixels, width, height, stride, self.qimage_format)
+        if timing:
+            timing.decoded = decoded
+            timing.converted = converted
+            self.receiver.metrics.observe('decode', timing.packet, decoded)
+            self.receiver.metrics.observe('convert', decoded, converted)
+        image.timing = timing # Read back by VideoWidget.paintEvent
+        self.receiver._emit_frame(image, timing)
+
+    def close(self):
+        """Stops the worker; shared memory stays mapped until the GUI drops its last frame."""
+        if self.closing:
+            return
+        self.closing = True
+        while True: # Pictures not yet written are dropped rather than decoded on the way out
+            try:
+                self.outbox.get_nowait()
+            except queue.Empty:
+                break
+        self.outbox.put((MSG_QUIT,))
+        self.outbox.put(None)
+        self.feeder.join(timeout=2.0)
+        self.process.join(timeout=2.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.commands.close()
+        if self.reader is not threading.current_thread():
+            self.reader.join(timeout=1.0)
+        self.results.close()
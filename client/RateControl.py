@@ -0,0 +1,197 @@
+import importlib
+import time
+
+# Bounds of the default policy
+DEFAULT_MIN_BITRATE_KBPS = 500
+DEFAULT_MIN_FPS = 10
+
+# Keyframe requests are not repeated more often than this (s); the server needs time to deliver one
+KEYFRAME_REQUEST_INTERVAL = 1.0
+
+
+class LinkSample:
+    """Client-side view of the stream over the last sampling interval."""
+    __slots__ = ('interval', 'throughput_kbps', 'picture_rate', 'queue_depth', 'decode_lag_ms',
+                 'rtt_ms', 'pictures_dropped', 'decode_errors', 'awaiting_keyframe')
+
+    def __init__(self, interval, throughput_kbps, picture_rate, queue_depth, decode_lag_ms, rtt_ms,
+                 pictures_dropped, decode_errors, awaiting_keyframe):
+        self.interval = interval # Seconds covered by this sample
+        self.throughput_kbps = throughput_kbps # Video channel receive rate
+        self.picture_rate = picture_rate # Pictures received per second
+        self.queue_depth = queue_depth # Pictures waiting for the decoder
+        self.decode_lag_ms = decode_lag_ms # How far the decoder is behind the network (queue depth in time)
+        self.rtt_ms = rtt_ms # Latest control channel round-trip time (0 before the first echo)
+        self.pictures_dropped = pictures_dropped # Discarded by overflow or corruption during the interval
+        self.decode_errors = decode_errors # Decode errors during the interval
+        self.awaiting_keyframe = awaiting_keyframe # The decoder cannot continue before the next IDR picture
+
+
+class RateHint:
+    """Rate-control request for the server's encoder (ControlProtocol.TYPE_RATE on the control channel)."""
+    __slots__ = ('bitrate_kbps', 'max_fps', 'request_keyframe')
+
+    def __init__(self, bitrate_kbps, max_fps, request_keyframe=False):
+        self.bitrate_kbps = bitrate_kbps
+        self.max_fps = max_fps
+        self.request_keyframe = request_keyframe
+
+    def __repr__(self):
+        return (f"RateHint({self.bitrate_kbps} kbit/s, {self.max_fps} fps"
+                f"{', keyframe' if self.request_keyframe else ''})")
+
+
+class RatePolicy:
+    """Base class for client-side rate controllers.
+
+    `update(sample)` is called once per sampling interval with a LinkSample and returns a
+    RateHint to send to the server, or None to leave the encoder as it is.
+    """
+
+    def update(self, sample):
+        raise NotImplementedError
+
+
+class AimdRatePolicy(RatePolicy):
+    """Additive-increase/multiplicative-decrease controller with hysteresis.
+
+    The link counts as congested when the RTT rises well above the lowest RTT seen, or when
+    the decoder falls behind or drops pictures. A congested interval cuts the bitrate at once
+    (and the frame rate too if the decoder is the bottleneck). Rates only go back up after
+    `stable_intervals` consecutive clean intervals and at least `hold_time` seconds after the
+    last cut, and in small steps, so the encoder does not oscillate around the limit.
+    """
+
+    def __init__(self, bitrate_kbps, max_fps, min_bitrate_kbps=DEFAULT_MIN_BITRATE_KBPS, min_fps=DEFAULT_MIN_FPS,
+                 decrease=0.7, increase=1.1, stable_intervals=5, hold_time=5.0,
+                 rtt_congested=2.0, rtt_clear=1.3, rtt_margin_ms=20.0, lag_congested_ms=200.0, lag_clear_ms=50.0):
+        self.max_bitrate_kbps = bitrate_kbps
+        self.min_bitrate_kbps = min(min_bitrate_kbps, bitrate_kbps)
+        self.max_fps = max_fps
+        self.min_fps = min(min_fps, max_fps)
+        self.decrease = decrease
+        self.increase = increase
+        self.stable_intervals = stable_intervals
+        self.hold_time = hold_time
+        # Entering congestion needs a clearly worse link than leaving it (hysteresis band in between)
+        self.rtt_congested = rtt_congested
+        self.rtt_clear = rtt_clear
+        self.rtt_margin_ms = rtt_margin_ms # Ignore RTT growth below this on very fast links
+        self.lag_congested_ms = lag_congested_ms
+        self.lag_clear_ms = lag_clear_ms
+
+        self.bitrate_kbps = bitrate_kbps
+        self.fps = max_fps
+        self.base_rtt_ms = None # Lowest RTT seen: the link without queueing
+        self.clean_intervals = 0
+        self.last_decrease = float('-inf')
+        self.last_keyframe_request = float('-inf')
+
+    def update(self, sample):
+        now = time.monotonic()
+        if sample.rtt_ms > 0:
+            self.base_rtt_ms = sample.rtt_ms if self.base_rtt_ms is None else min(self.base_rtt_ms, sample.rtt_ms)
+        base_rtt = self.base_rtt_ms or 0.0
+        rtt_limit = max(base_rtt * self.rtt_congested, base_rtt + self.rtt_margin_ms)
+        network_congested = self.base_rtt_ms is not None and sample.rtt_ms > rtt_limit
+        decoder_congested = sample.decode_lag_ms > self.lag_congested_ms or sample.pictures_dropped > 0
+        clean = (sample.rtt_ms <= max(base_rtt * self.rtt_clear, base_rtt + self.rtt_margin_ms / 2) and
+                 sample.decode_lag_ms <= self.lag_clear_ms and not sample.pictures_dropped and
+                 not sample.decode_errors)
+
+        bitrate, fps = self.bitrate_kbps, self.fps
+        if network_congested or decoder_congested:
+            self.clean_intervals = 0
+            self.last_decrease = now
+            bitrate *= self.decrease
+            if network_congested and sample.throughput_kbps > 0:
+                # What actually arrived is an upper bound for what the link carries right now
+                bitrate = min(bitrate, sample.throughput_kbps * 0.9)
+            if decoder_congested:
+                fps *= self.decrease
+        elif clean:
+            self.clean_intervals += 1
+            if self.clean_intervals >= self.stable_intervals and now - self.last_decrease >= self.hold_time:
+                self.clean_intervals = 0
+                bitrate *= self.increase
+                fps *= self.increase
+        else:
+            self.clean_intervals = 0 # Inside the hysteresis band: hold
+
+        bitrate = int(min(self.max_bitrate_kbps, max(self.min_bitrate_kbps, bitrate)))
+        fps = int(round(min(self.max_fps, max(self.min_fps, fps))))
+        keyframe = ((sample.awaiting_keyframe or sample.decode_errors > 0) and
+                    now - self.last_keyframe_request >= KEYFRAME_REQUEST_INTERVAL)
+        if keyframe:
+            self.last_keyframe_request = now
+
+        if bitrate == self.bitrate_kbps and fps == self.fps and not keyframe:
+            return None
+        self.bitrate_kbps, self.fps = bitrate, fps
+        return RateHint(bitrate, fps, keyframe)
+
+
+# Policies selectable by name in settings.json ("rate_policy"); "module:Class" loads a custom one
+RATE_POLICIES = {
+    'aimd': AimdRatePolicy,
+}
+
+
+def create_policy(name, bitrate_kbps, max_fps):
+    """Returns the policy called `name` ('off' -> None), constructed with the initial encoder settings."""
+    if not name or name == 'off':
+        return None
+    if ':' in name:
+        module_name, class_name = name.split(':', 1)
+        policy_class = getattr(importlib.import_module(module_name), class_name)
+    elif name in RATE_POLICIES:
+        policy_class = RATE_POLICIES[name]
+    else:
+        raise ValueError(f"Unknown rate policy: {name}")
+    return policy_class(bitrate_kbps, max_fps)
+
+
+class RateController:
+    """Samples a receiver/sender pair and forwards its policy's hints to the server.
+
+    `update()` is meant to be called periodically (e.g. from the GUI's stats timer); it
+    only reads counters, so it is cheap and safe from any thread.
+    """
+
+    def __init__(self, receiver, sender, policy):
+        self.receiver = receiver
+        self.sender = sender
+        self.policy = policy
+        self.last_time = None
+        self.last_stats = None
+        self.last_hint = None
+        self.hints_sent = 0
+
+    def update(self):
+        now = time.monotonic()
+        stats = self.receiver.get_pipeline_stats()
+        if self.last_time is None:
+            self.last_time, self.last_stats = now, stats
+            return None
+        interval = max(now - self.last_time, 1e-6)
+        previous = self.last_stats
+        self.last_time, self.last_stats = now, stats
+
+        picture_rate = (stats["pictures_received"] - previous["pictures_received"]) / interval
+        sample = LinkSample(
+            interval=interval,
+            throughput_kbps=(stats["bytes_received"] - previous["bytes_received"]) * 8 / 1000 / interval,
+            picture_rate=picture_rate,
+            queue_depth=stats["queue_depth"],
+            decode_lag_ms=stats["queue_depth"] / picture_rate * 1000 if picture_rate else 0.0,
+            rtt_ms=self.sender.get_ping(),
+            pictures_dropped=stats["pictures_dropped"] - previous["pictures_dropped"],
+            decode_errors=stats["decode_errors"] - previous["decode_errors"],
+            awaiting_keyframe=stats["awaiting_keyframe"],
+        )
+        hint = self.policy.update(sample)
+        if hint:
+            self.sender.send_rate_hint(hint.bitrate_kbps, hint.max_fps, hint.request_keyframe)
+            self.last_hint = hint
+            self.hints_sent += 1
+        return hint
@@ -0,0 +1,34 @@
+import random
+
+# Connection states reported by StreamReceiver and ControlSender (state_changed signal)
+STATE_CONNECTING = 'connecting' # First connection attempt
+STATE_CONNECTED = 'connected' # Streaming / paired
+STATE_RECONNECTING = 'reconnecting' # Connection lost; retrying with backoff
+STATE_DISCONNECTED = 'disconnected' # Stopped, failed to connect, or gave up reconnecting
+
+# First retry after a drop comes almost at once (Wi-Fi roaming blips are short), later ones back off
+DEFAULT_INITIAL_DELAY = 0.05
+DEFAULT_MAX_DELAY = 2.0
+
+# A dropped connection is retried for this long before the client gives up (s)
+DEFAULT_RECONNECT_TIMEOUT = 30.0
+
+
+class Backoff:
+    """Exponential backoff with equal jitter (each delay between half and all of its step), so several
+    clients do not retry in lockstep while the delays still grow."""
+
+    def __init__(self, initial=DEFAULT_INITIAL_DELAY, maximum=DEFAULT_MAX_DELAY, factor=2.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.attempts = 0
+
+    def next_delay(self):
+        """Returns the delay before the next attempt (s)."""
+        ceiling = min(self.maximum, self.initial * self.factor ** self.attempts)
+        self.attempts += 1
+        return random.uniform(ceiling / 2, ceiling)
+
+    def reset(self):
+        self.attempts = 0
@@ -0,0 +1,112 @@
+import av
+import queue
+import threading
+import time
+from fractions import Fraction
+
+from H264Parser import NAL_TYPE_SPS, NAL_TYPE_PPS, iter_nal_units
+
+# Bounded hand-off between the network task and the writer thread (in pictures)
+DEFAULT_QUEUE_SIZE = 512
+
+# MP4/MKV timestamps are written in a 90 kHz clock, the usual H.264 timebase
+TIME_BASE = Fraction(1, 90000)
+
+
+class StreamRecorder:
+    """Remuxes the received H.264 stream into MP4/MKV on a background writer thread.
+
+    No decoding or encoding is involved: the access units assembled by the receiver are
+    stamped with their receive time and written as-is.
+    """
+
+    def __init__(self, filename, width, height, status_signal, queue_size=DEFAULT_QUEUE_SIZE):
+        self.filename = filename
+        self.width = width
+        self.height = height
+        self.status_signal = status_signal
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.awaiting_keyframe = True # A file can only start at an IDR picture
+        self.pictures_dropped = 0
+        self.packets_written = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._writer, name="SCX-Recorder", daemon=True)
+        self.thread.start()
+
+    def push(self, data, keyframe):
+        """Queues one access unit from the network task. Never blocks; drops data if the disk stalls."""
+        if self.awaiting_keyframe:
+            if not keyframe:
+                self.pictures_dropped += 1
+                return
+            self.awaiting_keyframe = False
+        try:
+            self.queue.put_nowait((time.monotonic(), bytes(data), keyframe))
+        except queue.Full:
+            # Writer is behind; skip ahead to the next keyframe so the file stays decodable
+            self.pictures_dropped += 1
+            self.awaiting_keyframe = True
+
+    def stop(self):
+        """Flushes the queued data, closes the file and waits for the writer thread."""
+        if not self.thread:
+            return
+        self.queue.put(None) # Blocking: the sentinel must not be dropped
+        self.thread.join()
+        self.thread = None
+
+    def _writer(self):
+        container = None
+        stream = None
+        first_time = None
+        last_pts = -1
+
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                receive_time, data, keyframe = item
+
+                if container is None:
+                    # Pictures arrive from the first keyframe on, which carries the parameter sets
+                    parameter_sets = {nal_type: data[start:end] for nal_type, start, end in iter_nal_units(data)
+                                      if nal_type in (NAL_TYPE_SPS, NAL_TYPE_PPS)}
+                    container = av.open(self.filename, mode='w')
+                    stream = container.add_stream('h264')
+                    stream.codec_context.width = self.width
+                    stream.codec_context.height = self.height
+                    stream.codec_context.extradata = (_annexb(parameter_sets[NAL_TYPE_SPS]) +
+                                                      _annexb(parameter_sets[NAL_TYPE_PPS]))
+                    stream.time_base = TIME_BASE
+
+                if first_time is None:
+                    first_time = receive_time
+                pts = max(int((receive_time - first_time) / TIME_BASE), last_pts + 1)
+                last_pts = pts
+                packet = av.Packet(data)
+                packet.stream = stream
+                packet.time_base = TIME_BASE
+                packet.pts = packet.dts = pts
+                packet.is_keyframe = keyframe
+                container.mux(packet)
+                self.packets_written += 1
+        except Exception as e:
+            self.status_signal.emit(f"Recording error: {e}")
+        finally:
+            if container:
+                container.close()
+                self.status_signal.emit(f"Recording saved to {self.filename} ({self.packets_written} frames)")
+            else:
+                self.status_signal.emit("Recording stopped before the first keyframe; nothing saved.")
+
+
+def _annexb(nal):
+    """Ensures a NAL unit carries a 4-byte start code (as extradata for the muxer)."""
+    if nal[:4] == b'\x00\x00\x00\x01':
+        return nal
+    if nal[:3] == b'\x00\x00\x01':
+        return b'\x00' + nal
+    return b'\x00\x00\x00\x01' + nal
@@ -0,0 +1,158 @@
+import asyncio
+import concurrent.futures
+import threading
+from collections import deque
+
+from PyQt6.QtCore import QObject, Qt, pyqtSignal
+
+try:
+    import uvloop # Optional: faster event loop (Linux/macOS)
+except ImportError:
+    uvloop = None
+
+# How long stop() waits for cancelled tasks to unwind (s)
+STOP_TIMEOUT = 2.0
+
+
+class ClientRuntime:
+    """One asyncio event loop on its own thread, hosting the client's network tasks.
+
+    The video, control and discovery tasks all run here (StreamReceiver.start(loop),
+    ControlSender.start(loop), AutoDiscovery(runtime=...)). Nothing CPU-heavy runs on the
+    loop: decoding is on the receiver's threads, so control packets go out as soon as they
+    are queued. submit() and call_soon() may be called from any thread; stop() cancels
+    whatever is still running, lets it clean up and closes the loop.
+    """
+
+    def __init__(self, name="SCX-Runtime", use_uvloop=True):
+        self.name = name
+        self.use_uvloop = use_uvloop and uvloop is not None
+        self.loop = None
+        self.thread = None
+
+    @property
+    def loop_type(self):
+        return "uvloop" if self.use_uvloop else "asyncio"
+
+    def start(self):
+        if self.thread is None:
+            self.loop = uvloop.new_event_loop() if self.use_uvloop else asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self.thread.start()
+        return self
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+            # Stopped: cancel the tasks that are left and let their finally blocks run
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+        finally:
+            self.loop.close()
+
+    @property
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def submit(self, coro):
+        """Schedules a coroutine on the loop; returns a concurrent.futures.Future for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call_soon(self, callback, *args):
+        """Runs `callback(*args)` on the loop thread (ignored once the runtime has stopped)."""
+        try:
+            self.loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            pass # Loop already closed
+
+    def wait(self, *futures, timeout=STOP_TIMEOUT):
+        """Waits for submitted tasks (e.g. after cancelling them); a no-op on the loop thread itself."""
+        futures = [future for future in futures if future is not None]
+        if futures and threading.current_thread() is not self.thread:
+            concurrent.futures.wait(futures, timeout)
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        if self.thread is None:
+            return
+        self.call_soon(self.loop.stop)
+        if self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+        self.thread = None
+
+
+class BridgeChannel:
+    """Sending end of a QtBatchBridge channel; has the emit() of the signal it stands in for."""
+    __slots__ = ('bridge', 'handler', 'latest', 'merge')
+
+    def __init__(self, bridge, handler, latest, merge):
+        self.bridge = bridge
+        self.handler = handler
+        self.latest = latest
+        self.merge = merge
+
+    def emit(self, *args):
+        self.bridge._post(self, args)
+
+
+class QtBatchBridge(QObject):
+    """Hands values from worker threads to the GUI thread in batches.
+
+    Only the first post after a delivery wakes the GUI thread (one queued signal); everything
+    posted until the GUI gets to it is handled in that one call. Channels made with
+    `latest=True` keep just their newest value per batch, so a busy GUI never works through
+    frames it could not show anyway; `merge(replaced_args, newer_args)` can carry over what
+    the newer value needs from the one it replaces.
+    """
+    _wake = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.lock = threading.Lock()
+        self.queued = deque() # (channel, args) of ordinary channels, in posting order
+        self.latest = {} # channel -> args of latest-value channels
+        self.scheduled = False
+        self.batches = 0
+        self.delivered = 0
+        self.coalesced = 0 # Latest-value posts replaced before the GUI saw them
+        self._wake.connect(self._deliver, Qt.ConnectionType.QueuedConnection)
+
+    def channel(self, handler, latest=False, merge=None):
+        """Returns an object whose emit(*args) calls `handler(*args)` on the GUI thread."""
+        return BridgeChannel(self, handler, latest, merge)
+
+    def _post(self, channel, args):
+        with self.lock:
+            if channel.latest:
+                replaced = self.latest.get(channel)
+                if replaced is not None:
+                    self.coalesced += 1
+                    if channel.merge:
+                        args = channel.merge(replaced, args)
+                self.latest[channel] = args
+            else:
+                self.queued.append((channel, args))
+            if self.scheduled:
+                return
+            self.scheduled = True
+        self._wake.emit()
+
+    def _deliver(self):
+        with self.lock:
+            queued, self.queued = self.queued, deque()
+            latest, self.latest = self.latest, {}
+            self.scheduled = False
+        self.batches += 1
+        self.delivered += len(queued) + len(latest)
+        for channel, args in queued:
+            channel.handler(*args)
+        for channel, args in latest.items():
+            channel.handler(*args)
+
+    def stats(self):
+        return {"bridge_batches": self.batches, "bridge_delivered": self.delivered,
+                "bridge_coalesced": self.coalesced}
@@ -0,0 +1,435 @@
+import argparse
+import asyncio
+import math
+import os
+import queue
+import sys
+import threading
+from collections import deque
+from PyQt6.QtWidgets import (
+    QApplication, QMainWindow, QWidget, QFrame, QGridLayout, QVBoxLayout, QHBoxLayout,
+    QLineEdit, QPushButton, QLabel, QStatusBar
+)
+from PyQt6.QtCore import QObject, Qt, QTimer, pyqtSignal
+
+from AutoDiscovery import DiscoveryCache, discover
+from Config import ConfigError, load_config
+from FrameDiff import merge_dirty
+from Runtime import ClientRuntime, QtBatchBridge
+from StreamReceiver import StreamReceiver
+from ControlSender import ControlSender
+from RateControl import RateController, create_policy
+from SmartControlX import VideoWidget
+from ControlProtocol import ACTION_DOWN
+
+# Pictures a session may have waiting for the decode pool before it skips to the next keyframe
+DEFAULT_SESSION_QUEUE_SIZE = 8
+
+
+def default_decode_workers():
+    return max(1, min(8, os.cpu_count() or 1))
+
+
+class LoopPool:
+    """A few client runtimes (event loop threads) shared by all sessions (assigned round-robin)."""
+
+    def __init__(self, count=1, use_uvloop=True):
+        self.runtimes = [ClientRuntime(f"SCX-Loop-{index}", use_uvloop).start() for index in range(max(1, count))]
+        self.next = 0
+
+    def assign(self):
+        runtime = self.runtimes[self.next % len(self.runtimes)]
+        self.next += 1
+        return runtime.loop
+
+    def stop(self):
+        for runtime in self.runtimes:
+            runtime.stop()
+
+
+class SessionQueue:
+    """One session's backlog inside a DecodePool.
+
+    Offers the put_nowait/get_nowait/qsize subset of queue.Queue that StreamReceiver uses,
+    so the receiver's overflow handling is the same as with its own decoder thread.
+    """
+
+    def __init__(self, pool, receiver, maxsize):
+        self.pool = pool
+        self.receiver = receiver
+        self.maxsize = maxsize
+        self.items = deque()
+        self.scheduled = False # In the pool's ready queue or being decoded
+        self.busy = False # A pool thread is decoding one of its pictures
+        self.registered = True
+
+    def put_nowait(self, item):
+        self.pool._put(self, item)
+
+    def get_nowait(self):
+        return self.pool._take(self)
+
+    def qsize(self):
+        return len(self.items)
+
+
+class DecodePool:
+    """Decoder threads shared by all sessions, scheduled round-robin between sessions.
+
+    A session's pictures must be decoded in order and by one thread at a time, so a session
+    is either idle, waiting in the ready queue, or being served. A thread decodes one picture
+    per turn and then puts the session back at the end of the ready queue, so one busy stream
+    cannot starve the others. Only the newest decoded picture of a session is converted.
+    """
+
+    def __init__(self, workers=None, queue_size=DEFAULT_SESSION_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.cond = threading.Condition()
+        self.ready = deque()
+        self.running = True
+        self.threads = [threading.Thread(target=self._worker, name=f"SCX-DecodePool-{index}", daemon=True)
+                        for index in range(workers or default_decode_workers())]
+        for thread in self.threads:
+            thread.start()
+
+    def register(self, receiver):
+        return SessionQueue(self, receiver, self.queue_size)
+
+    def unregister(self, receiver):
+        """Drops the receiver's backlog and waits until no pool thread is decoding for it."""
+        session_queue = receiver.picture_queue
+        with self.cond:
+            session_queue.registered = False
+            session_queue.items.clear()
+            if threading.current_thread() not in self.threads:
+                self.cond.wait_for(lambda: not session_queue.busy)
+
+    def _put(self, session_queue, item):
+        with self.cond:
+            if not session_queue.registered:
+                return
+            if len(session_queue.items) >= session_queue.maxsize:
+                raise queue.Full
+            session_queue.items.append(item)
+            if not session_queue.scheduled:
+                session_queue.scheduled = True
+                self.ready.append(session_queue)
+                self.cond.notify()
+
+    def _take(self, session_queue):
+        with self.cond:
+            if not session_queue.items:
+                raise queue.Empty
+            return session_queue.items.popleft()
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.ready or not self.running)
+                if not self.running:
+                    return
+                session_queue = self.ready.popleft()
+                if not session_queue.items or not session_queue.registered:
+                    session_queue.scheduled = False
+                    continue
+                item = session_queue.items.popleft()
+                newer_pending = bool(session_queue.items)
+                session_queue.busy = True
+
+            session_queue.receiver.decode_pooled(item, newer_pending)
+
+            with self.cond:
+                session_queue.busy = False
+                if session_queue.items and session_queue.registered:
+                    self.ready.append(session_queue) # Back of the line: one picture per turn
+                    self.cond.notify()
+                else:
+                    session_queue.scheduled = False
+                self.cond.notify_all() # Wake unregister() waiters
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join(timeout=2.0)
+
+
+class SessionSignals(QObject):
+    """Per-session counterparts of MainWindow's signals, emitted on the GUI thread by the shared bridge."""
+    frame_received = pyqtSignal(object)
+    status_updated = pyqtSignal(str)
+
+
+class DeviceSession:
+    """One connected phone: its receiver, control sender and the signals feeding its tile."""
+
+    def __init__(self, ip, video_port, control_port, decode_pool, config, bridge):
+        self.ip = ip
+        self.status = "Connecting..."
+        self.signals = SessionSignals()
+        self.signals.status_updated.connect(self._set_status)
+        # All sessions' frames and messages reach the GUI thread through one QtBatchBridge
+        frames = bridge.channel(self.signals.frame_received.emit, latest=True, merge=merge_dirty)
+        status = bridge.channel(self.signals.status_updated.emit)
+        self.receiver = StreamReceiver(ip, video_port, frames, status,
+                                       pixel_format=config.frame_pixel_format,
+                                       scaling=config.scaling_quality,
+                                       decode_pool=decode_pool,
+                                       reconnect_timeout=config.reconnect_timeout_s,
+                                       frame_diff=config.frame_diff,
+                                       decoder=config.decoder,
+                                       decoder_profile=config.decoder_profile,
+                                       skip_loop_filter=config.decoder_skip_loop_filter)
+        self.sender = ControlSender(ip, control_port, status,
+                                    ping_interval=config.ping_interval_ms / 1000.0,
+                                    reconnect_timeout=config.reconnect_timeout_s,
+                                    touch_sample_rate=config.touch_sample_rate_hz,
+                                    touch_batch_interval=config.touch_batch_ms / 1000.0)
+        policy = create_policy(config.rate_policy, int(config.target_bitrate_mbps * 1000), config.target_fps)
+        self.rate_controller = RateController(self.receiver, self.sender, policy) if policy else None
+        self.receiver.keyframe_needed.connect(self.sender.request_keyframe)
+
+    def _set_status(self, message):
+        self.status = message
+
+    def start(self, loop):
+        self.receiver.start(loop)
+        self.sender.start(loop)
+
+    def stop(self):
+        self.receiver.stop()
+        self.sender.stop()
+
+    def stats(self):
+        """Called once per second by the window; also drives the session's rate controller."""
+        if self.rate_controller:
+            self.rate_controller.update()
+        rtt = self.sender.get_latency_stats()
+        return dict(self.receiver.get_pipeline_stats(), fps=self.receiver.get_fps(),
+                    rtt_p50_ms=rtt['p50'], rtt_p95_ms=rtt['p95'], connected=self.receiver.is_running)
+
+
+class SessionManager:
+    """Runs many device sessions in one process on shared event loops and a shared decode pool."""
+
+    def __init__(self, config, loops=1, decode_workers=None):
+        self.config = config
+        self.loop_pool = LoopPool(loops, config.use_uvloop)
+        self.bridge = QtBatchBridge() # The manager is created on the GUI thread (SessionWindow)
+        self.decode_pool = DecodePool(decode_workers, config.session_queue_size or DEFAULT_SESSION_QUEUE_SIZE)
+        self.sessions = []
+
+    def add_session(self, ip, video_port=None, control_port=None):
+        session = DeviceSession(ip, video_port or self.config.default_port,
+                                control_port or self.config.control_port, self.decode_pool, self.config,
+                                self.bridge)
+        session.start(self.loop_pool.assign())
+        self.sessions.append(session)
+        return session
+
+    def remove_session(self, session):
+        session.stop()
+        self.sessions.remove(session)
+
+    def stop(self):
+        for session in list(self.sessions):
+            self.remove_session(session)
+        self.decode_pool.stop()
+        self.loop_pool.stop()
+
+
+class SessionTile(QFrame):
+    """Grid cell: a device's video with its stats line underneath."""
+    clicked = pyqtSignal(object)
+
+    def __init__(self, session, parent=None, pointer_overlay=True, mouse_as_touch=True):
+        super().__init__(parent)
+        self.session = session
+        self.setFrameShape(QFrame.Shape.Box)
+        self.set_active(False)
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(2, 2, 2, 2)
+        self.video_widget = VideoWidget(pointer_overlay=pointer_overlay, mouse_as_touch=mouse_as_touch)
+        self.caption = QLabel(session.ip)
+        self.caption.setStyleSheet("font-family: monospace; font-size: 10px; border: none;")
+        layout.addWidget(self.video_widget, 1)
+        layout.addWidget(self.caption)
+
+        session.signals.frame_received.connect(self.video_widget.setImage)
+        self.video_widget.display_size_changed.connect(session.receiver.set_display_size)
+        session.receiver.set_display_size(*self.video_widget.physicalSize())
+        session.receiver.stream_size_changed.connect(self.video_widget.setSourceSize)
+        self.video_widget.pointer_event.connect(self.send_pointer_event)
+        self.video_widget.touch_event.connect(self.send_touch_event)
+        self.video_widget.scroll_event.connect(self.send_scroll_event)
+
+    def set_active(self, active):
+        self.setStyleSheet("SessionTile { border: 1px solid %s; }" % ("#569cd6" if active else "#3c3c3c"))
+
+    def update_stats(self):
+        stats = self.session.stats()
+        if not stats["connected"]:
+            self.caption.setText(f"{self.session.ip} | {self.session.status}")
+            return
+        dropped = stats["pictures_dropped"] + stats["pictures_skipped"] + stats["frames_dropped"]
+        self.caption.setText(f"{self.session.ip} | {stats['fps']:.0f} fps | ping {stats['rtt_p50_ms']:.1f} ms"
+                             f" | q {stats['queue_depth']} | dropped {dropped}")
+
+    def send_pointer_event(self, x, y, buttons, action):
+        """Mouse input on the video goes to this tile's device (and selects the tile)."""
+        if action == ACTION_DOWN:
+            self.clicked.emit(self)
+        if self.session.sender.is_running:
+            self.session.sender.send_mouse_event(x, y, buttons, action)
+
+    def send_touch_event(self, t, points):
+        if any(action == ACTION_DOWN for _, action, _, _, _ in points):
+            self.clicked.emit(self)
+        if self.session.sender.is_running:
+            self.session.sender.send_touch_input(t, points)
+
+    def send_scroll_event(self, t, x, y, delta_x, delta_y):
+        if self.session.sender.is_running:
+            self.session.sender.send_scroll_input(t, x, y, delta_x, delta_y)
+
+    def mousePressEvent(self, event):
+        self.clicked.emit(self)
+        super().mousePressEvent(event)
+
+
+class SessionWindow(QMainWindow):
+    """Tiled view of all device sessions; keyboard input goes to the selected tile, mouse input to the tile under it."""
+
+    def __init__(self, config, devices=(), loops=1, decode_workers=None):
+        super().__init__()
+        self.setWindowTitle("SmartControlX Sessions")
+        self.setGeometry(100, 100, 1280, 800)
+        self.setStyleSheet("background-color: #1e1e1e; color: #d4d4d4;")
+        self.config = config
+        self.manager = SessionManager(config, loops, decode_workers)
+        self.tiles = []
+        self.active_tile = None
+
+        self.central_widget = QWidget()
+        self.setCentralWidget(self.central_widget)
+        self.layout = QVBoxLayout(self.central_widget)
+
+        add_bar = QHBoxLayout()
+        self.ip_input = QLineEdit()
+        self.ip_input.setPlaceholderText("Device IPs (comma or space separated)")
+        self.add_button = QPushButton("Add")
+        self.add_button.clicked.connect(self.add_from_input)
+        self.ip_input.returnPressed.connect(self.add_from_input)
+        add_bar.addWidget(self.ip_input)
+        add_bar.addWidget(self.add_button)
+        self.layout.addLayout(add_bar)
+
+        self.grid = QGridLayout()
+        self.grid.setSpacing(4)
+        self.layout.addLayout(self.grid, 1)
+
+        self.status_bar = QStatusBar()
+        self.setStatusBar(self.status_bar)
+        self.status_label = QLabel("No devices")
+        self.status_bar.addWidget(self.status_label)
+
+        self.stats_timer = QTimer(self)
+        self.stats_timer.timeout.connect(self.update_stats)
+        self.stats_timer.start(1000)
+
+        for device in devices:
+            self.add_device(device)
+
+    def add_from_input(self):
+        for device in self.ip_input.text().replace(",", " ").split():
+            self.add_device(device)
+        self.ip_input.clear()
+
+    def add_device(self, device):
+        """Adds a session for "ip" or "ip:video_port:control_port"."""
+        ip, *ports = device.split(":")
+        session = self.manager.add_session(ip, *(int(port) for port in ports))
+        tile = SessionTile(session, pointer_overlay=self.config.pointer_overlay,
+                           mouse_as_touch=self.config.mouse_as_touch)
+        tile.clicked.connect(self.select_tile)
+        self.tiles.append(tile)
+        self.relayout()
+
+    def relayout(self):
+        for tile in self.tiles:
+            self.grid.removeWidget(tile)
+        columns = max(1, math.ceil(math.sqrt(len(self.tiles))))
+        for index, tile in enumerate(self.tiles):
+            self.grid.addWidget(tile, index // columns, index % columns)
+
+    def select_tile(self, tile):
+        if self.active_tile:
+            self.active_tile.set_active(False)
+        self.active_tile = tile
+        tile.set_active(True)
+
+    def update_stats(self):
+        connected = 0
+        for tile in self.tiles:
+            tile.update_stats()
+            connected += tile.session.receiver.is_running
+        self.status_label.setText(f"{connected}/{len(self.tiles)} devices streaming | "
+                                  f"{len(self.manager.decode_pool.threads)} decode threads")
+
+    # --- Input Event Handling (to the selected device) ---
+    def _active_sender(self):
+        if self.active_tile and self.active_tile.session.sender.is_running:
+            return self.active_tile.session.sender
+        return None
+
+    def keyPressEvent(self, event):
+        sender = self._active_sender()
+        if sender:
+            sender.send_key_event(event.key(), 1)
+
+    def keyReleaseEvent(self, event):
+        sender = self._active_sender()
+        if sender:
+            sender.send_key_event(event.key(), 0)
+
+    def closeEvent(self, event):
+        self.stats_timer.stop()
+        self.manager.stop()
+        event.accept()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive several SmartControlX devices from one client process.")
+    parser.add_argument("devices", nargs="*", help="Device addresses: ip or ip:video_port:control_port")
+    parser.add_argument("--loops", type=int, help="Event loop threads shared by the sessions")
+    parser.add_argument("--decode-workers", type=int, help="Decoder threads shared by the sessions")
+    parser.add_argument("--discover", action="store_true", help="Also add every device that answers discovery")
+    args = parser.parse_args()
+
+    try:
+        config = load_config()
+    except ConfigError as e:
+        sys.exit(str(e))
+
+    devices = list(args.devices or config.devices)
+    if args.discover:
+        found = asyncio.run(discover(config.discovery_port, window=config.discovery_window_s,
+                                     sweep=config.discovery_sweep))
+        cache = DiscoveryCache(config.discovery_cache_file, config.discovery_cache_ttl_s)
+        cache.update(found)
+        cache.save()
+        known = {device.split(':')[0] for device in devices}
+        devices += [device.ip for device in found if device.ip not in known]
+        print(f"Discovered {len(found)} device(s): {', '.join(device.ip for device in found) or 'none'}")
+
+    app = QApplication(sys.argv)
+    window = SessionWindow(config, devices,
+                           loops=args.loops or config.session_loops,
+                           decode_workers=args.decode_workers or config.session_decode_workers or None)
+    window.show()
+    sys.exit(app.exec())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,126 @@
+import argparse
 import sys
-import json
-import asyncio
+
+import StartupProfile
+
+# --profile-startup: time every import from here on (must come before the heavy ones)
+if __name__ == "__main__" and "--profile-startup" in sys.argv:
+    StartupProfile.enable()
+
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QLineEdit, QPushButton, QLabel, QStatusBar
 )
-from PyQt6.QtGui import QImage, QPixmap, QPainter, QKeyEvent, QMouseEvent
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QTimer
+from PyQt6.QtGui import QImage, QPixmap, QPainter, QKeyEvent
+from PyQt6.QtCore import Qt, QRectF, pyqtSignal, QTimer
 
-# Import other client modules (will be created next)
-from StreamReceiver import StreamReceiver
-from ControlSender import ControlSender
-from AutoDiscovery import AutoDiscovery
+# Only light modules are imported up front; the networking/decoding stack (PyAV, numpy, the decode
+# backends, recording), discovery, metrics and the OpenGL renderer are imported when first used.
+from Config import ConfigError, load_config
+from PointerOverlay import PointerInput
+from Reconnect import STATE_CONNECTED, STATE_DISCONNECTED, STATE_RECONNECTING
 
-class VideoWidget(QWidget):
+class VideoWidget(PointerInput, QWidget):
     """A widget that displays video frames."""
-    def __init__(self, parent=None):
+    # Emitted with the widget size in physical pixels so the decoder can scale frames to fit
+    display_size_changed = pyqtSignal(int, int)
+    # Mouse input in device coordinates: x, y, buttons, action (PointerOverlay.ACTION_*)
+    pointer_event = pyqtSignal(int, int, int, int)
+    # Touch and gesture input: time (perf_counter), [(pointer, action, device x, device y, pressure)] (TouchInput)
+    touch_event = pyqtSignal(float, object)
+    # Wheel steps: time, device x, device y, horizontal and vertical delta (Qt angleDelta)
+    scroll_event = pyqtSignal(float, int, int, int, int)
+
+    def __init__(self, parent=None, pointer_overlay=True, mouse_as_touch=True):
         super().__init__(parent)
         self.image = None
+        self.scaled_cache = None # (cache key, scaled image) for frames that do not fit yet
+        self.metrics = None # PipelineMetrics when instrumentation is enabled
+        self.painted_image = None
+        self._init_pointer_input(pointer_overlay, mouse_as_touch)
 
     def setImage(self, image: QImage):
+        dirty = None
+        if image is not None:
+            # Frames arrive in physical pixels; let QPainter map them to logical coordinates
+            image.setDevicePixelRatio(self.devicePixelRatioF())
+            if self.image is not None and image.size() == self.image.size():
+                dirty = getattr(image, 'dirty', None) # Set by StreamReceiver's frame diff
+        elif self.overlay:
+            self.overlay.clear()
         self.image = image
-        self.update() # Trigger a repaint
+        if dirty and self.video_rect and self.source_size[0]:
+            for rect in self._dirty_widget_rects(dirty):
+                self.update(rect) # Qt merges them into one paint event
+        else:
+            self.update() # Trigger a repaint
+
+    def _dirty_widget_rects(self, dirty):
+        """Maps dirty rectangles in source pixels onto the drawn frame (a pixel wider for scaling filters)."""
+        x, y, width, height = self.video_rect
+        scale_x = width / self.source_size[0]
+        scale_y = height / self.source_size[1]
+        for left, top, w, h in dirty:
+            rect = QRectF(x + left * scale_x, y + top * scale_y, w * scale_x, h * scale_y)
+            yield rect.toAlignedRect().adjusted(-1, -1, 1, 1)
+
+    def physicalSize(self):
+        ratio = self.devicePixelRatioF()
+        return int(self.width() * ratio), int(self.height() * ratio)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.scaled_cache = None
+        self.display_size_changed.emit(*self.physicalSize())
 
     def paintEvent(self, event):
         if self.image:
             painter = QPainter(self)
-            # Scale the image to fit the widget while maintaining aspect ratio
-            scaled_image = self.image.scaled(self.size(), Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+            image = self.image
+            size = image.deviceIndependentSize()
+            if size.width() > self.width() + 1 or size.height() > self.height() + 1:
+                # Frame was decoded for a larger widget (e.g. mid-resize); scale it once and
+                # reuse the result until the next frame or resize.
+                key = (image.cacheKey(), self.size())
+                if not self.scaled_cache or self.scaled_cache[0] != key:
+                    scaled = image.scaled(self.size() * image.devicePixelRatio(), Qt.AspectRatioMode.KeepAspectRatio,
+                                          Qt.TransformationMode.FastTransformation)
+                    scaled.setDevicePixelRatio(image.devicePixelRatio())
+                    self.scaled_cache = (key, scaled)
+                image = self.scaled_cache[1]
+                size = image.deviceIndependentSize()
             # Center the image
-            x = (self.width() - scaled_image.width()) // 2
-            y = (self.height() - scaled_image.height()) // 2
-            painter.drawImage(x, y, scaled_image)
+            x = (self.width() - int(size.width())) // 2
+            y = (self.height() - int(size.height())) // 2
+            painter.drawImage(x, y, image)
+            self._set_video_rect(x, y, int(size.width()), int(size.height()))
+            self._paint_overlay(painter)
+
+            if self.metrics:
+                self._record_paint()
+
+    def _record_paint(self):
+        """Reports the first paint of each frame (repaints of the same frame are not counted)."""
+        if self.image is not self.painted_image:
+            self.painted_image = self.image
+            self.metrics.count('frames_painted')
+            timing = getattr(self.image, 'timing', None)
+            if timing:
+                self.metrics.frame_painted(timing)
 
 class MainWindow(QMainWindow):
     """Main application window."""
-    frame_received = pyqtSignal(QImage)
+    frame_received = pyqtSignal(object) # QImage, or av.VideoFrame for the OpenGL renderer
     status_updated = pyqtSignal(str)
 
-    def __init__(self):
+    def __init__(self, config=None):
         super().__init__()
         self.setWindowTitle("SmartControlX Client")
         self.setGeometry(100, 100, 800, 600)
         self.setStyleSheet("background-color: #1e1e1e; color: #d4d4d4;")
 
-        # Load settings
-        with open("settings.json", "r") as f:
-            self.settings = json.load(f)
+        # Settings, parsed and validated once (Config.py)
+        self.config = config or load_config()
 
         # --- UI Components ---
         self.central_widget = QWidget()
@@ -55,7 +129,7 @@ class MainWindow(QMainWindow):
 
         # Top connection bar
         self.connection_bar = QHBoxLayout()
-        self.ip_input = QLineEdit(self.settings.get("default_ip", "192.168.1.1"))
+        self.ip_input = QLineEdit(self.config.default_ip)
         self.ip_input.setPlaceholderText("Enter Android Device IP")
         self.connect_button = QPushButton("Connect")
         self.discover_button = QPushButton("Discover")
@@ -64,114 +138,353 @@ class MainWindow(QMainWindow):
         self.connection_bar.addWidget(self.connect_button)
         self.layout.addLayout(self.connection_bar)
 
-        # Video display
-        self.video_widget = VideoWidget()
-        self.layout.addWidget(self.video_widget, 1) # Give it stretch factor
-
         # Status bar
         self.status_bar = QStatusBar()
         self.setStatusBar(self.status_bar)
         self.status_label = QLabel("Disconnected")
         self.status_bar.addWidget(self.status_label)
 
+        # Pipeline instrumentation (disabled unless configured; costs nothing when off)
+        self.metrics = None
+        self.overlay_sink = None
+        self.video_widget = None
+        if self.config.metrics_enabled:
+            self.setup_metrics()
+
+        # Video display
+        self.use_gl = False
+        self.create_video_widget(self.config.renderer == "opengl")
+
         # --- Networking and Control ---
         self.stream_receiver = None
         self.control_sender = None
+        self.rate_controller = None # Sends rate-control hints to the server ("rate_policy": "off" disables)
+        self.runtime = None # Runtime.ClientRuntime: one event loop for video, control and discovery
+        self.bridge = None # Runtime.QtBatchBridge: frames and status messages from the runtime, batched
+        self.frame_channel = None
+        self.status_channel = None
+        self.replay_server = None # Local MockServer replaying a capture (--replay)
         self.discovery = None
+        self.first_discovered = None # First responder of the running discovery
+        self.discovery_cache = None # Loaded by finish_startup()
         self.is_connected = False
+        self.reconnecting = False # Both channels were connected; at least one is being re-established
         self.is_recording = False
 
         # --- Signal/Slot Connections ---
         self.connect_button.clicked.connect(self.toggle_connection)
         self.discover_button.clicked.connect(self.start_discovery)
-        self.frame_received.connect(self.video_widget.setImage)
         self.status_updated.connect(self.update_status)
 
-        # --- FPS and Ping Timer ---
+        # --- FPS and Ping Timer (runs only while a connection exists) ---
         self.fps_counter = 0
-        self.ping_timer = QTimer(self)
-        self.ping_timer.timeout.connect(self.update_stats)
-        self.ping_timer.start(5000) # Every 5 seconds
+        self.ping_timer = None
+
+    def finish_startup(self):
+        """Startup work that can wait until the window is on screen (called from the event loop)."""
+        with StartupProfile.phase("discovery cache"):
+            from AutoDiscovery import DiscoveryCache
+            self.discovery_cache = DiscoveryCache(self.config.discovery_cache_file,
+                                                  self.config.discovery_cache_ttl_s)
+        StartupProfile.report("window shown")
+        # Frames are paced to the refresh rate of the screen the window is on
+        self.windowHandle().screenChanged.connect(self.screen_changed)
+
+        # Reconnect to the last device straight from the cache; discovery revalidates it in the background
+        last_device = self.discovery_cache.get_last_device()
+        if last_device:
+            self.ip_input.setText(last_device)
+            if self.config.connect_last_device:
+                self.start_connection()
+                self.start_discovery()
+
+    def create_video_widget(self, use_gl):
+        """Creates the OpenGL renderer if requested and available, else the QPainter widget."""
+        GLVideoWidget = None
+        if use_gl:
+            try:
+                from GLVideoWidget import GLVideoWidget
+            except ImportError: # PyQt6 built without QtOpenGL / QtOpenGLWidgets
+                pass
+        if use_gl and (GLVideoWidget is None or not GLVideoWidget.is_supported()):
+            self.update_status("OpenGL renderer unavailable, using QPainter")
+            use_gl = False
+
+        if self.video_widget:
+            self.frame_received.disconnect()
+            self.layout.removeWidget(self.video_widget)
+            self.video_widget.deleteLater()
+
+        self.use_gl = use_gl
+        if use_gl:
+            self.video_widget = GLVideoWidget(pointer_overlay=self.config.pointer_overlay,
+                                              mouse_as_touch=self.config.mouse_as_touch)
+            self.video_widget.renderer_failed.connect(self.gl_renderer_failed)
+            self.video_widget.frameSwapped.connect(self.video_swapped)
+            self.frame_received.connect(self.video_widget.setFrame)
+        else:
+            self.video_widget = VideoWidget(pointer_overlay=self.config.pointer_overlay,
+                                            mouse_as_touch=self.config.mouse_as_touch)
+            self.video_widget.display_size_changed.connect(self.video_resized)
+            self.frame_received.connect(self.video_widget.setImage)
+        self.video_widget.pointer_event.connect(self.send_pointer_event)
+        self.video_widget.touch_event.connect(self.send_touch_event)
+        self.video_widget.scroll_event.connect(self.send_scroll_event)
+        self.layout.addWidget(self.video_widget, 1) # Give it stretch factor
+        self.video_widget.metrics = self.metrics
+        if self.overlay_sink:
+            self.overlay_sink.label.setParent(self.video_widget)
+            self.overlay_sink.label.show()
+
+    def setup_metrics(self):
+        """Creates the metrics registry and the sinks enabled in settings.json."""
+        from Metrics import PipelineMetrics, JsonLinesSink, PrometheusSink, OverlaySink
+
+        self.metrics = PipelineMetrics()
+        if self.config.metrics_jsonl_file:
+            self.metrics.add_sink(JsonLinesSink(self.config.metrics_jsonl_file))
+        if self.config.metrics_prometheus_port:
+            self.metrics.add_sink(PrometheusSink(self.config.metrics_prometheus_port))
+        if self.config.metrics_overlay:
+            self.overlay_sink = OverlaySink(self.central_widget) # Reparented onto the video widget
+            self.metrics.add_sink(self.overlay_sink)
+
+    def gl_renderer_failed(self, reason):
+        """Falls back to the QPainter path if the GL pipeline could not be set up."""
+        self.create_video_widget(False)
+        if self.stream_receiver:
+            self.stream_receiver.frame_output = "qimage"
+            self.stream_receiver.set_display_size(*self.video_widget.physicalSize())
+            self.video_widget.setSourceSize(*self.stream_receiver.stream_size())
+            self.stream_receiver.stream_size_changed.connect(self.video_widget.setSourceSize)
+        self.update_status(f"OpenGL renderer failed ({reason}), using QPainter")
+
+    def clear_video(self):
+        if self.use_gl:
+            self.video_widget.setFrame(None)
+        else:
+            self.video_widget.setImage(None)
 
     def toggle_connection(self):
-        if not self.is_connected:
+        if not self.stream_receiver:
             self.start_connection()
         else:
-            self.stop_connection()
+            self.stop_connection() # Also cancels a connection attempt
 
     def start_connection(self):
+        with StartupProfile.phase("connect"):
+            self._start_connection()
+        StartupProfile.report("connect")
+
+    def ensure_runtime(self):
+        """Starts the client runtime on first use (first connection or discovery)."""
+        if self.runtime is None:
+            from FrameDiff import merge_dirty
+            from Runtime import ClientRuntime, QtBatchBridge
+
+            self.runtime = ClientRuntime(use_uvloop=self.config.use_uvloop).start()
+            self.bridge = QtBatchBridge(self)
+            # Only the newest frame of a batch is shown; it inherits the dirty areas of the ones it replaces
+            self.frame_channel = self.bridge.channel(self.frame_received.emit, latest=True, merge=merge_dirty)
+            self.status_channel = self.bridge.channel(self.status_updated.emit)
+        return self.runtime
+
+    def _start_connection(self):
+        # First use of the networking/decoding stack
+        from StreamReceiver import StreamReceiver
+        from ControlSender import ControlSender
+        from RateControl import RateController, create_policy
+
+        config = self.config
         ip = self.ip_input.text()
-        video_port = self.settings["default_port"]
-        control_port = self.settings["control_port"]
-
+        video_port, control_port = config.default_port, config.control_port
+        if self.replay_server:
+            video_port, control_port = self.replay_server.video_port, self.replay_server.control_port
         self.update_status(f"Connecting to {ip}...")
-        self.connect_button.setEnabled(False)
-
-        # Start the networking threads/tasks
-        self.stream_receiver = StreamReceiver(ip, video_port, self.frame_received, self.status_updated)
-        self.control_sender = ControlSender(ip, control_port, self.status_updated)
-
-        # Start the asyncio event loop in a separate thread
-        self.asyncio_thread = QThread()
-        self.stream_receiver.moveToThread(self.asyncio_thread)
-        self.control_sender.moveToThread(self.asyncio_thread)
-
-        self.asyncio_thread.started.connect(self.stream_receiver.run)
-        self.asyncio_thread.started.connect(self.control_sender.run)
-
-        self.stream_receiver.finished.connect(self.asyncio_thread.quit)
-        self.asyncio_thread.finished.connect(self.asyncio_thread.deleteLater)
-
-        self.asyncio_thread.start()
-
-        # Check connection status after a delay
-        QTimer.singleShot(2000, self.check_initial_connection)
-
-    def check_initial_connection(self):
-        if self.stream_receiver and self.stream_receiver.is_running and self.control_sender and self.control_sender.is_running:
+        self.connect_button.setText("Cancel")
+
+        # Both channels run as tasks on the shared runtime; decoding stays off its loop (pipelined or
+        # process backend), so video work never delays control packets
+        runtime = self.ensure_runtime()
+        self.stream_receiver = StreamReceiver(ip, video_port, self.frame_channel, self.status_channel,
+                                              pipelined=True,
+                                              pixel_format=config.frame_pixel_format,
+                                              scaling=config.scaling_quality,
+                                              frame_output="yuv" if self.use_gl else "qimage",
+                                              metrics=self.metrics,
+                                              decode_backend=config.decode_backend,
+                                              reconnect_timeout=config.reconnect_timeout_s,
+                                              capture_file=config.capture_file or None,
+                                              frame_diff=config.frame_diff,
+                                              decoder=config.decoder,
+                                              decoder_profile=config.decoder_profile,
+                                              decoder_threads=config.decoder_threads,
+                                              skip_loop_filter=config.decoder_skip_loop_filter,
+                                              frame_pacing=config.frame_pacing,
+                                              pacing_buffer_frames=config.pacing_buffer_frames)
+        self.stream_receiver.set_refresh_rate(self.screen().refreshRate())
+        if not self.use_gl:
+            self.stream_receiver.set_display_size(*self.video_widget.physicalSize())
+        self.control_sender = ControlSender(ip, control_port, self.status_channel,
+                                            ping_interval=config.ping_interval_ms / 1000.0,
+                                            reconnect_timeout=config.reconnect_timeout_s,
+                                            touch_sample_rate=config.touch_sample_rate_hz,
+                                            touch_batch_interval=config.touch_batch_ms / 1000.0)
+        policy = create_policy(config.rate_policy, int(config.target_bitrate_mbps * 1000), config.target_fps)
+        self.rate_controller = RateController(self.stream_receiver, self.control_sender, policy) if policy else None
+
+        # Connection state is reported by the channels themselves, including reconnects
+        self.stream_receiver.state_changed.connect(self.connection_state_changed)
+        self.control_sender.state_changed.connect(self.connection_state_changed)
+        # Input is mapped to device pixels, so the widget needs the stream resolution
+        self.stream_receiver.stream_size_changed.connect(self.video_widget.setSourceSize)
+        self.stream_receiver.keyframe_needed.connect(self.control_sender.request_keyframe)
+
+        if self.ping_timer is None:
+            self.ping_timer = QTimer(self)
+            self.ping_timer.timeout.connect(self.update_stats)
+        self.ping_timer.start(1000) # Every second
+
+        self.control_sender.start(runtime.loop)
+        self.stream_receiver.start(runtime.loop)
+
+    def connection_state_changed(self, state):
+        """Combines the state of both channels into the window's connection state."""
+        if not self.stream_receiver or not self.control_sender:
+            return # Already torn down
+        states = (self.stream_receiver.state, self.control_sender.state)
+        if states == (STATE_CONNECTED, STATE_CONNECTED):
+            if not self.is_connected:
+                self.update_status("Connected")
+                if self.discovery_cache:
+                    self.discovery_cache.remember_connection(self.stream_receiver.ip)
+                    self.discovery_cache.save()
             self.is_connected = True
+            self.reconnecting = False
             self.connect_button.setText("Disconnect")
-            self.update_status("Connected")
-        else:
-            self.update_status("Connection Failed")
+        elif STATE_DISCONNECTED in states:
+            failed = not self.is_connected
             self.stop_connection()
-        self.connect_button.setEnabled(True)
+            self.update_status("Connection Failed" if failed else "Connection lost")
+        elif STATE_RECONNECTING in states:
+            self.reconnecting = True
+            self.update_status("Connection lost, reconnecting...")
 
     def stop_connection(self):
         self.is_connected = False
+        self.reconnecting = False
+        self.is_recording = False # The receiver stops its recorder
         if self.stream_receiver:
             self.stream_receiver.stop()
         if self.control_sender:
             self.control_sender.stop()
-        if hasattr(self, "asyncio_thread") and self.asyncio_thread.isRunning():
-            self.asyncio_thread.quit()
-            self.asyncio_thread.wait()
+        if self.stream_receiver and self.control_sender:
+            # Let the cancelled tasks finish (captures and recordings are closed on the way out)
+            self.runtime.wait(self.stream_receiver.main_task, self.control_sender.main_task)
+        self.stream_receiver = None
+        self.control_sender = None
+        self.rate_controller = None
+        if self.ping_timer:
+            self.ping_timer.stop()
 
         self.connect_button.setText("Connect")
         self.connect_button.setEnabled(True)
         self.update_status("Disconnected")
-        self.video_widget.setImage(None) # Clear screen
+        self.clear_video() # Clear screen
+
+    def start_replay(self, filename, realtime=True):
+        """Replays a video channel capture through a local mock server and connects to it (no phone needed)."""
+        from MockServer import MockServer
+        from StreamCapture import CaptureReader
+
+        try:
+            capture = CaptureReader(filename)
+        except (OSError, ValueError) as e:
+            self.update_status(f"Cannot replay {filename}: {e}")
+            return
+        if not capture.connections:
+            self.update_status(f"Cannot replay {filename}: no video data")
+            return
+        self.replay_server = MockServer([], video_port=0, control_port=0, realtime=realtime, hold_open=True,
+                                        capture=capture).start_in_thread()
+        self.ip_input.setText("127.0.0.1")
+        self.start_connection()
+
+    def video_resized(self, width, height):
+        if self.stream_receiver:
+            self.stream_receiver.set_display_size(width, height)
+
+    def video_swapped(self):
+        """GL renderer presented a frame: gives the frame pacer the display's vsync phase."""
+        if self.stream_receiver:
+            self.stream_receiver.display_vsync()
+
+    def screen_changed(self, screen):
+        if self.stream_receiver and screen:
+            self.stream_receiver.set_refresh_rate(screen.refreshRate())
 
     def start_discovery(self):
-        self.update_status("Discovering devices...")
-        self.discovery = AutoDiscovery(self.settings["discovery_port"])
+        from AutoDiscovery import AutoDiscovery
+
+        if self.discovery and self.discovery.is_running:
+            return
+        if not self.stream_receiver:
+            self.update_status("Discovering devices...")
+        self.discover_button.setEnabled(False)
+        self.first_discovered = None
+        self.discovery = AutoDiscovery(self.config.discovery_port, window=self.config.discovery_window_s,
+                                       sweep=self.config.discovery_sweep, runtime=self.ensure_runtime())
         self.discovery.device_found.connect(self.device_discovered)
+        self.discovery.discovery_finished.connect(self.discovery_finished)
         self.discovery.start()
 
     def device_discovered(self, ip):
-        self.update_status(f"Device found at {ip}")
-        self.ip_input.setText(ip)
-        self.discovery.stop()
+        # The first (fastest) responder is filled in at once; a running connection is left alone
+        if not self.stream_receiver and not self.first_discovered:
+            self.update_status(f"Device found at {ip}")
+            self.ip_input.setText(ip)
+        self.first_discovered = self.first_discovered or ip
+
+    def discovery_finished(self, devices):
+        """Stores the responders in the cache (on the GUI thread) and reports the result."""
+        self.discover_button.setEnabled(True)
         self.discovery = None
+        if self.discovery_cache:
+            self.discovery_cache.update(devices)
+            self.discovery_cache.save()
+        if self.stream_receiver:
+            return # Background revalidation while connecting/connected
+        if devices:
+            self.ip_input.setText(devices[0].ip) # Lowest RTT
+            self.update_status(f"Found {len(devices)} device{'s' if len(devices) != 1 else ''}: "
+                               + ", ".join(f"{device.ip} ({device.rtt_ms:.0f} ms)" for device in devices[:4]))
+        else:
+            cached = self.discovery_cache.devices() if self.discovery_cache else []
+            self.update_status("No devices found" + (f", last seen: {cached[0].ip}" if cached else ""))
 
     def update_status(self, message):
         self.status_label.setText(message)
 
     def update_stats(self):
-        if self.is_connected and self.stream_receiver:
+        if self.is_connected and self.stream_receiver and not self.reconnecting:
             fps = self.stream_receiver.get_fps()
-            ping = self.control_sender.get_ping()
-            self.update_status(f"Connected | FPS: {fps:.1f} | Ping: {ping:.1f} ms")
+            rtt = self.control_sender.get_latency_stats()
+            stats = self.stream_receiver.get_pipeline_stats()
+            dropped = stats["pictures_dropped"] + stats["pictures_skipped"] + stats["frames_dropped"]
+            rate = ""
+            if self.rate_controller:
+                self.rate_controller.update()
+                hint = self.rate_controller.last_hint
+                if hint:
+                    rate = f" | Rate: {hint.bitrate_kbps / 1000:.1f} Mbit/s @ {hint.max_fps} fps"
+            static = ""
+            if self.stream_receiver.frame_differ:
+                static = f" | Static: {self.stream_receiver.frame_differ.skipped_fraction * 100:.0f}%"
+            late = f" | Late: {stats['frames_late']}" if self.stream_receiver.frame_pacer else ""
+            self.update_status(f"Connected | FPS: {fps:.1f} | Ping: {rtt['p50']:.1f}/{rtt['p95']:.1f} ms (p50/p95)"
+                               f" | Loss: {rtt['loss'] * 100:.0f}% | Dropped: {dropped}{late}{rate}{static}")
+            if self.metrics:
+                self.metrics.publish(dict(stats, **self.bridge.stats(), rtt_p50_ms=rtt['p50'], rtt_p95_ms=rtt['p95']))
 
     # --- Input Event Handling ---
     def keyPressEvent(self, event: QKeyEvent):
@@ -186,36 +499,63 @@ class MainWindow(QMainWindow):
         if self.is_connected and self.control_sender:
             self.control_sender.send_key_event(event.key(), 0) # 0 for release
 
-    def mousePressEvent(self, event: QMouseEvent):
+    def send_pointer_event(self, x, y, buttons, action):
+        """Mouse input from the video widget, already in device coordinates."""
         if self.is_connected and self.control_sender:
-            self.control_sender.send_mouse_event(event.pos().x(), event.pos().y(), event.button(), 1) # 1 for press
+            self.control_sender.send_mouse_event(x, y, buttons, action)
 
-    def mouseReleaseEvent(self, event: QMouseEvent):
+    def send_touch_event(self, t, points):
+        """Touch and gesture input from the video widget, resampled by the sender."""
         if self.is_connected and self.control_sender:
-            self.control_sender.send_mouse_event(event.pos().x(), event.pos().y(), event.button(), 0) # 0 for release
+            self.control_sender.send_touch_input(t, points)
 
-    def mouseMoveEvent(self, event: QMouseEvent):
+    def send_scroll_event(self, t, x, y, delta_x, delta_y):
         if self.is_connected and self.control_sender:
-            self.control_sender.send_mouse_event(event.pos().x(), event.pos().y(), event.buttons(), 2) # 2 for move
+            self.control_sender.send_scroll_input(t, x, y, delta_x, delta_y)
 
     def toggle_recording(self):
         if not self.is_recording:
             if self.stream_receiver:
-                self.stream_receiver.start_recording("record.mp4")
-                self.is_recording = True
-                self.update_status("Recording started...")
+                # The extension picks the container (.mp4 or .mkv); the H.264 stream is stored as received
+                self.stream_receiver.start_recording(self.config.recording_file)
+                self.is_recording = self.stream_receiver.recorder is not None
         else:
             if self.stream_receiver:
                 self.stream_receiver.stop_recording()
                 self.is_recording = False
-                self.update_status("Recording stopped. Saved to record.mp4")
 
     def closeEvent(self, event):
+        if self.discovery:
+            self.discovery.stop()
         self.stop_connection()
+        if self.runtime:
+            self.runtime.stop()
+        if self.replay_server:
+            self.replay_server.stop_thread()
+        if self.metrics:
+            self.metrics.close()
         event.accept()
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = MainWindow()
-    window.show()
+    parser = argparse.ArgumentParser(description="SmartControlX client.")
+    parser.add_argument("--profile-startup", action="store_true", help="Print import and startup timings")
+    parser.add_argument("--replay", metavar="CAPTURE", help="Replay a video channel capture instead of a phone")
+    parser.add_argument("--max-speed", action="store_true", help="Replay as fast as the client decodes")
+    args, _ = parser.parse_known_args() # The rest is for Qt
+
+    with StartupProfile.phase("QApplication"):
+        app = QApplication(sys.argv)
+    try:
+        with StartupProfile.phase("settings"):
+            config = load_config()
+    except ConfigError as e:
+        sys.exit(str(e))
+    with StartupProfile.phase("window"):
+        window = MainWindow(config)
+        window.show()
+    # Once the window is on screen
+    if args.replay:
+        QTimer.singleShot(0, lambda: window.start_replay(args.replay, realtime=not args.max_speed))
+    else:
+        QTimer.singleShot(0, window.finish_startup)
     sys.exit(app.exec())
@@ -0,0 +1,87 @@
+import builtins
+import contextlib
+import sys
+import time
+
+# Modules listed in a report (the rest are summed into one line)
+REPORT_TOP = 15
+
+_profiler = None
+
+
+class StartupProfiler:
+    """Times every module import and the named startup phases.
+
+    Imports are timed by wrapping builtins.__import__; a module's cost is its own import time
+    without the modules it pulled in (those are charged to themselves), summed per top-level
+    package so e.g. all of numpy shows up as one line.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.imports = {} # top-level package -> seconds spent importing it
+        self.phases = [] # (name, seconds)
+        self.stack = [] # Child import time of the imports in progress
+        self.original_import = builtins.__import__
+
+    def install(self):
+        builtins.__import__ = self._import
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return self.original_import(name, globals, locals, fromlist, level)
+        self.stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self.original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self.stack.pop()
+            if self.stack:
+                self.stack[-1] += elapsed
+            package = name.partition('.')[0]
+            self.imports[package] = self.imports.get(package, 0.0) + elapsed - children
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def report(self, title):
+        """Prints the imports and phases recorded since the last report."""
+        lines = [f"--- Startup profile: {title} ({(time.perf_counter() - self.started) * 1000:.1f} ms "
+                 f"since the profiler started) ---"]
+        imports = sorted(self.imports.items(), key=lambda item: -item[1])
+        lines.append(f"Imports: {sum(self.imports.values()) * 1000:.1f} ms in {len(imports)} packages")
+        for package, seconds in imports[:REPORT_TOP]:
+            lines.append(f"  {seconds * 1000:8.1f} ms  {package}")
+        if len(imports) > REPORT_TOP:
+            rest = sum(seconds for _, seconds in imports[REPORT_TOP:])
+            lines.append(f"  {rest * 1000:8.1f} ms  ({len(imports) - REPORT_TOP} others)")
+        if self.phases:
+            lines.append("Phases (including the imports they triggered):")
+            lines += [f"  {seconds * 1000:8.1f} ms  {name}" for name, seconds in self.phases]
+        print("\n".join(lines), file=sys.stderr)
+        self.imports = {}
+        self.phases = []
+
+
+def enable():
+    """Starts profiling (call before the imports to be measured)."""
+    global _profiler
+    if _profiler is None:
+        _profiler = StartupProfiler()
+        _profiler.install()
+
+
+def phase(name):
+    """Context manager timing one startup step; free when profiling is off."""
+    return _profiler.phase(name) if _profiler else contextlib.nullcontext()
+
+
+def report(title):
+    if _profiler:
+        _profiler.report(title)
@@ -0,0 +1,141 @@
+import mmap
+import queue
+import struct
+import threading
+import time
+
+# Capture file layout:
+#   FILE_HEADER: magic, wall-clock start time (time.time())
+#   records:     RECORD_HEADER (seconds since the capture started, length) + `length` bytes as read from the socket
+# A record of length 0 marks the start of a connection; the bytes of each connection begin with
+# the server's configuration line, exactly as StreamReceiver read them.
+MAGIC = b'SCXCAP01'
+FILE_HEADER = struct.Struct('<8sd')
+RECORD_HEADER = struct.Struct('<dI')
+
+# Writes are collected into blocks of this size before they hit the disk
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+class CaptureWriter:
+    """Captures the raw video channel (every socket read, with its receive time) on a writer thread.
+
+    `write(view)` is called from the network task with a memoryview of the bytes just read.
+    NalStreamProtocol never reuses receive buffers, so the views are queued without copying.
+    """
+
+    def __init__(self, filename, status_signal=None):
+        self.filename = filename
+        self.status_signal = status_signal
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.start_time = None
+        self.bytes_captured = 0
+        self.connections = 0
+        self.failed = False # The file could not be written; further data is ignored
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self.thread = threading.Thread(target=self._writer, args=(time.time(),), name="SCX-Capture", daemon=True)
+        self.thread.start()
+
+    def new_connection(self):
+        self.connections += 1
+        if not self.failed:
+            self.queue.put((time.perf_counter() - self.start_time, None))
+
+    def write(self, view):
+        if self.failed:
+            return
+        self.bytes_captured += len(view)
+        self.queue.put((time.perf_counter() - self.start_time, view))
+
+    def stop(self):
+        """Writes out everything captured so far and closes the file."""
+        if not self.thread:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def _writer(self, wall_start):
+        try:
+            with open(self.filename, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
+                f.write(FILE_HEADER.pack(MAGIC, wall_start))
+                while True:
+                    item = self.queue.get()
+                    if item is None:
+                        break
+                    timestamp, view = item
+                    f.write(RECORD_HEADER.pack(timestamp, len(view) if view is not None else 0))
+                    if view is not None:
+                        f.write(view)
+        except OSError as e:
+            self.failed = True
+            if self.status_signal:
+                self.status_signal.emit(f"Capture to {self.filename} failed: {e}")
+            while self.queue.get() is not None: # Let stop() finish
+                pass
+
+
+class CaptureReader:
+    """A capture file, memory-mapped: reads are served from the page cache, not loaded into RAM.
+
+    Only the record index (timestamp, offset, length) is kept in memory. `connection(i)`
+    yields the reads of the i-th captured connection as (seconds since that connection
+    started, memoryview into the mapping).
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # Empty file
+            self.file.close()
+            raise ValueError(f"{filename} is not a SmartControlX capture")
+        if len(self.map) < FILE_HEADER.size or self.map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{filename} is not a SmartControlX capture")
+        self.wall_start = FILE_HEADER.unpack_from(self.map)[1]
+        self.connections = [] # Per connection: [(timestamp, offset, length), ...]
+        self.total_bytes = 0
+        self._index()
+
+    def _index(self):
+        pos, size = FILE_HEADER.size, len(self.map)
+        while pos + RECORD_HEADER.size <= size:
+            timestamp, length = RECORD_HEADER.unpack_from(self.map, pos)
+            pos += RECORD_HEADER.size
+            if pos + length > size:
+                break # Truncated last record (capture interrupted)
+            if length == 0 or not self.connections:
+                self.connections.append([])
+            if length:
+                self.connections[-1].append((timestamp, pos, length))
+                self.total_bytes += length
+            pos += length
+        self.connections = [records for records in self.connections if records]
+
+    @property
+    def duration(self):
+        if not self.connections:
+            return 0.0
+        return self.connections[-1][-1][0] - self.connections[0][0][0]
+
+    def connection(self, index):
+        records = self.connections[index]
+        first = records[0][0]
+        view = memoryview(self.map)
+        try:
+            for timestamp, offset, length in records:
+                yield timestamp - first, view[offset:offset + length]
+        finally:
+            view.release()
+
+    def close(self):
+        try:
+            self.map.close()
+        except (AttributeError, BufferError):
+            pass # Not mapped, or views still in use (unmapped once they are released)
+        self.file.close()
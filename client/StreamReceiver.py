@@ -1,15 +1,80 @@
 import asyncio
 import av
-import struct
+import queue
+import threading
 import time
 from PyQt6.QtCore import QObject, pyqtSignal, QThread
 from PyQt6.QtGui import QImage
 
+from FramedReader import MAX_NAL_SIZE, SIZE_PREFIX, FramingError, NalStreamProtocol
+from FrameConverter import FrameConverter
+from FrameDiff import FrameDiffer
+from FramePacing import DEFAULT_BUFFER_FRAMES, FramePacer
+from Decoder import DEFAULT_PROFILE, create_decoder, hardware_active
+from Metrics import FrameTiming
+from H264Parser import AccessUnitAssembler
+from Reconnect import (Backoff, DEFAULT_RECONNECT_TIMEOUT, STATE_CONNECTED, STATE_CONNECTING,
+                       STATE_DISCONNECTED, STATE_RECONNECTING)
+
+# Frame outputs: 'qimage' emits RGB QImages (QPainter widget), 'yuv' emits yuv420p av.VideoFrames (GL widget)
+FRAME_OUTPUTS = ('qimage', 'yuv')
+YUV_FORMATS = ('yuv420p', 'yuvj420p')
+
+# Decode backends: 'thread' decodes in this process, 'process' in a worker process with shared memory frames
+DECODE_BACKENDS = ('thread', 'process')
+
+# Default depth of the network -> decoder queue in pipelined mode (in pictures)
+DEFAULT_QUEUE_SIZE = 64
+
+# With backpressure, how often a full decoder queue is checked for room again (s)
+BACKPRESSURE_POLL = 0.001
+
+
+class LatestFrameSlot:
+    """Single-entry mailbox: a newer frame replaces one that was never taken."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if self._item is not None:
+                self.dropped += 1 # Stale frame overwritten before conversion
+            self._item = item
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Blocks until a frame is available. Returns None on timeout or close."""
+        with self._cond:
+            if self._item is None and not self._closed:
+                self._cond.wait(timeout)
+            item, self._item = self._item, None
+            return item
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._item = None
+            self._cond.notify_all()
+
+
 class StreamReceiver(QObject):
     """Handles video stream reception, H.264 decoding, and frame passing to GUI."""
     finished = pyqtSignal()
+    state_changed = pyqtSignal(str) # Reconnect.STATE_* (connecting, connected, reconnecting, disconnected)
+    stream_size_changed = pyqtSignal(int, int) # Device resolution, when the first frame of a new size is shown
+    keyframe_needed = pyqtSignal() # Decoding stopped until the next IDR picture; connect to ControlSender.request_keyframe
 
-    def __init__(self, ip, port, frame_signal, status_signal, parent=None):
+    def __init__(self, ip, port, frame_signal, status_signal, parent=None,
+                 pipelined=False, queue_size=DEFAULT_QUEUE_SIZE, pixel_format='rgb24',
+                 scaling='smooth', frame_output='qimage', metrics=None, max_nal_size=MAX_NAL_SIZE,
+                 decode_pool=None, decode_backend='thread', reconnect_timeout=DEFAULT_RECONNECT_TIMEOUT,
+                 capture_file=None, frame_diff=False, decoder='auto', decoder_profile=DEFAULT_PROFILE,
+                 decoder_threads=0, skip_loop_filter=False, frame_pacing=False,
+                 pacing_buffer_frames=DEFAULT_BUFFER_FRAMES, backpressure=False):
         super().__init__(parent)
         self.ip = ip
         self.port = port
@@ -17,11 +82,80 @@ class StreamReceiver(QObject):
         self.status_signal = status_signal
         self.is_running = False
         self.loop = None
+        self.main_task = None
+        self.max_nal_size = max_nal_size # Larger size prefixes are treated as stream corruption
+        self.protocol = None # NalStreamProtocol of the current connection
+        self.bytes_received = 0 # Over previous connections (the protocol counts the current one)
+        self.capture_file = capture_file # Raw video channel capture for offline replay (StreamCapture.py)
+        self.capture = None
+
+        # A dropped stream is resumed on a new connection for up to reconnect_timeout s (0: never)
+        self.reconnect_timeout = reconnect_timeout
+        self.state = None
+        self.reconnects = 0
+        self.stream_config = {} # Configuration line sent by the server ({"width": ..., "height": ..., "codec": ...})
+        self.emitted_size = (0, 0) # Last size reported through stream_size_changed
+
+        # NAL units -> one access unit (decoder packet) per picture
+        self.assembler = None
+        self.skip_to_idr = False # Set by decode errors; the decoder waits for the next IDR picture
+        self.pictures_skipped = 0
+
+        # Pipelined mode: network task -> picture queue -> decoder thread -> latest-frame slot -> render thread
+        # (with frame pacing the slot is a FramePacer, releasing at most one frame per display refresh)
+        # With a decode pool (multi-device sessions) the queue lives in the pool and its threads decode instead
+        self.pipelined = pipelined and not decode_pool
+        self.decode_pool = decode_pool
+        self.queue_size = queue_size
+        self.picture_queue = decode_pool.register(self) if decode_pool else queue.Queue(maxsize=queue_size)
+        # 0: FFmpeg picks; pooled sessions get their parallelism from the pool
+        self.decoder_threads = 1 if decode_pool else decoder_threads
+        self.frame_pacer = FramePacer(pacing_buffer_frames) if frame_pacing and self.pipelined else None
+        self.frame_slot = self.frame_pacer or LatestFrameSlot()
+        self.decode_thread = None
+        self.render_thread = None
+        self.awaiting_keyframe = False
+        self.pictures_dropped = 0
+        # Benchmarks: a full decoder queue stops the socket reads (and so the sender) instead of dropping
+        # pictures. It blocks the receiver's event loop, so only for a receiver running its own (run())
+        self.backpressure = backpressure
+        self.decode_errors = 0
+        self.frames_emitted = 0
+        self.frames_superseded = 0 # Pool mode: decoded, but a newer picture was already waiting
 
-        # PyAV components
+        # Process mode: the picture queue is a ProcessDecoder created per connection (RGB output only)
+        if decode_backend not in DECODE_BACKENDS:
+            raise ValueError(f"Unsupported decode backend: {decode_backend}")
+        self.decode_backend = decode_backend if frame_output == 'qimage' and not decode_pool else 'thread'
+        if self.decode_backend == 'process':
+            self.pipelined = False # The worker process takes the place of the decoder/render threads
+        self.process_decoder = None
+        self.pixel_format = pixel_format
+        self.scaling = scaling
+        self.display_size = None
+
+        # Optional per-stage instrumentation (None when disabled, so every hook is a single check)
+        self.metrics = metrics
+        self.track_frames = False
+
+        # PyAV components (decoder backend and profile: Decoder.py)
         self.codec = None
-        self.decoder = None
-        self.output_container = None # For recording
+        self.decoder = decoder
+        self.decoder_profile = decoder_profile
+        self.skip_loop_filter = skip_loop_filter
+        self.decoder_label = None
+        self.check_hwaccel = False # A hardware decoder was opened; confirm it is used once frames come out
+        self.recorder = None # Remuxes the received stream to a file on its own thread
+        if frame_output not in FRAME_OUTPUTS:
+            raise ValueError(f"Unsupported frame output: {frame_output}")
+        self.frame_output = frame_output
+        self.converter = FrameConverter(pixel_format, scaling=scaling) # Decoded frame -> QImage without PIL copies
+        # Optional: frames that look like the one on screen are neither converted nor repainted,
+        # partly changed ones carry their dirty rectangles to the widget (not used by the process backend)
+        self.frame_differ = FrameDiffer() if frame_diff and self.decode_backend == 'thread' else None
+        if self.decode_backend == 'process':
+            self.frame_pacer = None # Converted in the worker; paced only by the GUI taking the newest frame
+            self.frame_slot = LatestFrameSlot()
 
         # FPS calculation
         self.frame_count = 0
@@ -34,7 +168,8 @@ class StreamReceiver(QObject):
         asyncio.set_event_loop(self.loop)
         self.is_running = True
         try:
-            self.loop.run_until_complete(self.receive_stream())
+            self.main_task = self.loop.create_task(self.receive_stream())
+            self.loop.run_until_complete(self.main_task)
         except asyncio.CancelledError:
             pass
         finally:
@@ -42,98 +177,400 @@ class StreamReceiver(QObject):
             self.is_running = False
             self.finished.emit()
 
+    def start(self, loop):
+        """Runs the receiver on an event loop already running in another thread (Runtime.ClientRuntime)."""
+        self.loop = loop
+        self.is_running = True
+        self.main_task = asyncio.run_coroutine_threadsafe(self.receive_stream(), loop)
+        self.main_task.add_done_callback(self._task_finished)
+
+    def _task_finished(self, future):
+        self.is_running = False
+        self.finished.emit()
+
     async def receive_stream(self):
         """Asynchronously connects to the video server and processes the stream."""
+        # Initialize H.264 decoder (before connecting: units are handled as soon as they arrive)
+        # Per-frame stage timing needs packet->frame opaque propagation (PyAV 12+)
+        self.track_frames = bool(self.metrics) and hasattr(av.CodecContext, 'copy_opaque')
+        if self.decode_backend == 'thread':
+            self.codec, self.decoder_label, self.check_hwaccel = create_decoder(
+                self.decoder, self.decoder_profile, self.decoder_threads, self.skip_loop_filter,
+                copy_opaque=self.track_frames)
+            self.status_signal.emit(f"Decoder: {self.decoder_label}")
+        self.assembler = AccessUnitAssembler()
+        if self.capture_file:
+            from StreamCapture import CaptureWriter
+
+            self.capture = CaptureWriter(self.capture_file, self.status_signal)
+            self.capture.start()
+        if self.decode_backend == 'process':
+            from ProcessDecoder import ProcessDecoder # multiprocessing/shared memory only when used
+
+            # The worker starts while connecting; pictures arriving before it is up wait in the pipe
+            self.process_decoder = ProcessDecoder(
+                self, self.pixel_format, self.scaling, max_in_flight=self.queue_size,
+                decoder_settings=(self.decoder, self.decoder_profile, self.decoder_threads, self.skip_loop_filter))
+            if self.display_size:
+                self.process_decoder.set_target_size(*self.display_size)
+            self.picture_queue = self.process_decoder
+        if self.pipelined:
+            self._start_workers()
+
+        # Connect, stream until the connection ends, and resume on a new one while it is worth retrying
+        backoff = Backoff()
+        deadline = None
+        self._set_state(STATE_CONNECTING)
         try:
-            reader, writer = await asyncio.open_connection(self.ip, self.port)
-            self.status_signal.emit(f"Video stream connected to {self.ip}:{self.port}")
+            while self.is_running:
+                transport = await self._connect()
+                if transport:
+                    if self.state == STATE_RECONNECTING:
+                        self._resume()
+                    backoff.reset()
+                    deadline = None
+                    self._set_state(STATE_CONNECTED)
+                    await self._receive_until_closed(transport)
+                elif self.state == STATE_CONNECTING:
+                    break # Never connected: wrong address or server not running
+                if not self.is_running or not self.reconnect_timeout:
+                    break
+                now = time.monotonic()
+                if deadline is None:
+                    deadline = now + self.reconnect_timeout
+                elif now >= deadline:
+                    self.status_signal.emit(f"Video stream lost; gave up reconnecting after {self.reconnect_timeout:g} s")
+                    break
+                self._set_state(STATE_RECONNECTING)
+                await asyncio.sleep(backoff.next_delay())
+        finally:
+            self._set_state(STATE_DISCONNECTED)
+        self.stop()
+
+    async def _connect(self):
+        """Opens the video connection; returns the transport, or None if the attempt failed."""
+        previous = self.protocol
+        try:
+            transport, protocol = await self.loop.create_connection(
+                lambda: NalStreamProtocol(self._handle_nal, self._handle_config, self.max_nal_size,
+                                          capture=self.capture),
+                self.ip, self.port)
         except ConnectionRefusedError:
-            self.status_signal.emit(f"Connection refused by server at {self.ip}:{self.port}")
-            return
+            if self.state == STATE_CONNECTING:
+                self.status_signal.emit(f"Connection refused by server at {self.ip}:{self.port}")
+            return None
         except Exception as e:
-            self.status_signal.emit(f"Error connecting video stream: {e}")
+            if self.state == STATE_CONNECTING:
+                self.status_signal.emit(f"Error connecting video stream: {e}")
+            return None
+        if previous:
+            self.bytes_received += previous.bytes_received
+        self.protocol = protocol
+        self.status_signal.emit(f"Video stream connected to {self.ip}:{self.port}")
+        return transport
+
+    async def _receive_until_closed(self, transport):
+        """The protocol parses and dispatches NAL units from its own callbacks until the connection ends."""
+        try:
+            await self.protocol.closed
+            self.status_signal.emit("Video stream disconnected")
+        except ConnectionResetError:
+            self.status_signal.emit("Video stream disconnected (Connection Reset)")
+        except FramingError as e:
+            self.status_signal.emit(f"Video stream corrupt: {e}")
+        except Exception as e:
+            self.status_signal.emit(f"Video stream error: {e}")
+        finally:
+            transport.close()
+
+    def _resume(self):
+        """Continues on a new connection with the same decoder and cached SPS/PPS, from the next IDR."""
+        self.reconnects += 1
+        self.assembler.discard()
+        self.status_signal.emit(f"Video stream resumed (reconnect {self.reconnects})")
+
+    def _set_state(self, state):
+        if state != self.state:
+            self.state = state
+            self.state_changed.emit(state)
+
+    def _handle_config(self, config):
+        """Stores the configuration line the server sends before the first NAL unit."""
+        self.stream_config = config
+        self.status_signal.emit(f"Stream: {config.get('width')}x{config.get('height')} {config.get('codec', '')}")
+
+    def _handle_nal(self, nal_data, received):
+        """Processes one NAL unit (a memoryview into the receive buffer) on the network task."""
+        if not self.is_running:
+            return
+        timing = FrameTiming(received) if self.track_frames else None
+        if self.metrics:
+            self.metrics.count('bytes_received', len(nal_data) + SIZE_PREFIX.size)
+            self.metrics.count('nals_received')
+
+        for picture, keyframe, picture_timing in self.assembler.push(nal_data, timing):
+            # Record the compressed data as received (no decode/encode involved)
+            if self.recorder:
+                self.recorder.push(picture, keyframe)
+
+            # Decode the picture (inline, or hand off to the decoder thread / pool / process)
+            if self.pipelined or self.decode_pool or self.process_decoder:
+                self._enqueue_picture(picture, keyframe, picture_timing)
+            else:
+                for frame in self._decode_picture(picture, keyframe, picture_timing):
+                    self._present_frame(frame)
+
+    def _decode_picture(self, data, keyframe, timing=None):
+        """Decodes one access unit and returns the resulting frames (possibly none)."""
+        if self.skip_to_idr:
+            if not keyframe:
+                self.pictures_skipped += 1
+                return []
+            self.skip_to_idr = False
+        packet = av.Packet(data)
+        if timing:
+            timing.packet = time.perf_counter()
+            self.metrics.observe('network', timing.received, timing.packet)
+            packet.opaque = timing
+        try:
+            frames = self.codec.decode(packet)
+        except av.error.InvalidDataError:
+            # Corrupt data: later pictures would reference it, so resume at the next IDR
+            self.decode_errors += 1
+            self.skip_to_idr = True
+            self.keyframe_needed.emit()
+            return []
+        if self.check_hwaccel and frames:
+            self.check_hwaccel = False
+            if not hardware_active(self.codec):
+                # The device opened but FFmpeg fell back to software for this stream
+                device, rest = self.decoder_label.split(" (hardware)", 1)
+                self.decoder_label = f"software ({device} unusable){rest}"
+                self.status_signal.emit(f"Decoder: {self.decoder_label}")
+        if self.metrics:
+            for frame in frames:
+                self.metrics.count('frames_decoded')
+                frame_timing = getattr(frame, 'opaque', None)
+                if frame_timing:
+                    self.metrics.frame_decoded(frame_timing)
+        return frames
+
+    def _present_frame(self, frame):
+        """Converts a decoded frame for the GUI, records it, and updates the FPS counter."""
+        timing = getattr(frame, 'opaque', None) if self.metrics else None
+        dirty = None
+        if self.frame_differ:
+            changed, dirty = self.frame_differ.compare(frame)
+            if not changed:
+                self._update_fps() # Still a displayed frame, just identical to the last one
+                return
+        if self.frame_output == 'yuv':
+            # GPU renderer uploads the planes itself; only normalise unusual decoder formats
+            if frame.format.name not in YUV_FORMATS:
+                frame = frame.reformat(format='yuv420p')
+                frame.opaque = timing
+            output = frame
+        else:
+            # Convert AVFrame to QImage (shares memory with the converter's buffer ring)
+            output = self.converter.to_qimage(frame)
+            output.timing = timing # Read back by VideoWidget.paintEvent
+            output.dirty = dirty # Source-pixel rectangles VideoWidget repaints (None: everything)
+        if timing:
+            self.metrics.frame_converted(timing)
+        self._emit_frame(output, timing)
+
+    def _emit_frame(self, output, timing=None):
+        """Hands a converted frame to the GUI and updates the FPS counter."""
+        if timing:
+            self.metrics.frame_emitted(timing)
+        size = self.stream_size()
+        if size != self.emitted_size:
+            self.emitted_size = size
+            self.stream_size_changed.emit(*size) # Ahead of the frame, so input maps to the new resolution
+        self.frame_signal.emit(output)
+        self.frames_emitted += 1
+        self._update_fps()
+
+    def _update_fps(self):
+        self.frame_count += 1
+        if time.time() - self.start_time >= 1.0:
+            self.fps = self.frame_count / (time.time() - self.start_time)
+            self.frame_count = 0
+            self.start_time = time.time()
+
+    # --- Pipelined mode ---
+    def _enqueue_picture(self, data, keyframe, timing=None):
+        """Hands an access unit to the decoder thread without ever blocking the socket reader."""
+        if self.awaiting_keyframe:
+            # After an overflow only an IDR picture can be decoded cleanly
+            if not keyframe:
+                self.pictures_dropped += 1
+                return
+            self.awaiting_keyframe = False
+
+        if self.backpressure:
+            while self.is_running:
+                try:
+                    self.picture_queue.put_nowait((data, keyframe, timing))
+                    return
+                except queue.Full:
+                    time.sleep(BACKPRESSURE_POLL)
             return
 
-        # Initialize H.264 decoder
-        self.codec = av.CodecContext.create('h264', 'r')
-        self.codec.thread_type = 'AUTO' # Use multi-threading for decoding
+        try:
+            self.picture_queue.put_nowait((data, keyframe, timing))
+        except queue.Full:
+            # Decoder has fallen behind: discard the backlog instead of letting latency grow
+            while True:
+                try:
+                    self.picture_queue.get_nowait()
+                    self.pictures_dropped += 1
+                except queue.Empty:
+                    break
+            self.awaiting_keyframe = not keyframe
+            if keyframe:
+                self.picture_queue.put_nowait((data, keyframe, timing))
+            else:
+                self.pictures_dropped += 1
+                # Ask for an IDR picture now, so the picture stops for a round trip instead of the rest of the GOP
+                self.keyframe_needed.emit()
 
+    def _start_workers(self):
+        self.decode_thread = threading.Thread(target=self._decode_worker, name="SCX-Decode", daemon=True)
+        self.render_thread = threading.Thread(target=self._render_worker, name="SCX-Render", daemon=True)
+        self.decode_thread.start()
+        self.render_thread.start()
+
+    def _stop_workers(self):
+        """Signals the worker threads to exit and waits for them."""
+        try:
+            self.picture_queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self.frame_slot.close()
+        for thread in (self.decode_thread, self.render_thread):
+            if thread and thread.is_alive() and thread is not threading.current_thread():
+                thread.join(timeout=1.0)
+        self.decode_thread = None
+        self.render_thread = None
+
+    def _decode_worker(self):
+        """Decoder thread: drains the picture queue and publishes frames to the latest-frame slot."""
         while self.is_running:
             try:
-                # 1. Read 4-byte size prefix (network byte order - big endian)
-                size_bytes = await reader.readexactly(4)
-                nal_size = struct.unpack('>I', size_bytes)[0]
-
-                # 2. Read NAL unit data
-                nal_data = await reader.readexactly(nal_size)
-
-                # 3. Decode the frame
-                packet = av.Packet(nal_data)
-                frames = self.codec.decode(packet)
-
-                for frame in frames:
-                    # Convert AVFrame to QImage
-                    img = frame.to_image(format='rgb24')
-                    qimage = QImage(img.tobytes(), img.width, img.height, QImage.Format.Format_RGB888)
-                    self.frame_signal.emit(qimage)
-
-                    # Handle recording
-                    if self.output_container:
-                        for packet in self.output_container.mux(frame):
-                            self.output_container.stream.write(packet)
-
-                    # Update FPS
-                    self.frame_count += 1
-                    if time.time() - self.start_time >= 1.0:
-                        self.fps = self.frame_count / (time.time() - self.start_time)
-                        self.frame_count = 0
-                        self.start_time = time.time()
-
-            except asyncio.IncompleteReadError:
-                self.status_signal.emit("Video stream disconnected (Incomplete Read)")
-                break
-            except ConnectionResetError:
-                self.status_signal.emit("Video stream disconnected (Connection Reset)")
+                item = self.picture_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is None:
                 break
+            try:
+                for frame in self._decode_picture(*item):
+                    self.frame_slot.put(frame)
             except Exception as e:
-                self.status_signal.emit(f"Video stream error: {e}")
-                break
+                self.status_signal.emit(f"Video decode error: {e}")
+                self.decode_errors += 1
 
-        writer.close()
-        await writer.wait_closed()
-        self.stop()
+    def _render_worker(self):
+        """Render thread: converts only the most recent decoded frame and emits it."""
+        while self.is_running:
+            frame = self.frame_slot.get(timeout=0.1)
+            if frame is None:
+                continue
+            started = time.perf_counter()
+            try:
+                self._present_frame(frame)
+            except Exception as e:
+                self.status_signal.emit(f"Video render error: {e}")
+            if self.frame_pacer:
+                self.frame_pacer.frame_rendered(time.perf_counter() - started)
+
+    # --- Decode pool mode ---
+    def decode_pooled(self, item, newer_pending):
+        """Called by a pool thread with this session's next picture; converts it only if it is the newest."""
+        try:
+            for frame in self._decode_picture(*item):
+                if newer_pending:
+                    self.frames_superseded += 1
+                else:
+                    self._present_frame(frame)
+        except Exception as e:
+            self.status_signal.emit(f"Video decode error: {e}")
+            self.decode_errors += 1
+
+    def set_display_size(self, width, height):
+        """Called from the GUI when the video widget is resized (physical pixels)."""
+        self.display_size = (width, height)
+        self.converter.set_target_size(width, height)
+        if self.frame_differ:
+            self.frame_differ.reset() # Frames now come out at a new size; the next one is needed in full
+        if self.process_decoder:
+            self.process_decoder.set_target_size(width, height)
+
+    def set_refresh_rate(self, hz):
+        """Called from the GUI with the refresh rate of the screen the video is shown on."""
+        if self.frame_pacer:
+            self.frame_pacer.set_refresh_rate(hz)
+
+    def display_vsync(self):
+        """Called from the GUI right after the video widget swapped buffers (a vsync, when swaps are throttled)."""
+        if self.frame_pacer:
+            self.frame_pacer.vsync(time.perf_counter())
+
+    def get_pipeline_stats(self):
+        """Returns drop counters for each pipeline stage."""
+        decoder = self.process_decoder
+        return {
+            "pictures_dropped": self.pictures_dropped, # Network -> decoder queue overflow
+            "pictures_skipped": self.pictures_skipped + (self.assembler.pictures_skipped if self.assembler else 0) +
+                                (decoder.pictures_skipped if decoder else 0),
+            # Decoded but superseded before conversion (with frame pacing: another frame was due by the same refresh)
+            "frames_dropped": self.frame_slot.dropped + self.frames_superseded +
+                              (decoder.frames_superseded if decoder else 0),
+            "decode_errors": self.decode_errors + (decoder.decode_errors if decoder else 0),
+            "frames_emitted": self.frames_emitted,
+            # Frame diff: decoded frames identical to the one on screen / repainted only in part
+            "frames_unchanged": self.frame_differ.frames_unchanged if self.frame_differ else 0,
+            "frames_partial": self.frame_differ.frames_partial if self.frame_differ else 0,
+            # Frame pacing: frames shown well after their place in the stream's cadence, current jitter buffer depth
+            "frames_late": self.frame_pacer.late if self.frame_pacer else 0,
+            "pacing_depth": self.frame_pacer.target_depth if self.frame_pacer else 0,
+            "queue_depth": self.picture_queue.qsize(),
+            "awaiting_keyframe": int(self.awaiting_keyframe or self.skip_to_idr), # 0/1: gauges are numbers
+            # Monotonic totals (rates are derived by the caller)
+            "bytes_received": self.bytes_received + (self.protocol.bytes_received if self.protocol else 0),
+            "pictures_received": self.assembler.pictures_released if self.assembler else 0,
+        }
 
     def start_recording(self, filename):
-        """Starts recording the decoded frames to a file."""
-        if self.output_container:
+        """Starts remuxing the received H.264 stream to a file (MP4/MKV by extension)."""
+        if self.recorder:
             self.status_signal.emit("Recording already in progress.")
             return
 
-        try:
-            # Create output container for MP4
-            self.output_container = av.open(filename, mode='w')
-            stream = self.output_container.add_stream('mpeg4', rate=30) # Use mpeg4 for compatibility
-            stream.width = self.codec.width
-            stream.height = self.codec.height
-            stream.pix_fmt = 'yuv420p' # Standard pixel format for video
-            self.status_signal.emit(f"Recording started to {filename}")
-        except Exception as e:
-            self.status_signal.emit(f"Error starting recording: {e}")
-            self.output_container = None
+        width, height = self.stream_size()
+        if not width:
+            self.status_signal.emit("Cannot start recording before video has been received.")
+            return
+
+        from Recorder import StreamRecorder # Loaded on the first recording
+
+        self.recorder = StreamRecorder(filename, width, height, self.status_signal)
+        self.recorder.start()
+        self.status_signal.emit(f"Recording started to {filename} (waiting for next keyframe)")
+
+    def stream_size(self):
+        """Returns the decoded video size, or (0, 0) before the first frame."""
+        if self.process_decoder:
+            return self.process_decoder.source_size
+        if self.codec:
+            return self.codec.width, self.codec.height
+        return 0, 0
 
     def stop_recording(self):
-        """Stops recording and closes the output file."""
-        if self.output_container:
-            try:
-                # Flush stream
-                for packet in self.output_container.mux():
-                    self.output_container.stream.write(packet)
-                self.output_container.close()
-                self.output_container = None
-                self.status_signal.emit("Recording stopped and file saved.")
-            except Exception as e:
-                self.status_signal.emit(f"Error stopping recording: {e}")
-                self.output_container = None
+        """Stops recording; the writer thread flushes and closes the file."""
+        if self.recorder:
+            recorder, self.recorder = self.recorder, None
+            recorder.stop()
 
     def get_fps(self):
         return self.fps
@@ -141,10 +578,27 @@ class StreamReceiver(QObject):
     def stop(self):
         """Stops the receiver and closes resources."""
         self.is_running = False
-        if self.loop:
-            self.loop.call_soon_threadsafe(self.loop.stop)
-        if self.output_container:
+        if self.pipelined:
+            self._stop_workers()
+        if self.decode_pool:
+            self.decode_pool.unregister(self) # Waits for a pool thread that is decoding for us
+        if self.process_decoder:
+            self.process_decoder.close() # Frames still shown keep their shared memory mapped
+        if self.loop and not self.loop.is_closed(): # The loop closes itself when the stream ends
+            # Cancelling the main task ends run_until_complete() cleanly (stopping the loop would abort it)
+            try:
+                self.loop.call_soon_threadsafe(self.main_task.cancel if self.main_task else self.loop.stop)
+            except RuntimeError:
+                pass # Closed since the check
+        if self.recorder:
             self.stop_recording()
+        if self.capture:
+            self.capture.stop()
+            self.status_signal.emit(f"Capture saved to {self.capture_file} "
+                                    f"({self.capture.bytes_captured / 1e6:.1f} MB, {self.capture.connections} connections)")
+            self.capture = None
         if self.codec:
-            self.codec.close()
+            # Older PyAV releases expose close(); newer ones free the context on release
+            if hasattr(self.codec, 'close'):
+                self.codec.close()
             self.codec = None
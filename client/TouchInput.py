@@ -0,0 +1,306 @@
+import time
+from collections import deque
+
+from ControlProtocol import ACTION_CANCEL, ACTION_DOWN, ACTION_MOVE, ACTION_UP
+
+# Finger paths are resampled to this rate (Hz); 0 sends every move as it comes
+DEFAULT_SAMPLE_RATE = 120
+
+# Slowest sample rate (Hz): the touch batch message carries the interval in 16-bit microseconds
+MIN_SAMPLE_RATE = 16
+
+# Samples are sent in batches this often (s), one message per batch
+DEFAULT_BATCH_INTERVAL = 0.016
+
+# Samples are taken this many sample intervals behind the newest input, so each one falls between
+# two real points (interpolated, not guessed) even when the GUI hands events over in bursts
+SAMPLE_DELAY = 2
+
+# Longest batch after a stall (the loop was busy); older samples are not sent
+MAX_BATCH_SAMPLES = 64
+
+# Points kept per finger path (only the last few before the sample grid are needed)
+MAX_PATH_POINTS = 256
+
+# Wire pointer ids (0-255), one per finger down
+MAX_POINTER_ID = 255
+
+# Qt event clock: the mapping may drift later by this much per second (platform and perf_counter clocks differ)
+CLOCK_DRIFT = 1e-3
+
+# Synthesised pinch: distance between the two fingers when they go down (fraction of the shorter
+# screen side), the closest they come (device pixels), the zoom per wheel notch, and the time a
+# zoom step is spread over, so the sampler turns wheel notches into a continuous pinch (s)
+PINCH_SPAN = 0.3
+PINCH_MIN_SPAN = 40
+PINCH_STEP = 1.1
+PINCH_RAMP = 0.05
+
+
+class EventClock:
+    """Maps Qt input event timestamps (ms on the platform's clock) onto time.perf_counter().
+
+    The offset is the smallest difference between when an event was handled and its timestamp,
+    so events the GUI thread got to late keep the time they really happened.
+    """
+
+    def __init__(self):
+        self.offset = None
+        self.updated = 0.0
+
+    def time(self, timestamp_ms):
+        now = time.perf_counter()
+        if not timestamp_ms:
+            return now # Synthesised event without a timestamp
+        offset = now - timestamp_ms / 1000.0
+        if self.offset is None:
+            self.offset = offset
+        else:
+            self.offset = min(offset, self.offset + (now - self.updated) * CLOCK_DRIFT)
+        self.updated = now
+        return timestamp_ms / 1000.0 + self.offset
+
+
+class TrackedPointer:
+    """A finger down: its wire id and the points of its path not sampled yet, as (t, x, y, pressure)."""
+    __slots__ = ('id', 'path')
+
+    def __init__(self, pointer_id, t, x, y, pressure):
+        self.id = pointer_id
+        self.path = deque([(t, x, y, pressure)])
+
+    def add(self, t, x, y, pressure):
+        path = self.path
+        path.append((max(t, path[-1][0]), x, y, pressure)) # Times never go backwards
+        if len(path) > MAX_PATH_POINTS:
+            path.popleft()
+
+    @property
+    def latest(self):
+        _, x, y, pressure = self.path[-1]
+        return self.id, x, y, pressure
+
+    def at(self, t):
+        """Position at time t (linear between the points around it; the last one held after it).
+
+        Sample times only increase, so points before the one preceding t are no longer needed.
+        """
+        path = self.path
+        while len(path) > 1 and path[1][0] <= t:
+            path.popleft()
+        t0, x0, y0, p0 = path[0]
+        if len(path) == 1 or t <= t0:
+            return x0, y0, p0
+        t1, x1, y1, p1 = path[1]
+        f = (t - t0) / (t1 - t0)
+        return round(x0 + (x1 - x0) * f), round(y0 + (y1 - y0) * f), p0 + (p1 - p0) * f
+
+
+class TouchSampler:
+    """Finger paths -> evenly spaced samples, sent in timestamped batches.
+
+    Touch and mouse moves reach the client in bursts: at the input device's rate, and whenever
+    the GUI thread gets round to them. Sent on as they come, a swipe floods the control channel
+    and is replayed on the phone as jerky as it arrived. Instead each pointer's path is recorded
+    with the events' times, and tick() resamples all paths on a fixed grid of `sample_rate`,
+    SAMPLE_DELAY samples behind `now`, sending what is due as one touch batch. Batches in which
+    no finger moved are not sent.
+
+    Putting a finger down, lifting it or cancelling is sent at once (a multi-touch message with
+    every finger down), after the samples up to that moment, so gestures start and end without
+    the delay. Scroll steps between two ticks are summed into one.
+
+    `sink` is the ControlSender (send_multi_touch, send_touch_batch, send_scroll). Not
+    thread-safe; ControlSender drives it under its touch lock.
+    """
+
+    def __init__(self, sink, sample_rate=DEFAULT_SAMPLE_RATE):
+        if 0 < sample_rate < MIN_SAMPLE_RATE:
+            raise ValueError(f"Touch sample rate must be 0 or at least {MIN_SAMPLE_RATE} Hz")
+        self.sink = sink
+        self.interval = 1.0 / sample_rate if sample_rate > 0 else 0.0
+        self.pointers = {} # Key (Qt touch point id, 'mouse', pinch finger) -> TrackedPointer, in order down
+        self.next_sample = 0.0 # Time of the next sample on the grid
+        self.last_sent = [] # Positions of the last sample sent, per pointer
+        self.scroll = None # [x, y, dx, dy] summed since the last tick
+        self.events = 0
+        self.samples_sent = 0
+        self.batches_sent = 0
+
+    @property
+    def active(self):
+        """True while there is anything for tick() to do."""
+        return bool(self.interval) and (bool(self.pointers) or self.scroll is not None)
+
+    def reset(self):
+        """Forgets every finger (the connection was lost; the server dropped them too)."""
+        self.pointers.clear()
+        self.scroll = None
+
+    def update(self, t, points):
+        """Pointer changes at time t (perf_counter s): (key, action, x, y, pressure) in device pixels.
+
+        ACTION_CANCEL (any key) ends the whole gesture.
+        """
+        for key, action, x, y, pressure in points:
+            self.events += 1
+            pointer = self.pointers.get(key)
+            if action == ACTION_DOWN and pointer is None:
+                self._sample_until(t)
+                pointer = TrackedPointer(self._free_id(), t, x, y, pressure)
+                self.pointers[key] = pointer
+                self.sink.send_multi_touch(ACTION_DOWN, pointer.id, self._state())
+                self._restart(t)
+            elif action == ACTION_CANCEL:
+                if self.pointers:
+                    self.sink.send_multi_touch(ACTION_CANCEL, next(iter(self.pointers.values())).id, self._state())
+                    self.pointers.clear()
+                return
+            elif pointer is None:
+                continue # Moves and releases of a finger that went down outside the video
+            elif action == ACTION_UP:
+                pointer.add(t, x, y, pressure)
+                self._sample_until(pointer.path[-1][0])
+                self.sink.send_multi_touch(ACTION_UP, pointer.id, self._state()) # Listed one last time
+                del self.pointers[key]
+                self._restart(t)
+            else:
+                pointer.add(t, x, y, pressure)
+                if not self.interval:
+                    self.sink.send_multi_touch(ACTION_MOVE, pointer.id, self._state())
+
+    def scroll_step(self, t, x, y, delta_x, delta_y):
+        """A wheel step at device pixel x, y; sent on the next tick, added to the steps before it."""
+        if not self.interval:
+            self.sink.send_scroll(x, y, delta_x, delta_y)
+        elif self.scroll is None:
+            self.scroll = [x, y, delta_x, delta_y]
+        else:
+            scroll = self.scroll
+            scroll[0], scroll[1] = x, y
+            scroll[2] += delta_x
+            scroll[3] += delta_y
+
+    def tick(self, now):
+        """Sends the samples due by `now` as one batch, and the summed scroll."""
+        if self.pointers and self.interval:
+            self._sample_until(now - SAMPLE_DELAY * self.interval)
+        if self.scroll is not None:
+            self.sink.send_scroll(*self.scroll)
+            self.scroll = None
+
+    def _free_id(self):
+        used = {pointer.id for pointer in self.pointers.values()}
+        return next(pointer_id for pointer_id in range(MAX_POINTER_ID + 1) if pointer_id not in used)
+
+    def _state(self):
+        return [pointer.latest for pointer in self.pointers.values()]
+
+    def _restart(self, t):
+        """The set of fingers changed (at t, where all of them were just sent): a new grid starts."""
+        self.next_sample = max(t + self.interval, self.next_sample) # Not back over samples already sent
+        self.last_sent = [pointer.latest[1:] for pointer in self.pointers.values()]
+
+    def _sample_until(self, end):
+        if not self.pointers or not self.interval:
+            return
+        interval = self.interval
+        first = self.next_sample
+        if end - first > MAX_BATCH_SAMPLES * interval:
+            first += (int((end - first) / interval) - MAX_BATCH_SAMPLES + 1) * interval
+        pointers = list(self.pointers.values())
+        samples = []
+        t = first
+        while t <= end:
+            for pointer in pointers:
+                samples.append(pointer.at(t))
+            t += interval
+        if not samples:
+            return
+        self.next_sample = t
+        last_sent = self.last_sent
+        count = len(pointers)
+        if all(sample == last_sent[index % count] for index, sample in enumerate(samples)):
+            return # Nobody moved
+        self.last_sent = samples[-count:]
+        self.sink.send_touch_batch(int(first * 1000), round(interval * 1e6),
+                                   [pointer.id for pointer in pointers], samples)
+        self.samples_sent += len(samples) // count
+        self.batches_sent += 1
+
+
+class PinchSynthesizer:
+    """A two-finger pinch for zooming without fingers: Ctrl+wheel and trackpad pinch gestures.
+
+    The fingers go down on either side of the zoom centre, PINCH_SPAN of the screen apart, and
+    move apart or together with each zoom step. Each step returns (t, points) for
+    TouchSampler.update; a `ramp` dates the move that far ahead, so the sampler spreads a wheel
+    notch over that time instead of jumping.
+    """
+    KEYS = (('pinch', 0), ('pinch', 1))
+
+    def __init__(self):
+        self.centre = None # (x, y) while the fingers are down
+        self.span = 0.0
+        self.limits = (0, 0) # Device screen size
+        self.last_time = 0.0 # Of the last step (may be ahead of now, by its ramp)
+
+    @property
+    def active(self):
+        return self.centre is not None
+
+    def begin(self, t, x, y, device_width, device_height):
+        self.centre = (x, y)
+        self.limits = (device_width, device_height)
+        self.span = PINCH_SPAN * min(device_width, device_height)
+        self.last_time = t
+        return t, self._points(ACTION_DOWN)
+
+    def zoom(self, t, factor, ramp=PINCH_RAMP):
+        width, height = self.limits
+        self.span = min(max(self.span * factor, PINCH_MIN_SPAN), max(width, height))
+        self.last_time = max(t + ramp, self.last_time)
+        return self.last_time, self._points(ACTION_MOVE)
+
+    def end(self, t):
+        points = self._points(ACTION_UP)
+        self.centre = None
+        return max(t, self.last_time), points
+
+    def _points(self, action):
+        x, y = self.centre
+        width, height = self.limits
+        half = self.span / 2
+        # Side by side, or one above the other on a portrait screen; clamped to the screen near its edges
+        if width >= height:
+            fingers = [(min(max(round(x + dx), 0), width - 1), y) for dx in (-half, half)]
+        else:
+            fingers = [(x, min(max(round(y + dy), 0), height - 1)) for dy in (-half, half)]
+        return [(key, action, fx, fy, 1.0) for key, (fx, fy) in zip(self.KEYS, fingers)]
+
+
+def swipe(x0, y0, x1, y1, duration, rate=DEFAULT_SAMPLE_RATE, key='swipe'):
+    """Scripted swipe: [(t offset, points)] for TouchSampler.update, at `rate` events per second."""
+    steps = max(int(duration * rate), 1)
+    events = [(0.0, [(key, ACTION_DOWN, x0, y0, 1.0)])]
+    for step in range(1, steps + 1):
+        f = step / steps
+        events.append((f * duration, [(key, ACTION_MOVE, round(x0 + (x1 - x0) * f), round(y0 + (y1 - y0) * f), 1.0)]))
+    events.append((duration, [(key, ACTION_UP, x1, y1, 1.0)]))
+    return events
+
+
+def pinch(x, y, span0, span1, duration, rate=DEFAULT_SAMPLE_RATE):
+    """Scripted horizontal pinch about (x, y) from span0 to span1 pixels apart (zoom in: span1 > span0)."""
+    keys = (('pinch', 0), ('pinch', 1))
+    steps = max(int(duration * rate), 1)
+
+    def fingers(action, span):
+        return [(key, action, round(x + side * span / 2), y, 1.0) for key, side in zip(keys, (-1, 1))]
+
+    events = [(0.0, fingers(ACTION_DOWN, span0))]
+    for step in range(1, steps + 1):
+        f = step / steps
+        events.append((f * duration, fingers(ACTION_MOVE, span0 + (span1 - span0) * f)))
+    events.append((duration, fingers(ACTION_UP, span1)))
+    return events